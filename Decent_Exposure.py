@@ -26,10 +26,8 @@ st.set_page_config(layout="wide")
 
 if 'geolocation_file' not in st.session_state:
     st.toast('geolocation_file not set in st.session_state...')
-    st.session_state.csv_data_files = [f for f in os.listdir(DATA_PATH) if isfile(join(DATA_PATH, f)) and f.endswith('.csv')]
-    st.session_state.geolocation_data = pd.DataFrame(columns=GEOLOCATION_COLUMNS)
-    st.session_state.asset_data = pd.DataFrame(columns=GEOLOCATION_COLUMNS + ASSET_COLUMNS + ['mock_defor'])
-    st.session_state.observation_data = pd.DataFrame(columns=GEOLOCATION_COLUMNS + ASSET_COLUMNS + ['mock_defor'] + OBSERVATION_COLUMNS + ['capacity_norm'])
+    st.session_state.csv_data_files = [f for f in os.listdir(DATA_PATH) if isfile(join(DATA_PATH, f)) and f.endswith(('.csv', '.parquet', '.feather'))]
+    st.session_state.selection = None # see streamlit_app.selected_data
     st.session_state.geolocation_file = None
 
 if 'lat_range' not in st.session_state:
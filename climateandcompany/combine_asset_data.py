@@ -1,17 +1,30 @@
 import pandas as pd
 import numpy as np
 import os
-from flags import PATH_TO_INPUT_FOLDER, PATH_TO_OUTPUT_FOLDER
-
-def combine_asset_datasets(): 
-    df_gem = pd.read_csv("data/loaded_asset/asset_level_open_source_gem.csv")
+from flags import PATH_TO_INPUT_FOLDER, PATH_TO_OUTPUT_FOLDER, TABLE_FORMAT
+from leaf.storage import read_table, write_table
+from leaf.schema import apply_schema
+from climateandcompany.deduplicate_asset_data import DEDUP_DISTANCE, DEDUP_THRESHOLD, deduplicate_assets
+
+def combine_asset_datasets(deduplicate: bool = True, distance: float = DEDUP_DISTANCE, threshold: float = DEDUP_THRESHOLD):
+    """Combine the assets of GEM, Climate Trace and SFI into one table.
+
+    Args:
+        deduplicate (bool, optional): Keep one canonical asset of the assets that are in several sources, see deduplicate_assets. Defaults to True.
+        distance (float, optional): The distance in meters of duplicates. Defaults to DEDUP_DISTANCE.
+        threshold (float, optional): The name similarity of duplicates. Defaults to DEDUP_THRESHOLD.
+
+    Returns:
+        pd.DataFrame: The combined assets.
+    """
+    df_gem = apply_schema(read_table(f"data/loaded_asset/asset_level_open_source_gem.{TABLE_FORMAT}"))
     df_gem['data_source'] = 'GEM'
 
-    df_clt = pd.read_csv("data/loaded_asset/asset_level_open_source_climate_trace.csv")
+    df_clt = apply_schema(read_table(f"data/loaded_asset/asset_level_open_source_climate_trace.{TABLE_FORMAT}"))
     df_clt['data_source'] = 'Climate Trace'
     df_clt.rename(columns = {"company_name": "owner_name"}, inplace = True)
 
-    df_sfi = pd.read_csv("data/loaded_asset/asset_level_open_source_sfi.csv")
+    df_sfi = apply_schema(read_table(f"data/loaded_asset/asset_level_open_source_sfi.{TABLE_FORMAT}"))
     df_sfi['data_source'] = 'SFI'
 
     df = pd.concat([df_gem, df_clt, df_sfi], axis = 0).reset_index()
@@ -32,8 +45,18 @@ def combine_asset_datasets():
         
     df.dropna(axis = 0, subset = ['owner_name', 'latitude', 'longitude'], how = 'any', inplace = True)
 
+    # categories of the sources are combined
+    df = apply_schema(df)
+
+    # one asset per asset that is in several sources, with the uid of each source linked to it
+    if deduplicate:
+        df, links = deduplicate_assets(df, distance, threshold)
+        print(f"{len(links) - len(df)} of {len(links)} assets are duplicates of another source")
+        links_path = os.path.join(PATH_TO_OUTPUT_FOLDER, f"loaded_asset/combined_asset_links.{TABLE_FORMAT}")
+        write_table(links, links_path)
+
     # export finalized dataset
-    output_path = os.path.join(PATH_TO_OUTPUT_FOLDER,"loaded_asset/combined_asset_data.csv")
-    df.to_csv(output_path, index=False)
+    output_path = os.path.join(PATH_TO_OUTPUT_FOLDER,f"loaded_asset/combined_asset_data.{TABLE_FORMAT}")
+    write_table(df, output_path)
 
     return df
@@ -0,0 +1,203 @@
+"""
+Filename: deduplicate_asset_data.py
+
+Description:
+    The same plant often appears in GEM, Climate Trace and SFI. This script finds the
+    assets of different sources that are close to each other, in the same sector, and
+    have similar asset or owner names, and links them to one canonical asset.
+
+Outline:
+    1) Candidate pairs: a BallTree (haversine) per sector family, within a distance
+    2) Name similarity: TF-IDF of character n-grams of asset_name and owner_name
+    3) Canonical assets: the trees of the best match of each asset in a source of higher priority,
+       with at most one asset of each source
+"""
+# import packages
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.neighbors import BallTree
+from typing import Tuple
+
+# the mean radius of the earth in meters
+EARTH_RADIUS = 6_371_008.8
+
+# the distance in meters and the name similarity of a duplicate
+DEDUP_DISTANCE = 2_000
+DEDUP_THRESHOLD = 0.5
+
+# the sources in the order in which their asset is kept as the canonical one
+SOURCE_PRIORITY = ['GEM', 'SFI', 'Climate Trace']
+
+# the family of the sectors of the sources, other sectors are their own family
+SECTOR_FAMILIES = {
+    'electricity generation': 'power',
+    'wind power': 'power',
+    'solar power': 'power',
+    'coal plant': 'power',
+    'hydropower': 'power',
+    'nuclear': 'power',
+    'geothermal': 'power',
+    'bioenergy': 'power',
+    'coal mine': 'coal mining',
+    'oil & gas extraction': 'oil and gas production',
+    'oil and gas production and transport': 'oil and gas production',
+    'pulp paper': 'pulp and paper',
+    'petrochemicals': 'chemicals',
+}
+
+# text of missing names, see combine_asset_datasets
+MISSING_NAMES = ['', 'nan', 'none', 'na']
+
+def sector_families(sectors: pd.Series) -> np.ndarray:
+    """The family of each sector e.g. 'power' for 'wind power/onshore', see SECTOR_FAMILIES."""
+    heads = sectors.astype(str).str.split('/', n=1).str[0].str.strip()
+    return heads.map(lambda head: SECTOR_FAMILIES.get(head, head.lower())).to_numpy()
+
+def candidate_pairs(latitudes: np.ndarray, longitudes: np.ndarray, blocks: np.ndarray, distance: float = DEDUP_DISTANCE) -> Tuple[np.ndarray, np.ndarray]:
+    """The pairs of assets in the same block, e.g. sector family, within a distance.
+
+    Each block gets a BallTree with the haversine metric, so only the neighbours of
+    each asset are compared rather than all pairs.
+
+    Args:
+        latitudes (np.ndarray): The latitudes in degrees.
+        longitudes (np.ndarray): The longitudes in degrees.
+        blocks (np.ndarray): The block of each asset, see sector_families.
+        distance (float, optional): The distance in meters. Defaults to DEDUP_DISTANCE.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The positions of the first and second asset of each pair, first < second.
+    """
+    firsts, seconds = [], []
+    for block in pd.unique(blocks):
+        positions = np.flatnonzero(blocks == block)
+        if len(positions) < 2:
+            continue
+        coordinates = np.radians(np.column_stack([latitudes[positions], longitudes[positions]]))
+        neighbours = BallTree(coordinates, metric='haversine').query_radius(coordinates, r=distance / EARTH_RADIUS)
+        first = np.repeat(np.arange(len(positions)), [len(n) for n in neighbours])
+        second = np.concatenate(neighbours)
+        keep = first < second
+        firsts.append(positions[first[keep]])
+        seconds.append(positions[second[keep]])
+
+    if not firsts:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+def name_similarity(names: pd.Series, firsts: np.ndarray, seconds: np.ndarray) -> np.ndarray:
+    """The cosine similarity of the TF-IDF of character n-grams of the names of pairs.
+
+    Only the names of the pairs are vectorized, and the similarity of all pairs is one
+    sparse product. Missing names, see MISSING_NAMES, are similar to nothing.
+
+    Args:
+        names (pd.Series): The names e.g. asset_name.
+        firsts (np.ndarray): The positions of the first asset of each pair.
+        seconds (np.ndarray): The positions of the second asset of each pair.
+
+    Returns:
+        np.ndarray: The similarity of each pair, from 0 to 1.
+    """
+    if len(firsts) == 0:
+        return np.empty(0)
+
+    positions, inverse = np.unique(np.concatenate([firsts, seconds]), return_inverse=True)
+    text = names.iloc[positions].astype(str).str.lower().str.strip()
+    missing = text.isin(MISSING_NAMES).to_numpy()
+    text = text.where(~missing, '')
+
+    if missing.all():
+        return np.zeros(len(firsts))
+    vectors = TfidfVectorizer(analyzer='char_wb', ngram_range=(3, 3)).fit_transform(text)
+
+    first, second = inverse[:len(firsts)], inverse[len(firsts):]
+    return np.asarray(vectors[first].multiply(vectors[second]).sum(axis=1)).ravel()
+
+def deduplicate_assets(df: pd.DataFrame,
+                       distance: float = DEDUP_DISTANCE,
+                       threshold: float = DEDUP_THRESHOLD) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Link the assets of different sources that are the same asset to a canonical asset.
+
+    Two assets match when they are from different sources, in the same sector family,
+    within distance and with a similarity of asset_name or owner_name of at least
+    threshold. Each asset is linked to its most similar match in a source that comes
+    earlier in SOURCE_PRIORITY, and the assets linked, directly or through others, are
+    one asset whose canonical_uid is the uid of the asset they are linked to in the end.
+    Links are taken from the most similar down, and one that would put two assets of
+    the same source in one asset is left out, so e.g. of two SFI phases of a wind farm
+    that match the same GEM asset, only the more similar one is linked to it and the
+    other stays an asset of its own.
+
+    Args:
+        df (pd.DataFrame): The combined assets with uid, asset_name, owner_name, sector, latitude, longitude and data_source.
+        distance (float, optional): The distance in meters. Defaults to DEDUP_DISTANCE.
+        threshold (float, optional): The name similarity from 0 to 1. Defaults to DEDUP_THRESHOLD.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: The canonical assets, and the links of uid to canonical_uid with the data_source of each asset.
+    """
+    df = df.reset_index(drop=True)
+    sources = df['data_source'].astype(str).to_numpy()
+
+    # 1) candidate pairs of different sources
+    firsts, seconds = candidate_pairs(df['latitude'].to_numpy(dtype=float), df['longitude'].to_numpy(dtype=float),
+                                      sector_families(df['sector']), distance)
+    cross = sources[firsts] != sources[seconds]
+    firsts, seconds = firsts[cross], seconds[cross]
+
+    # 2) confirmed by the names
+    similarity = np.maximum(name_similarity(df['asset_name'], firsts, seconds),
+                            name_similarity(df['owner_name'], firsts, seconds))
+    match = similarity >= threshold
+    firsts, seconds = firsts[match], seconds[match]
+
+    # 3) each asset is linked to its best match in a source of higher priority, so that
+    # the links are trees whose root is the canonical asset
+    priority = pd.Series(sources).map({source: i for i, source in enumerate(SOURCE_PRIORITY)}).fillna(len(SOURCE_PRIORITY)).to_numpy()
+    forward = priority[firsts] > priority[seconds]
+    children = np.where(forward, firsts, seconds)
+    parents = np.where(forward, seconds, firsts)
+    keep = priority[firsts] != priority[seconds]
+    children, parents, similarity = children[keep], parents[keep], similarity[match][keep]
+
+    order = np.lexsort((-similarity, children))
+    best = np.ones(len(order), dtype=bool)
+    best[1:] = children[order][1:] != children[order][:-1]
+    children, parents, similarity = children[order][best], parents[order][best], similarity[order][best]
+
+    # 4) from the most similar link down, skip those that join two trees with assets of the same source
+    n = len(df)
+    trees = np.arange(n)
+    sources_of = np.left_shift(1, priority.astype(np.int64))
+    keep = np.zeros(len(children), dtype=bool)
+    for k in np.argsort(-similarity, kind='stable'):
+        child, parent = children[k], parents[k]
+        while trees[child] != child:
+            child = trees[child]
+        while trees[parent] != parent:
+            parent = trees[parent]
+        if sources_of[child] & sources_of[parent]:
+            continue
+        trees[child] = parent
+        sources_of[parent] |= sources_of[child]
+        keep[k] = True
+    children, parents = children[keep], parents[keep]
+
+    graph = coo_matrix((np.ones(len(children)), (children, parents)), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+
+    has_parent = np.zeros(n, dtype=bool)
+    has_parent[children] = True
+    uids = df['uid'].to_numpy()
+    roots = ~has_parent
+    canonical = np.empty(labels.max() + 1, dtype=uids.dtype)
+    canonical[labels[roots]] = uids[roots]
+
+    links = pd.DataFrame({'uid': uids, 'canonical_uid': canonical[labels], 'data_source': df['data_source']})
+    assets = df[links['uid'].to_numpy() == links['canonical_uid'].to_numpy()].reset_index(drop=True)
+
+    return assets, links
@@ -8,7 +8,7 @@ Update:
     Last updated in November 2023
 
 Output:
-    A cleaned and structured DataFrame saved as a CSV file
+    A cleaned and structured DataFrame saved as a Parquet (or TABLE_FORMAT) file
     
 NOTES/ #TODO:
 - Get access to more disaggregated data with ownership information (i.e., reach out to them).
@@ -18,33 +18,86 @@ NOTES/ #TODO:
 import os
 import pandas as pd
 import numpy as np
-from flags import PATH_TO_INPUT_FOLDER, PATH_TO_OUTPUT_FOLDER
+import pyarrow as pa
+from pyarrow import csv
+from concurrent.futures import ThreadPoolExecutor
+from flags import PATH_TO_INPUT_FOLDER, PATH_TO_OUTPUT_FOLDER, TABLE_FORMAT
+from leaf.storage import write_table
+from leaf.schema import apply_schema, make_uid
+from typing import Optional
 
-def process_and_save_climate_trace_data(ownership_threshold=10):
+# the columns read from the *_ownership.csv files, with their types
+CLIMATE_TRACE_DTYPES = {
+    'source_id': 'int64',
+    'source_name': 'object',
+    'iso3_country': 'object',
+    'original_inventory_sector': 'object',
+    'lat': 'float64',
+    'lon': 'float64',
+    'ultimate_parent_name': 'object',
+    'ultimate_parent_id': 'Int64',
+    'percent_interest_parent': 'float64',
+    'company_name': 'object',
+    'company_id': 'Int64',
+    'percent_interest_company': 'float64',
+}
+# ids are written as e.g. 100001014592.0 in some files, so nullable ints are read as floats
+ARROW_TYPES = {'int64': pa.int64(), 'Int64': pa.float64(), 'float64': pa.float64(), 'object': pa.string()}
+
+def read_climate_trace(climate_trace_input_folder: str, max_workers: Optional[int] = None) -> pd.DataFrame:
+    """Read the *_ownership.csv files of Climate Trace, one row per asset and owner.
+
+    The files are parsed by the pyarrow CSV reader in parallel, and only the columns of
+    CLIMATE_TRACE_DTYPES are read, with their types.
+
+    Args:
+        climate_trace_input_folder (str): The path to the folder containing the Climate Trace data.
+        max_workers (Optional[int], optional): The number of files read at once. Defaults to None, see ThreadPoolExecutor.
+
+    Returns:
+        pd.DataFrame: The rows of all files, in the order of the files.
+    """
+    # Collect all filenames in the input folder ending with _ownership.csv
+    climate_trace_files = [file for file in os.listdir(climate_trace_input_folder) if file.endswith("_ownership.csv") and "steel" not in file]
+
+    # empty text is missing
+    options = csv.ConvertOptions(include_columns=list(CLIMATE_TRACE_DTYPES),
+                                 column_types={column: ARROW_TYPES[dtype] for column, dtype in CLIMATE_TRACE_DTYPES.items()},
+                                 strings_can_be_null=True)
+
+    def read(file: str) -> pd.DataFrame:
+        df = csv.read_csv(os.path.join(climate_trace_input_folder, file), convert_options=options).to_pandas()
+        df = df.astype(CLIMATE_TRACE_DTYPES)
+        # missing text is NaN rather than None, as with pd.read_csv
+        text = [column for column, dtype in CLIMATE_TRACE_DTYPES.items() if dtype == 'object']
+        df[text] = df[text].fillna(np.nan)
+        return df
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        temp_list = list(executor.map(read, climate_trace_files))
+
+    # Turning the list of dataframes into a single dataframe
+    return pd.concat(temp_list, ignore_index=True)
+
+def process_and_save_climate_trace_data(ownership_threshold=10, max_workers: Optional[int] = None):
     """
     Process and save Climate Trace data from the specified input folder to the output folder.
 
     Args:
-        climate_trace_input_folder (str): The path to the folder containing the Climate Trace data.
-        ownership_threshold (int): The minimum percent interest to include an asset with multiple owners.
+        ownership_threshold (int): The minimum percent interest to include an owner of an asset with multiple owners.
+        max_workers (Optional[int]): The number of files read at once, see read_climate_trace.
 
     Output:
-        Saves a cleaned and structured DataFrame as a CSV file in the output folder.
+        Saves a cleaned and structured DataFrame as a TABLE_FORMAT file in the output folder, with one row
+        per asset, and the owners of the assets with their shares as a long table next to it.
     """
     ### Load all Climate Trace data files
     climate_trace_input_folder = os.path.join(PATH_TO_INPUT_FOLDER, "asset_level_data/climate_trace")
-    
-    # Collect all filenames in the input folder ending with _ownership.csv
-    climate_trace_files = [file for file in os.listdir(climate_trace_input_folder) if file.endswith("_ownership.csv") and "steel" not in file]
-    temp_list = [pd.read_csv(os.path.join(climate_trace_input_folder, file)) for file in climate_trace_files]
-    
-    # Turning the list of dataframes into a single dataframe
-    df_climate_trace = pd.concat(temp_list, ignore_index=True)
-    del temp_list
+    df_owners = read_climate_trace(climate_trace_input_folder, max_workers)
 
     ### DATA CLEANING
     # Store assets with one owner in separate df
-    df_climate_trace = df_climate_trace.drop_duplicates(subset='source_id', keep='first')
+    df_climate_trace = df_owners.drop_duplicates(subset='source_id', keep='first')
 
     # Store start date
     # df_climate_trace['start_year'] = pd.to_datetime(df_climate_trace['start_date']).dt.year
@@ -72,11 +125,26 @@ def process_and_save_climate_trace_data(ownership_threshold=10):
         df_climate_trace[var].fillna('', inplace=True) # fill nan with empty string
         
     # create unique id for each row, counting from 0 to len(df_climate_trace)
-    df_climate_trace['uid'] = ['CLT_' + str(num) for num in list(range(len(df_climate_trace)))]
+    df_climate_trace['uid'] = make_uid('CLT', len(df_climate_trace))
+    df_climate_trace = apply_schema(df_climate_trace)
     
-    ### SAVE OUTPUT TO CSV
-    output_file_path = os.path.join(PATH_TO_OUTPUT_FOLDER, "loaded_asset/asset_level_open_source_climate_trace.csv")
-    df_climate_trace.to_csv(output_file_path, index=False)
+    ### OWNERS
+    # keep the owners of an asset with multiple owners that hold at least ownership_threshold percent
+    owners_per_asset = df_owners.groupby('source_id')['source_id'].transform('size')
+    df_owners = df_owners[(owners_per_asset == 1) | (df_owners['percent_interest_parent'] >= ownership_threshold)]
+    df_owners = df_owners[['source_id', 'ultimate_parent_name', 'ultimate_parent_id', 'percent_interest_parent',
+                           'company_name', 'company_id', 'percent_interest_company']]
+    df_owners = df_owners.rename(columns={'source_id': 'asset_id', 'ultimate_parent_name': 'parent_name',
+                                          'ultimate_parent_id': 'parent_id'})
+    # the uid of the asset in df_climate_trace
+    df_owners = df_owners.merge(df_climate_trace[['asset_id', 'uid']], on='asset_id', how='left', validate='many_to_one')
+    
+    ### SAVE OUTPUT AS TABLE_FORMAT
+    output_file_path = os.path.join(PATH_TO_OUTPUT_FOLDER, f"loaded_asset/asset_level_open_source_climate_trace.{TABLE_FORMAT}")
+    write_table(df_climate_trace, output_file_path)
+
+    owners_file_path = os.path.join(PATH_TO_OUTPUT_FOLDER, f"loaded_asset/asset_owners_climate_trace.{TABLE_FORMAT}")
+    write_table(df_owners, owners_file_path)
     
     return df_climate_trace
 
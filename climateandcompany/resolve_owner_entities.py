@@ -0,0 +1,246 @@
+"""
+Filename: resolve_owner_entities.py
+
+Description:
+    Owners and parents are named differently by GEM, Climate Trace and SFI, e.g.
+    'NTPC Ltd' and 'NTPC'. This script resolves their names to owner entities with
+    stable ids, kept in loaded_asset/owner_entities so that a later run keeps the ids
+    and only scores the names it has not seen.
+
+Outline:
+    1) Normalisation: lowercase, without accents, punctuation and legal forms e.g. 'ltd'
+    2) Anchors: names with the same LEI, PermID or source id are one entity
+    3) Blocking: names that share a rare token are compared, see block_pairs
+    4) Scoring: TF-IDF of character n-grams, see name_similarity
+    5) Stable ids: known names keep their id, new names take that of their entity
+"""
+# import packages
+import os
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, triu
+from scipy.sparse.csgraph import connected_components
+from sklearn.feature_extraction.text import CountVectorizer
+from flags import PATH_TO_OUTPUT_FOLDER, TABLE_FORMAT
+from leaf.storage import read_table, write_table
+from climateandcompany.deduplicate_asset_data import name_similarity
+from typing import Optional, Tuple
+
+# the similarity of two names of the same entity
+OWNER_THRESHOLD = 0.8
+
+# tokens in more names than this are too common to block on e.g. 'energy'
+MAX_BLOCK = 200
+
+# names of no one in particular
+PLACEHOLDER_NAMES = ['', 'nan', 'none', 'na', 'n/a', '-', 'unknown', 'other', 'others']
+
+# legal forms that are left out of the key of a name
+LEGAL_FORMS = ['ab', 'ag', 'as', 'asa', 'bhd', 'bv', 'cia', 'co', 'company', 'corp', 'corporation',
+               'gmbh', 'inc', 'incorporated', 'jsc', 'kg', 'limited', 'llc', 'lp', 'ltd', 'ltda',
+               'nv', 'oao', 'ojsc', 'oy', 'oyj', 'pjsc', 'plc', 'pt', 'pte', 'pty', 'pvt', 'sa',
+               'sab', 'sas', 'sl', 'spa', 'srl', 'tbk', 'zao']
+LEGAL_FORM = r'\b(?:' + '|'.join(LEGAL_FORMS) + r')\b'
+
+# the schemes of the identifiers of owners, see collect_owner_mentions
+class Scheme:
+    LEI = 'lei'
+    PERMID = 'permid'
+    GEM = 'gem'
+    CLIMATE_TRACE = 'climate_trace'
+
+def normalize_names(names: pd.Series) -> pd.Series:
+    """The key of each name: lowercase, without accents, punctuation and legal forms.
+
+    Each distinct name is normalised once, e.g. 'Acciona Energía S.A.' becomes
+    'acciona energia'. Placeholders, see PLACEHOLDER_NAMES, become ''.
+
+    Args:
+        names (pd.Series): The names.
+
+    Returns:
+        pd.Series: The keys, with the index of names.
+    """
+    distinct = pd.Series(names.astype(str).unique())
+    keys = (distinct.str.normalize('NFKD').str.replace(r'[\u0300-\u036f]', '', regex=True)
+            .str.lower().str.replace('&', ' and ', regex=False)
+            .str.replace(r'\.', '', regex=True).str.replace(r'[^\w]+', ' ', regex=True).str.strip())
+    stripped = keys.str.replace(LEGAL_FORM, ' ', regex=True).str.replace(r'\s+', ' ', regex=True).str.strip()
+    # a name that is only a legal form keeps it
+    keys = stripped.where(stripped != '', keys)
+    keys = keys.where(~keys.isin(PLACEHOLDER_NAMES), '')
+    return names.astype(str).map(dict(zip(distinct, keys)))
+
+def collect_owner_mentions(output_path: str = PATH_TO_OUTPUT_FOLDER) -> pd.DataFrame:
+    """The owner, parent and operator names of the asset tables, with their identifiers.
+
+    A name with several identifiers, e.g. an LEI and a PermID in SFI, is mentioned once
+    per identifier, and a name without any once with a missing identifier.
+
+    Args:
+        output_path (str, optional): The folder of loaded_asset. Defaults to PATH_TO_OUTPUT_FOLDER.
+
+    Returns:
+        pd.DataFrame: The mentions with name, scheme, identifier and data_source.
+    """
+    def path(name: str) -> str:
+        return os.path.join(output_path, f"loaded_asset/{name}.{TABLE_FORMAT}")
+
+    def text(identifiers: pd.Series) -> pd.Series:
+        # PermIDs are read as floats where some are missing
+        result = identifiers.astype(str).str.replace(r'\.0$', '', regex=True)
+        return result.where(identifiers.notna() & ~identifiers.astype(str).isin(PLACEHOLDER_NAMES + ['NA']))
+
+    def mentions(df: pd.DataFrame, name: str, data_source: str, identifiers: dict) -> pd.DataFrame:
+        result = [pd.DataFrame({'name': df[name].astype(str), 'scheme': None, 'identifier': None})]
+        for column, scheme in identifiers.items():
+            result.append(pd.DataFrame({'name': df[name].astype(str), 'scheme': scheme, 'identifier': text(df[column])}).dropna(subset=['identifier']))
+        result = pd.concat(result, ignore_index=True)
+        result['data_source'] = data_source
+        return result
+
+    dfs = []
+
+    df_gem = read_table(path('asset_level_open_source_gem'))
+    for role in ['parent', 'owner', 'operator']:
+        identifiers = text(df_gem[f'ownership_{role}_id'])
+        df = pd.DataFrame({'name': df_gem[f'{role}_name'],
+                           'permid': identifiers.where(~identifiers.str.startswith('GEM', na=False)),
+                           'gem': identifiers.where(identifiers.str.startswith('GEM', na=False))})
+        dfs.append(mentions(df, 'name', 'GEM', {'permid': Scheme.PERMID, 'gem': Scheme.GEM}))
+
+    df_sfi = read_table(path('asset_level_open_source_sfi'))
+    for role in ['owner', 'parent']:
+        dfs.append(mentions(df_sfi, f'{role}_name', 'SFI', {f'{role}_lei': Scheme.LEI, f'{role}_permid': Scheme.PERMID}))
+
+    df_clt = read_table(path('asset_owners_climate_trace'))
+    dfs.append(mentions(df_clt, 'parent_name', 'Climate Trace', {'parent_id': Scheme.CLIMATE_TRACE}))
+    dfs.append(mentions(df_clt, 'company_name', 'Climate Trace', {'company_id': Scheme.CLIMATE_TRACE}))
+
+    return pd.concat(dfs, ignore_index=True)
+
+def block_pairs(keys: pd.Series, max_block: int = MAX_BLOCK) -> Tuple[np.ndarray, np.ndarray]:
+    """The pairs of keys that share a token that is in at most max_block keys.
+
+    The keys and their tokens are a sparse matrix, so the pairs are one sparse
+    product, and common tokens e.g. 'power' are left out so that no block is large.
+
+    Args:
+        keys (pd.Series): The distinct keys, see normalize_names.
+        max_block (int, optional): The number of keys of the largest block. Defaults to MAX_BLOCK.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The positions of the first and second key of each pair, first < second.
+    """
+    tokens = CountVectorizer(token_pattern=r'\S+', binary=True, dtype=np.int32).fit_transform(keys)
+    tokens = tokens[:, np.flatnonzero(np.asarray(tokens.sum(axis=0)).ravel() <= max_block)]
+    pairs = triu(tokens @ tokens.T, k=1).tocoo()
+    return pairs.row, pairs.col
+
+def resolve_owners(mentions: pd.DataFrame,
+                   entities: Optional[pd.DataFrame] = None,
+                   threshold: float = OWNER_THRESHOLD,
+                   max_block: int = MAX_BLOCK) -> pd.DataFrame:
+    """Resolve the names of owners to entities with stable ids.
+
+    Names with the same key are the same entity, and so are names with the same
+    identifier of a scheme, or similar names that share a rare token. The known
+    names of entities keep their owner_id, and only pairs with a new name are scored.
+    A new name takes the smallest owner_id of the known names of its entity, or a
+    new owner_id.
+
+    Args:
+        mentions (pd.DataFrame): The names with scheme and identifier, see collect_owner_mentions.
+        entities (Optional[pd.DataFrame], optional): The entities of an earlier run. Defaults to None.
+        threshold (float, optional): The similarity of names of the same entity. Defaults to OWNER_THRESHOLD.
+        max_block (int, optional): See block_pairs. Defaults to MAX_BLOCK.
+
+    Returns:
+        pd.DataFrame: The entities with key, owner_id and name, the most mentioned name of the key.
+    """
+    mentions = mentions.assign(key=normalize_names(mentions['name']))
+    mentions = mentions[mentions['key'] != '']
+
+    if entities is None:
+        entities = pd.DataFrame({'key': pd.Series(dtype=object), 'owner_id': pd.Series(dtype=np.int64), 'name': pd.Series(dtype=object)})
+    new = pd.Index(mentions['key'].unique()).difference(entities['key'], sort=False)
+    keys = pd.concat([entities['key'], pd.Series(new, dtype=object)], ignore_index=True)
+    position = pd.Series(np.arange(len(keys)), index=keys)
+    known = len(entities)
+
+    firsts, seconds = [], []
+
+    # the known names of an entity stay together
+    anchor = entities.groupby('owner_id')['key'].transform('first')
+    firsts.append(np.arange(known))
+    seconds.append(position[anchor].to_numpy())
+
+    # names with the same identifier are one entity
+    identified = mentions.dropna(subset=['identifier'])
+    anchor = identified.groupby(['scheme', 'identifier'])['key'].transform('first')
+    firsts.append(position[identified['key']].to_numpy())
+    seconds.append(position[anchor].to_numpy())
+
+    # similar names of which one is new
+    first, second = block_pairs(keys, max_block)
+    scored = second >= known
+    first, second = first[scored], second[scored]
+    similar = name_similarity(keys, first, second) >= threshold
+    firsts.append(first[similar])
+    seconds.append(second[similar])
+
+    firsts, seconds = np.concatenate(firsts), np.concatenate(seconds)
+    graph = coo_matrix((np.ones(len(firsts)), (firsts, seconds)), shape=(len(keys), len(keys)))
+    _, labels = connected_components(graph, directed=False)
+
+    # the smallest known owner_id of each entity, else a new one in the order of the names
+    owner_ids = np.full(len(keys), -1, dtype=np.int64)
+    owner_ids[:known] = entities['owner_id'].to_numpy()
+    smallest = pd.Series(owner_ids[:known]).groupby(labels[:known]).min()
+    label_ids = pd.Series(-1, index=np.arange(labels.max() + 1 if len(keys) else 0), dtype=np.int64)
+    label_ids[smallest.index] = smallest.to_numpy()
+    fresh = pd.unique(labels[known:][label_ids.to_numpy()[labels[known:]] < 0])
+    start = owner_ids[:known].max() + 1 if known else 0
+    label_ids[fresh] = np.arange(start, start + len(fresh))
+    owner_ids[known:] = label_ids.to_numpy()[labels[known:]]
+
+    counts = mentions.groupby(['key', 'name'], sort=False).size().sort_values(ascending=False, kind='stable')
+    names = counts.reset_index().drop_duplicates('key').set_index('key')['name']
+    result = pd.DataFrame({'key': keys[known:].to_numpy(), 'owner_id': owner_ids[known:]})
+    result['name'] = result['key'].map(names)
+
+    return pd.concat([entities, result], ignore_index=True)
+
+def owner_ids(names: pd.Series, entities: pd.DataFrame) -> pd.Series:
+    """The owner_id of each name, missing for placeholders and names that were never resolved.
+
+    Args:
+        names (pd.Series): The names e.g. owner_name of combine_asset_datasets.
+        entities (pd.DataFrame): The entities, see resolve_owners.
+
+    Returns:
+        pd.Series: The owner_id as Int64, with the index of names.
+    """
+    ids = entities.set_index('key')['owner_id']
+    return normalize_names(names).map(ids).astype('Int64')
+
+def process_and_save_owner_entities(threshold: float = OWNER_THRESHOLD, max_block: int = MAX_BLOCK) -> pd.DataFrame:
+    """
+    Resolve the owners of the asset tables to the entities of loaded_asset/owner_entities.
+
+    Args:
+        threshold (float): The similarity of names of the same entity, see resolve_owners.
+        max_block (int): The number of names of the largest block, see block_pairs.
+
+    Output:
+        Saves the entities, those of the earlier runs with the new names, as a TABLE_FORMAT file in the output folder.
+    """
+    output_file_path = os.path.join(PATH_TO_OUTPUT_FOLDER, f"loaded_asset/owner_entities.{TABLE_FORMAT}")
+    entities = read_table(output_file_path) if os.path.isfile(output_file_path) else None
+
+    mentions = collect_owner_mentions()
+    entities = resolve_owners(mentions, entities, threshold, max_block)
+
+    write_table(entities, output_file_path)
+
+    return entities
@@ -0,0 +1,193 @@
+"""
+Filename: sectors.py
+
+Description:
+    The shared engine of the GEM and SFI ingestion. Each sector is described by a
+    SectorSpec, and load_sector turns its sheet into the columns of the asset tables.
+
+    Let's start with the following structure:
+    - STATUS (keep only active plants)
+    - CAPACITY (needed as a weight for the aggregation)
+    - OWNERSHIP INFORMARTION (crucial for mapping)
+    - SECTOR (to be added as a variable)
+    - EXPORT (prepare for export)
+"""
+# import packages
+import os
+import re
+import fnmatch
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional, List, Tuple
+from flags import TABLE_FORMAT
+from leaf.storage import read_table, write_table
+from leaf.sheets import decode_mixed, encode_mixed, read_sheet
+
+# the share of an owner e.g. 'Owner [60%]' or 'Owner (33.3%)'
+SHARE = re.compile(r"[\[\(]\d*[.]?\d*[%][\s*]?[\]\)]")
+
+class SectorSpec(NamedTuple):
+    """How the assets of a sector are read from a sheet, see load_sector.
+
+    Column names are those of the sheet in lowercase with underscores, see clean_col_names.
+    """
+    pattern: str                                  # the file name e.g. 'Global-Wind-Power-Tracker*.xlsx', see fnmatch
+    sector: str                                   # the sector e.g. 'wind power/', followed by the value of sector_column if any
+    sheet: Optional[str] = None                   # None for the sheet after 'About', see resolve_sheet
+    status: Tuple[str, str] = ('status', 'operating') # the column and value of the active assets
+    columns: Optional[dict] = None                # the output column of each column of the sheet e.g. {'asset_name': 'project_name'}
+    constants: Optional[dict] = None              # output columns with one value e.g. {'capacity_unit': 'mw'}
+    capacity: Tuple[str, ...] = ()                # columns added up to the capacity, with unknown values as 0
+    owners: Tuple[str, ...] = ()                  # columns where only the first of 'A [60%]; B [40%]' is kept, as 'A'
+    coordinates: Optional[str] = None             # a column of 'latitude, longitude'
+    sector_column: Optional[str] = None           # e.g. 'installation_type'
+    sector_fill: Optional[str] = None             # the value of a missing sector_column, None to leave it missing
+    lower: bool = True                            # lowercase the sector_column
+
+def clean_col_names(df):
+    """Turn all columns into lowercase and replace spaces with underscores."""
+    df.columns = df.columns.str.lower()
+    df.columns = df.columns.str.replace(" ", "_")
+    return df
+
+def find_file(spec: SectorSpec, input_path: str) -> str:
+    """The path to the workbook of a sector, the last by name if there are several.
+
+    Args:
+        spec (SectorSpec): The sector.
+        input_path (str): The folder with the workbooks.
+
+    Returns:
+        str: The path.
+    """
+    files = sorted(file for file in os.listdir(input_path) if fnmatch.fnmatch(file, spec.pattern))
+    if not files:
+        raise FileNotFoundError(f'No file matching {spec.pattern} in {input_path}')
+    if len(files) > 1:
+        print(f'Warning: {len(files)} files match {spec.pattern}, using {files[-1]}')
+    return os.path.join(input_path, files[-1])
+
+def needed_columns(spec: SectorSpec, keep: List[str]) -> List[str]:
+    """The columns of the sheet that load_sector uses."""
+    columns = [spec.status[0], *(spec.columns or {}).values(), *spec.capacity, *spec.owners, *keep]
+    columns += [column for column in (spec.coordinates, spec.sector_column) if column is not None]
+    return list(dict.fromkeys(columns))
+
+def load_sector(spec: SectorSpec, path: str, keep: List[str], missing=np.nan) -> pd.DataFrame:
+    """Load the active assets of a sector, with the columns keep.
+
+    Only the columns of the sheet that the spec uses are read, see read_sheet.
+
+    Args:
+        spec (SectorSpec): The sector e.g. from GEM_SECTORS.
+        path (str): The path to the workbook, see find_file.
+        keep (List[str]): The output columns e.g. VARS_TO_KEEP.
+        missing (optional): The value of the output columns the sheet does not have. Defaults to np.nan.
+
+    Returns:
+        pd.DataFrame: The assets, with a range index.
+    """
+    df = read_sheet(path, spec.sheet, needed_columns(spec, keep))
+    df = clean_col_names(df) # turn cols into lowercase
+
+    # STATUS
+    column, value = spec.status
+    df = df[df[column] == value].copy()
+
+    # CAPACITY
+    if spec.capacity:
+        capacity = df[list(spec.capacity)].replace([">0", "nan", "NA", "unknown"], 0).astype(float)
+        df = df.assign(capacity=capacity.sum(axis=1))
+
+    # CLEAN OWNER
+    for owner in spec.owners:
+        df[owner] = df[owner].str.split(";", n=1).str[0].str.replace(SHARE, '', regex=True).str.strip()
+
+    # EXPORT
+    if spec.coordinates is not None:
+        coordinates = df[spec.coordinates].str.split(",", expand=True)
+        df = df.assign(latitude=coordinates[0], longitude=coordinates[1])
+
+    columns, constants = spec.columns or {}, spec.constants or {}
+    result = {}
+    for name in keep:
+        if name in columns:
+            result[name] = df[columns[name]]
+        elif name in constants:
+            result[name] = constants[name]
+        elif name == 'sector':
+            # SECTOR
+            result[name] = spec.sector
+            if spec.sector_column is not None:
+                values = df[spec.sector_column]
+                if spec.sector_fill is not None:
+                    values = values.fillna(spec.sector_fill)
+                result[name] = spec.sector + (values.str.lower() if spec.lower else values)
+        elif name in df.columns:
+            result[name] = df[name]
+        else:
+            result[name] = missing
+
+    return pd.DataFrame(result, index=df.index).reset_index(drop=True)
+
+def load_sectors(specs: dict,
+                 input_path: str,
+                 output_path: str,
+                 keep: List[str],
+                 missing=np.nan,
+                 sectors: Optional[List[str]] = None,
+                 max_workers: Optional[int] = None) -> List[pd.DataFrame]:
+    """Load the sectors of a source, each in a process of its own.
+
+    Each sector is kept in output_path as e.g. wind_power.parquet, so that a refresh
+    of some sectors reads the others from there instead of parsing their workbooks.
+    A sector whose workbook is newer than its file is loaded again.
+    The sectors are returned in the order of specs, whatever the order in which
+    they finish.
+
+    Args:
+        specs (dict): The SectorSpec of each sector e.g. GEM_SECTORS.
+        input_path (str): The folder with the workbooks.
+        output_path (str): The folder of the sectors.
+        keep (List[str]): The output columns, see load_sector.
+        missing (optional): The value of the output columns a sheet does not have. Defaults to np.nan.
+        sectors (Optional[List[str]], optional): The sectors to load again, even if their workbook did not change e.g. ['wind_power']. Defaults to None, i.e. all.
+        max_workers (Optional[int], optional): The number of processes. Defaults to None, i.e. the number of CPUs.
+
+    Returns:
+        List[pd.DataFrame]: The assets of each sector.
+    """
+    if sectors is not None:
+        unknown = [sector for sector in sectors if sector not in specs]
+        if unknown:
+            raise ValueError(f'Unknown sectors {unknown}, expected some of {list(specs)}')
+
+    os.makedirs(output_path, exist_ok=True)
+    files = {sector: os.path.join(output_path, f'{sector}.{TABLE_FORMAT}') for sector in specs}
+
+    def changed(sector: str) -> bool:
+        # a sector read from output_path needs no workbook, only a newer one replaces it
+        try:
+            workbook = find_file(specs[sector], input_path)
+        except FileNotFoundError:
+            return False
+        return os.path.getmtime(workbook) > os.path.getmtime(files[sector])
+
+    # load the sectors asked for, those that were never loaded and those whose workbook changed since
+    load = [sector for sector in specs if sectors is None or sector in sectors or not os.path.isfile(files[sector])
+            or changed(sector)]
+
+    dfs = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {sector: executor.submit(load_sector, specs[sector], find_file(specs[sector], input_path), keep, missing)
+                   for sector in load}
+        for sector in specs:
+            if sector in futures:
+                df = futures[sector].result()
+                write_table(encode_mixed(df), files[sector])
+            else:
+                df = decode_mixed(read_table(files[sector]))
+            dfs.append(df)
+
+    return dfs
@@ -1,7 +1,11 @@
+import os
 import sys
 import argparse
+from contextlib import ExitStack
 import geopandas as gpd
 
+from flags import PATH_TO_INPUT_FOLDER, TABLE_FORMAT
+
 from climateandcompany.generate_asset_level_climate_trace import (
     process_and_save_climate_trace_data
 )
@@ -11,6 +15,7 @@ from climateandcompany.generate_asset_level_SFI import (
 )
 
 from climateandcompany.generate_asset_level_GEM import (
+    SECTORS as GEM_SECTORS,
     process_and_save_gem_data
 )
 
@@ -18,12 +23,21 @@ from climateandcompany.combine_asset_data import (
     combine_asset_datasets
 )
 
+from climateandcompany.resolve_owner_entities import (
+    process_and_save_owner_entities
+)
+
 from leaf.asset_data_for_ml import (
     gem_data_for_ml
 )
 
 from leaf.deforestation import (
+    HANSEN_VERSION,
     area,
+    areas,
+    nearest,
+    nearest_index,
+    to_assets_with_loss_area,
     to_reg_sample,
     window,
     to_lossyear_timeseries,
@@ -31,6 +45,80 @@ from leaf.deforestation import (
     to_assets_with_treecover2000
 )
 
+from leaf.geopackage import (
+    crs,
+    extent,
+    file_distance,
+    read_features,
+    read_nearest_features,
+    utm_crs
+)
+
+from leaf.metrics import Metrics
+from leaf.pipeline import (
+    PIPELINE_ROOT,
+    Pipeline,
+    Stage,
+    lossyear_tile,
+    merge_tiles,
+    reg_sample_table,
+    treecover2000_tile
+)
+from leaf.storage import (read_table, write_table, write_table_chunks)
+from leaf.remote import remote
+from leaf.tiles import TileCache
+
+def run_pipeline(tile_cache: TileCache, offset: int = 16, offsets=None, windows=None, max_workers=None, verbose: bool = False, metrics=None, force=()) -> dict:
+    """Bring the outputs of assets, gem_data_for_ml, lossyear and treecover2000 per tile and reg_sample up to date.
+
+    The tiles are those of the assets, so the asset stages run first. The stages of
+    each tile are independent and run concurrently, and a merge stage per layer
+    combines them, see merge_tiles. The stages named in force run even if they are
+    up to date, e.g. 'reg_sample' or 'lossyear_Hansen_GFC-2022-v1.10_lossyear_20S_060W.tif'.
+
+    Returns:
+        dict: The Status of each stage, see Pipeline.run.
+    """
+    gem_input = os.path.join(PATH_TO_INPUT_FOLDER, 'asset_level_data/global_energy_monitor')
+    gem = f"data/loaded_asset/asset_level_open_source_gem.{TABLE_FORMAT}"
+    assets = f"data/assets_for_deforestation.{TABLE_FORMAT}"
+    with_lossyear = f"data/assets_with_lossyear.{TABLE_FORMAT}"
+    with_deforestation = f"data/assets_with_deforestation.{TABLE_FORMAT}"
+    sample = f"data/regression_sample.{TABLE_FORMAT}"
+
+    stages = [
+        Stage('assets', process_and_save_gem_data,
+              inputs=tuple(os.path.join(gem_input, file) for file in sorted(os.listdir(gem_input)) if file.endswith('.xlsx')),
+              outputs=(gem,)),
+        Stage('gem_data_for_ml', gem_data_for_ml, inputs=(gem,), outputs=(assets,), parameters={'gem_data': gem}),
+    ]
+    statuses = Pipeline(stages, max_workers=max_workers, verbose=verbose, metrics=metrics).run(force=force)
+
+    # the asset stages are done, the later pipeline neither runs nor forces them again
+    stages = []
+    layers = tile_cache.prefetch(assets)
+    for layer, function, source, target, parameters in [('lossyear', lossyear_tile, assets, with_lossyear, {'offset': offset}),
+                                                       ('treecover2000', treecover2000_tile, with_lossyear, with_deforestation, {})]:
+        tiles = []
+        for file in layers[layer]:
+            tile = os.path.join(PIPELINE_ROOT, layer, f'{os.path.splitext(file)[0]}.{TABLE_FORMAT}')
+            geoTIFF = os.path.join(tile_cache.root, file)
+            stages.append(Stage(f'{layer}_{file}', function, inputs=(geoTIFF, source), outputs=(tile,),
+                                parameters={'geoTIFF': geoTIFF, 'assets': source, 'data': tile, **parameters}))
+            tiles.append(tile)
+        stages.append(Stage(layer, merge_tiles, inputs=tuple(tiles), outputs=(target,), parameters={'tiles': tiles, 'data': target}))
+
+    stages.append(Stage('reg_sample', reg_sample_table, inputs=(with_deforestation,), outputs=(sample,),
+                        parameters={'assets': with_deforestation, 'data': sample,
+                                    'offsets': None if offsets is None else list(offsets), 'windows': windows}))
+
+    unknown = sorted(set(force) - set(statuses) - {stage.name for stage in stages})
+    if unknown:
+        print(f'Warning: there are no stages {", ".join(unknown)} to force.')
+
+    statuses.update(Pipeline(stages, max_workers=max_workers, verbose=verbose, metrics=metrics).run(force=force))
+    return statuses
+
 def main():
 
     class Command:
@@ -42,6 +130,11 @@ def main():
         ASSETS_WITH_TREECOVER2000 = 'treecover2000'
         WINDOW = 'window'
         REG_SAMPLE = 'reg_sample'
+        NEAREST = 'nearest'
+        LOSS_AREA = 'loss_area'
+        PREFETCH = 'prefetch'
+        OWNERS = 'owners'
+        PIPELINE = 'pipeline'
 
     commands = [Command.AREA, 
                 Command.ASSETS, 
@@ -50,20 +143,55 @@ def main():
                 Command.ASSETS_WITH_LOSSYEAR, 
                 Command.ASSETS_WITH_TREECOVER2000, 
                 Command.WINDOW, 
-                Command.REG_SAMPLE]
+                Command.REG_SAMPLE,
+                Command.NEAREST,
+                Command.LOSS_AREA,
+                Command.PREFETCH,
+                Command.OWNERS,
+                Command.PIPELINE]
     parser=argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description="""
     Perform a command...\n
     
-    > python -m exposure lossyear -a data/assets_for_deforestation.csv -gt data/Hansen_GFC-2022-v1.10_lossyear_20S_060W.tif -d data/assets_with_lossyear.csv -s '\t'\n
+    > python -m exposure lossyear -a data/assets_for_deforestation.parquet -gt data/Hansen_GFC-2022-v1.10_lossyear_20S_060W.tif -d data/assets_with_lossyear.parquet\n
                                                                 
-    > python -m exposure treecover2000 -a data/assets_with_lossyear.csv -gt data/Hansen_GFC-2022-v1.10_treecover2000_20S_060W.tif -d data/assets_with_deforestation.csv -s '\t'\n
+    > python -m exposure treecover2000 -a data/assets_with_lossyear.parquet -gt data/Hansen_GFC-2022-v1.10_treecover2000_20S_060W.tif -d data/assets_with_deforestation.parquet\n
+
+    > python -m exposure reg_sample -a data/assets_with_deforestation.parquet -d data/regression_sample.csv -s '\t'
+
+    > python -m exposure reg_sample -a data/assets_with_deforestation.csv -d data/regression_sample.csv -s '\t' --chunksize 100000
 
-    > python -m exposure reg_sample -a data/assets_with_deforestation.csv -d data/regression_sample.csv -s '\t'
+    > python -m exposure reg_sample -a data/assets_with_deforestation.csv -d data/regression_sample.csv -s '\t' --offsets -10 10 --windows around_21=-10:10 past_10=-10:-1
+
+    > python -m exposure area -g data/geoply-sample.gpkg --locations data/locations.csv -d data/locations_with_area.csv
+
+    > python -m exposure nearest -g data/geoply-sample.gpkg -a data/assets_for_deforestation.csv -d data/assets_with_nearest.csv -s '\t'
+
+    > python -m exposure loss_area -g data/geoply-sample.gpkg -a data/assets_for_deforestation.csv -d data/assets_with_loss_area.csv -r 5000 -s '\t'
+
+    > python -m exposure prefetch -a data/assets_for_deforestation.csv -s '\t' --budget 20 --transcode
+
+    > python -m exposure assets --sectors wind_power,coal_mine
+
+    > python -m exposure owners
+
+    > python -m exposure pipeline -o 16 --offsets -10 10 --budget 20
+
+    Tables are read and written as Parquet (.parquet), Feather (.feather) or CSV (any other extension).
 
     Default seperator is , so use -s '\\t' for TAB.
 
+    A -gt URL, e.g. https://storage.googleapis.com/earthenginepartners-hansen/GFC-2022-v1.10/Hansen_GFC-2022-v1.10_lossyear_20S_060W.tif,
+    reads only the windows needed via HTTP range requests and caches them in data/blocks, which --budget bounds
+    and which can be deleted at any time.
+
+    The pipeline command runs assets, gem_data_for_ml, lossyear and treecover2000 per tile and reg_sample,
+    skipping the stages whose inputs and parameters have not changed since their last run, see data/.pipeline.
+    Use --force reg_sample, or any other stage, to run a stage anyway.
+
+    Use -m metrics.jsonl, or -m metrics.prom --metrics-format prometheus, to record the duration of each stage.
+
     """)
     parser.add_argument("command", choices=commands)
     parser.add_argument("-gt", "--geoTIFF", nargs='?',
@@ -77,11 +205,11 @@ def main():
                         default="data/geoply-sample.gpkg", const="data/geoply-sample.gpkg",
                         help="Path to a geometry file e.g. .gpkg file to be output by series command, or to be used as input for the area command.")
     parser.add_argument("-a", "--assets", nargs='?',
-                        default="data/assets_for_deforestation.csv", const="data/assets_for_deforestation.csv",
-                        help="Path to a data file e.g. .csv file containing the assets to query, or the output from the lossyear/treecover2000 commands.")
+                        default=f"data/assets_for_deforestation.{TABLE_FORMAT}", const=f"data/assets_for_deforestation.{TABLE_FORMAT}",
+                        help="Path to a data file e.g. .parquet or .csv file containing the assets to query, or the output from the lossyear/treecover2000 commands.")
     parser.add_argument("-d", "--data", nargs='?',
                         default="data/geotiff-sample.csv", const="data/geotiff-sample.csv",
-                        help="Path to a data file e.g. .csv file to be output by lossyear or treecover2000 commands.")
+                        help="Path to a data file e.g. .parquet or .csv file to be output by lossyear or treecover2000 commands.")
     parser.add_argument("-o", "--offset", nargs='?', type=int,
                         default="16", const="16", )
     parser.add_argument("-l", "--location", nargs=2, type=float,
@@ -89,12 +217,43 @@ def main():
                         help="The location as: lat long")
     parser.add_argument("-y", "--year", nargs='?', type=int,
                         default="2020", const="2020")
+    parser.add_argument("--locations", nargs='?',
+                        default=None, const="data/locations.csv",
+                        help="Path to a .csv file with columns latitude, longitude and optionally year, to be used by the area command instead of --location.")
+    parser.add_argument("-r", "--distance", nargs='?', type=float,
+                        default="5000", const="5000",
+                        help="The distance in meters around each asset, used by the loss_area command.")
     parser.add_argument("-s", "--separator", nargs='?',
                         default=",", const=",", )
     parser.add_argument("-v", "--verbose", action=argparse.BooleanOptionalAction,
                          default=False)
+    parser.add_argument("--offsets", nargs=2, type=int, metavar=('FIRST', 'LAST'),
+                        help="Years relative to the start year of the t_ columns of reg_sample. Defaults to -3 3.")
+    parser.add_argument("--windows", nargs='+', metavar='NAME=FIRST:LAST',
+                        help="Sums of deforestation over relative years for reg_sample e.g. around_5=-2:2. Defaults to around_3, around_5, forward_3 and past_3.")
+    parser.add_argument("--chunksize", nargs='?', type=int,
+                        help="Number of rows of assets per chunk, for reg_sample to stream large files. Defaults to all at once.")
+    parser.add_argument("--budget", nargs='?', type=float,
+                        help="Maximum size of the Hansen tile cache in data/, in GB, for prefetch, or of data/blocks for a -gt URL. Defaults to unbounded.")
+    parser.add_argument("--hansen-version", nargs='?', default=HANSEN_VERSION,
+                        help=f"Version of the Hansen dataset for prefetch. Defaults to {HANSEN_VERSION}.")
+    parser.add_argument("--transcode", action=argparse.BooleanOptionalAction, default=False,
+                        help="Also keep a cloud-optimized copy of each prefetched tile in data/cog, which the readers prefer.")
+    parser.add_argument("--sectors", type=lambda value: value.split(','), metavar='SECTOR,...',
+                        help=f"GEM sectors to load again for assets, the others are read from data/loaded_asset/gem. Any of {','.join(GEM_SECTORS)}. Defaults to all.")
+    parser.add_argument("--force", nargs='+', default=[], metavar='STAGE',
+                        help="Stages for pipeline to run even if they are up to date e.g. reg_sample or lossyear_<tile>. Defaults to none.")
+    parser.add_argument("-m", "--metrics", nargs='?',
+                        default=None, const="metrics.jsonl",
+                        help="Path to a file to receive per-stage durations and counts. Defaults to None for no metrics.")
+    parser.add_argument("--metrics-format", choices=['jsonl', 'prometheus'],
+                        default=None,
+                        help="Format of the metrics file. Defaults to prometheus for .prom/.txt files and jsonl otherwise.")
     args=parser.parse_args()
 
+    if args.sectors is not None and not set(args.sectors) <= set(GEM_SECTORS):
+        parser.error(f"unknown sectors: {','.join(sorted(set(args.sectors) - set(GEM_SECTORS)))}")
+
     location = args.location
     year = args.year
     geometry = args.geometry
@@ -108,41 +267,102 @@ def main():
 
     command = args.command
 
-    match command:
-        case Command.AREA:
-            gdf = gpd.read_file(geometry)
-            result = area(gdf, location[0], location[1], year, verbose)
-            if result == None:
-                print('The given location is not contained in an area of deforestaton.')
-            else:
-                print(f'The given location is contained in an area of {result} units.')
-        case Command.ASSETS:
-            # process_and_save_climate_trace_data()
-            # process_and_save_sfi_data()
-            process_and_save_gem_data()
-
-            # combine_asset_datasets()
-            gem_data_for_ml("data/loaded_asset/asset_level_open_source_gem.csv")
+    metrics = None if args.metrics is None else Metrics(command=command)
+
+    # read windows of a remote geoTIFF through a local block cache
+    stack = ExitStack()
+    if geoTIFF.startswith(('http://', 'https://')):
+        base_url, name = geoTIFF.rsplit('/', 1)
+        budget = None if args.budget is None else int(args.budget * 1e9)
+        url = stack.enter_context(remote(base_url, 'data/blocks', budget=budget, metrics=metrics))
+        geoTIFF = f'/vsicurl/{url}/{name}'
+
+    with stack:
+        match command:
+            case Command.AREA if args.locations is not None:
+                df = read_table(args.locations, separator)
+                gdf = read_features(geometry, df['latitude'], df['longitude'], verbose=verbose)
+                years = df['year'] if 'year' in df.columns else None
+                df['area'] = areas(gdf, df['latitude'], df['longitude'], years, verbose=verbose, metrics=metrics)
+                write_table(df, data, separator)
+                print(f'Of {len(df)} locations, {df["area"].notna().sum()} are contained in an area of deforestation.')
+            case Command.AREA:
+                gdf = read_features(geometry, [location[0]], [location[1]], verbose=verbose)
+                result = area(gdf, location[0], location[1], year, verbose)
+                if result == None:
+                    print('The given location is not contained in an area of deforestaton.')
+                else:
+                    print(f'The given location is contained in an area of {result} units.')
+            case Command.ASSETS:
+                # process_and_save_climate_trace_data()
+                # process_and_save_sfi_data()
+                process_and_save_gem_data(sectors=args.sectors)
+
+                # combine_asset_datasets()
+                gem_data_for_ml(f"data/loaded_asset/asset_level_open_source_gem.{TABLE_FORMAT}")
             
-        case Command.CRS:
-            gdf = gpd.read_file(geometry)
-            print(f'File {geometry} contains CRS: {gdf.crs}')
-        case Command.LOSSYEAR_TIMESERIES:
-            gdf = to_lossyear_timeseries(geoTIFF, window, verbose)
-            gdf.to_file(geometry, driver='GPKG')
-        case Command.ASSETS_WITH_LOSSYEAR:
-            df = to_assets_with_lossyear(geoTIFF, assets, separator, offset, window, verbose)
-            df.to_csv(data, sep=separator)
-        case Command.ASSETS_WITH_TREECOVER2000:
-            df = to_assets_with_treecover2000(geoTIFF, assets, separator, window, verbose)
-            df.to_csv(data, sep=separator)
-        case Command.WINDOW:
-            gdf = gpd.read_file(geometry)
-            result = window(gdf)
-            print(f'File {geometry} contains Window: {result}')
-        case Command.REG_SAMPLE:
-            df = to_reg_sample(assets, separator)
-            df.to_csv(data, index=False, sep=separator, encoding='utf-8')
+            case Command.CRS:
+                print(f'File {geometry} contains CRS: {crs(geometry)}')
+            case Command.LOSSYEAR_TIMESERIES:
+                gdf = to_lossyear_timeseries(geoTIFF, window, verbose, metrics)
+                gdf.to_file(geometry, driver='GPKG', SPATIAL_INDEX='YES')
+            case Command.ASSETS_WITH_LOSSYEAR:
+                df = to_assets_with_lossyear(geoTIFF, assets, separator, offset, window, verbose, metrics)
+                write_table(df, data, separator, index=True)
+            case Command.ASSETS_WITH_TREECOVER2000:
+                df = to_assets_with_treecover2000(geoTIFF, assets, separator, window, verbose, metrics)
+                write_table(df, data, separator, index=True)
+            case Command.WINDOW:
+                result = extent(geometry)
+                print(f'File {geometry} contains Window: {result}')
+            case Command.REG_SAMPLE:
+                offsets = None if args.offsets is None else range(args.offsets[0], args.offsets[1] + 1)
+                windows = None if args.windows is None else {
+                    name: tuple(int(year) for year in span.split(':')) for name, span in (spec.split('=') for spec in args.windows)
+                }
+                if args.chunksize is None:
+                    df = to_reg_sample(assets, separator, metrics=metrics, offsets=offsets, windows=windows)
+                    write_table(df, data, separator, encoding='utf-8')
+                else:
+                    chunks = to_reg_sample(assets, separator, metrics=metrics, offsets=offsets, windows=windows, chunksize=args.chunksize)
+                    write_table_chunks(chunks, data, separator, encoding='utf-8')
+            case Command.NEAREST:
+                df = read_table(assets, separator)
+                gdf = read_nearest_features(geometry, df['latitude'], df['longitude'], verbose=verbose)
+                index = nearest_index(gdf, utm_crs(geometry))
+                result = nearest(gdf, df['latitude'], df['longitude'], index, verbose=verbose, metrics=metrics)
+                for column in result.columns:
+                    df[f'nearest_{column}'] = result[column].to_numpy()
+                write_table(df, data, separator)
+            case Command.LOSS_AREA:
+                df = read_table(assets, separator)
+                distance = file_distance(geometry, args.distance, df['latitude'])
+                gdf = read_features(geometry, df['latitude'], df['longitude'], distance, verbose=verbose)
+                result = to_assets_with_loss_area(df, gdf, args.distance, utm_crs(geometry), verbose=verbose, metrics=metrics)
+                df = df.merge(result, how='left', left_on='uid_gem', right_index=True, validate='one_to_one')
+                write_table(df, data, separator)
+            case Command.PREFETCH:
+                budget = None if args.budget is None else int(args.budget * 1e9)
+                tile_cache = TileCache('data', budget, args.hansen_version, transcode=args.transcode, verbose=verbose, metrics=metrics)
+                layers = tile_cache.prefetch(assets, separator)
+                print(f'Cached {sum(len(files) for files in layers.values())} tiles, {tile_cache.size()} bytes in data/.')
+            case Command.PIPELINE:
+                offsets = None if args.offsets is None else range(args.offsets[0], args.offsets[1] + 1)
+                windows = None if args.windows is None else {
+                    name: tuple(int(year) for year in span.split(':')) for name, span in (spec.split('=') for spec in args.windows)
+                }
+                budget = None if args.budget is None else int(args.budget * 1e9)
+                tile_cache = TileCache('data', budget, args.hansen_version, transcode=args.transcode, verbose=verbose, metrics=metrics)
+                statuses = run_pipeline(tile_cache, offset, offsets, windows, verbose=verbose, metrics=metrics, force=args.force)
+                ran = [name for name, status in statuses.items() if status == Pipeline.Status.RAN]
+                print(f'Ran {len(ran)} of {len(statuses)} stages: {", ".join(ran)}')
+            case Command.OWNERS:
+                entities = process_and_save_owner_entities()
+                print(f'Resolved {len(entities)} owner names to {entities["owner_id"].nunique()} owners.')
+
+
+    if metrics is not None:
+        metrics.write(args.metrics, args.metrics_format)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
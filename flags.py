@@ -1,4 +1,7 @@
 from pathlib import PurePath, Path
 
 PATH_TO_INPUT_FOLDER=Path.cwd().joinpath('data')
-PATH_TO_OUTPUT_FOLDER=Path.cwd().joinpath('data')
\ No newline at end of file
+PATH_TO_OUTPUT_FOLDER=Path.cwd().joinpath('data')
+
+# file format of the tables passed between stages: 'parquet', 'feather' or 'csv'
+TABLE_FORMAT='parquet'
@@ -1,17 +1,65 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 from sklearn.preprocessing import LabelEncoder
 
+from flags import TABLE_FORMAT
+from leaf.storage import read_table, write_table
+from leaf.schema import apply_schema
+
+from typing import NamedTuple
+
+
+class UnitGroups(NamedTuple):
+    """The units of each asset as a range of rows of the units sorted by asset, see unit_groups."""
+    order: np.ndarray       # the positions of the units sorted by asset
+    starts: np.ndarray      # the position of the first unit of each asset in the sorted units
+    counts: np.ndarray      # the number of units of each asset
+    offsets: np.ndarray     # starts followed by the number of units, as the offsets of an Arrow list array
+
+def unit_groups(keys: pd.Series) -> UnitGroups:
+    """Group units by their asset with a single stable sort.
+
+    The assets are in the order in which they first appear, and the units of an asset
+    in their order. Units without an asset are left out.
+
+    Args:
+        keys (pd.Series): The asset of each unit e.g. uid_gem.
+
+    Returns:
+        UnitGroups: The groups.
+    """
+    codes, _ = pd.factorize(keys)
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    _, starts, counts = np.unique(codes[order], return_index=True, return_counts=True)
+    offsets = np.append(starts, len(order)).astype(np.int32)
+    return UnitGroups(order, starts, counts, offsets)
+
+def to_lists(values: pd.Series, offsets: np.ndarray) -> pd.Series:
+    """The values of the units of each asset as a list column, see unit_groups.
+
+    Args:
+        values (pd.Series): The values of the units, sorted by asset.
+        offsets (np.ndarray): The offsets of the assets.
+
+    Returns:
+        pd.Series: An array of values per asset, written as a nested column to Parquet and Feather.
+    """
+    lists = pa.ListArray.from_arrays(pa.array(offsets), pa.array(values, from_pandas=True))
+    return pd.Series(lists.to_pandas(), dtype=object)
+
     
 def gem_data_for_ml(gem_data):
     
-    df_gem = pd.read_csv(gem_data, low_memory=False)
+    df_gem = apply_schema(read_table(gem_data, low_memory=False))
 
     # coerce start year into numerical format
     for var in ['start_year', 'capacity']:
         df_gem[var] = pd.to_numeric(df_gem[var], errors='coerce') 
 
     # drop all observations with a missing start_year
-    df_gem = df_gem[df_gem.start_year.notnull()].reset_index()
+    df_gem = df_gem[df_gem.start_year.notnull()].reset_index(drop=True)
 
     # drop all observations with a start year outside of 2001-2022
     df_gem = df_gem[df_gem.start_year.between(2001, 2023)]
@@ -34,43 +82,33 @@ def gem_data_for_ml(gem_data):
 
     #=========================================================
     # AGGREGATE TO ASSET LEVEL (ON UID_GEM)
-    
-    # step 1: aggregate unit-specific information by uid_gem
-
-    cols_for_agg = ['capacity', 'start_year', 'sector_sub', 'uid_gem']
-
-    # 1a: first observaitons 
-    df_gem_first = df_gem[cols_for_agg].groupby('uid_gem').nth(0) \
-                        .rename(columns={'start_year': 'start_year_first', 
-                                            'capacity': 'capacity_first', 
-                                            'sector_sub': 'sector_sub_first'}).reset_index()
-
-    assert(len(df_gem_first) == df_gem_first.uid_gem.nunique())
-
-    # 1b: list of info for subsequent units
-    df_gem_list = df_gem[cols_for_agg].groupby('uid_gem').agg(list).reset_index()
-
-    assert(len(df_gem_list) == df_gem_list.uid_gem.nunique())
 
-    # step 2: keep non-changing information about each asset
+    # step 1: sort the units by uid_gem once, in the order in which the assets first appear
+    groups = unit_groups(df_gem.uid_gem)
+    units = df_gem.iloc[groups.order]
 
+    # step 2: keep non-changing information about each asset, from its first unit
     invariant_cols = ['latitude', 'longitude', 'uid_gem', 'sector_main', 'sector_main_num', 
                 'capacity_unit', 'country', 'asset_name', 'owner_name']
 
-    df_gem_invariant = df_gem[invariant_cols].drop_duplicates('uid_gem', keep='first')
+    first = units.iloc[groups.starts]
+    df_gem = first[invariant_cols].reset_index(drop=True)
 
-    assert(len(df_gem_invariant) == df_gem_invariant.uid_gem.nunique())
+    # step 3: first observations and the list of info of all units
+    cols_for_agg = ['capacity', 'start_year', 'sector_sub']
 
-    # merge aggregated datasets 
-    df_gem = pd.merge(df_gem_invariant, df_gem_first, on = 'uid_gem')
-    df_gem = pd.merge(df_gem, df_gem_list, on = 'uid_gem').reset_index(drop=True)
+    for col in cols_for_agg:
+        df_gem[f'{col}_first'] = first[col].to_numpy()
+    for col in cols_for_agg:
+        df_gem[col] = to_lists(units[col], groups.offsets)
 
     # retrieve number of units within an asset
-    df_gem['number_units'] = df_gem.start_year.apply(lambda x: len(x))
+    df_gem['number_units'] = groups.counts
 
     # check lenght of data 
     assert(len(df_gem) == df_gem.uid_gem.nunique())
     
     # export data
-    df_gem.to_csv('data/assets_for_deforestation.csv', index=False, sep='\t', encoding='utf-8')
+    df_gem = apply_schema(df_gem)
+    write_table(df_gem, f'data/assets_for_deforestation.{TABLE_FORMAT}', separator='\t', encoding='utf-8')
 
@@ -12,41 +12,146 @@ import rioxarray as rx
 import xarray as xr
 from shapely.geometry import Polygon
 from shapely.geometry import Point
+from shapely import STRtree
+import shapely
 
-from concurrent.futures import (ThreadPoolExecutor, wait)
+from sklearn.neighbors import KDTree
+
+from concurrent.futures import (ThreadPoolExecutor, as_completed, wait)
 import requests
 import threading
 
 from string import Template
 import itertools as it
 from functools import partial
+from contextlib import nullcontext
 from tqdm import tqdm
 import time
+import json
 import math
 import os
-import shutil
 
+from leaf.metrics import Metrics, NO_METRICS
+from leaf.remote import remote
+from leaf.storage import (read_table, read_table_chunks, write_table)
+from leaf.schema import apply_schema
 
-from typing import Tuple, Optional, List
+from typing import Tuple, Optional, List, NamedTuple, Sequence, Union, Iterator
 
 def closest_index(gdf: gpd.GeoDataFrame, lat: float, long: float, year: int, verbose: bool = False) -> Tuple[float, int]:
-    """_summary_
+    """Query the index of the polygon closest to a given GPS location.
+
+    For more than a handful of locations use nearest, which builds its index only once.
 
     Args:
-        gdf (gpd.GeoDataFrame): _description_
-        lat (float): _description_
-        long (float): _description_
-        year (int): _description_
-        verbose (bool, optional): _description_. Defaults to False.
+        gdf (gpd.GeoDataFrame): The DataFrame to query.
+        lat (float): The latitude of the GPS coordinate.
+        long (float): The longitude of the GPS coordinate.
+        year (int): Unused.
+        verbose (bool, optional): Print additional information to console. Defaults to False.
 
     Returns:
-        Tuple[float, int]: _description_
+        Tuple[float, int]: The index into gdf of the closest polygon.
     """
     if verbose:
         print(f'location: [{lat}, {long}]')
 
-    distances = gdf.distance(Point(lat, long)).sort_values()
-    return distances.index[0]
+    return nearest(gdf, [lat], [long], verbose=verbose)['index'].iloc[0]
+
+class NearestIndex(NamedTuple):
+    """A KD-tree over polygon centroids and an STRtree over the polygons, in a metric CRS."""
+    crs: rio.crs.CRS
+    centroids: KDTree
+    tree: STRtree
+    geometries: np.ndarray
+
+def nearest_index(gdf: gpd.GeoDataFrame, crs: Optional[str] = None) -> NearestIndex:
+    """Build the indices used by nearest over the polygons of the GeoDataFrame.
+
+    Args:
+        gdf (gpd.GeoDataFrame): The DataFrame to index e.g. from to_lossyear_timeseries.
+        crs (Optional[str], optional): A metric CRS for distances. Defaults to None, for the UTM zone of gdf.
+
+    Returns:
+        NearestIndex: The indices, built in the metric CRS.
+    """
+    crs = gdf.estimate_utm_crs() if crs is None else crs
+    geometries = gdf.geometry.to_crs(crs).to_numpy()
+    centroids = shapely.get_coordinates(shapely.centroid(geometries))
+
+    return NearestIndex(crs, KDTree(centroids), STRtree(geometries), geometries)
+
+def nearest(gdf: gpd.GeoDataFrame, lats: Sequence[float], longs: Sequence[float], index: Optional[NearestIndex] = None, k: int = 8, verbose: bool = False, metrics: Optional[Metrics] = None) -> pd.DataFrame:
+    """Query the closest polygon, its distance and its lossyear for many GPS locations at once.
+
+    The k nearest centroids give an upper bound on the distance to the closest polygon,
+    which is then refined against the true geometries with an STRtree.
+
+    Args:
+        gdf (gpd.GeoDataFrame): The DataFrame to query, which should include Series 'lossyear'.
+        lats (Sequence[float]): The latitudes of the GPS coordinates.
+        longs (Sequence[float]): The longitudes of the GPS coordinates.
+        index (Optional[NearestIndex], optional): A prebuilt nearest_index(gdf). Defaults to None, to build one.
+        k (int, optional): The number of nearest centroids used for the upper bound. Defaults to 8.
+        verbose (bool, optional): Print additional information to console. Defaults to False.
+        metrics (Optional[Metrics], optional): Receives the duration of each stage. Defaults to None.
+
+    Returns:
+        pd.DataFrame: Per location, the 'index' into gdf of the closest polygon, the 'distance' in units of the metric CRS and its 'lossyear', missing for a location without coordinates.
+    """
+    class Token:
+        INDEX = 'index'
+        DISTANCE = 'distance'
+        VARIABLE = 'lossyear'
+
+    metrics = NO_METRICS if metrics is None else metrics
+    labels = {'function': 'nearest'}
+
+    lats = np.asarray(lats, dtype=float)
+    longs = np.asarray(longs, dtype=float)
+
+    if len(lats) == 0 or len(gdf) == 0:
+        return pd.DataFrame({Token.INDEX: [None] * len(lats), Token.DISTANCE: np.nan, Token.VARIABLE: np.nan})
+
+    with metrics.stage('index', **labels):
+        index = nearest_index(gdf) if index is None else index
+
+    with metrics.stage('transform', **labels):
+        from_crs = rio.crs.CRS.from_epsg(4326)
+        xs, ys = transform(from_crs, index.crs, longs, lats)
+        points = shapely.points(xs, ys)
+
+    result = pd.DataFrame({Token.INDEX: [None] * len(lats), Token.DISTANCE: np.nan, Token.VARIABLE: np.nan})
+
+    # locations without coordinates have no closest polygon
+    valid = np.flatnonzero(np.isfinite(xs) & np.isfinite(ys))
+    if len(valid) == 0:
+        return result
+
+    with metrics.stage('query', **labels):
+        k = min(k, len(index.geometries))
+        _, candidates = index.centroids.query(np.column_stack([xs, ys])[valid], k=k)
+        bounds = shapely.distance(points[valid, np.newaxis], index.geometries[candidates]).min(axis=1)
+
+        # every polygon closer than the bound is a candidate, so the minimum over them is exact
+        query, tree = index.tree.query(points[valid], predicate='dwithin', distance=bounds * (1 + 1e-9) + 1e-9)
+        query = valid[query]
+        distances = shapely.distance(points[query], index.geometries[tree])
+        order = np.lexsort((tree, distances, query))
+        query, tree, distances = query[order], tree[order], distances[order]
+        found, first = np.unique(query, return_index=True)
+        closest = tree[first]
+
+    metrics.count('assets', len(lats), **labels)
+
+    result.loc[found, Token.INDEX] = gdf.index.to_numpy()[closest]
+    result.loc[found, Token.DISTANCE] = distances[first]
+    result.loc[found, Token.VARIABLE] = gdf[Token.VARIABLE].to_numpy()[closest]
+
+    if verbose:
+        print(result.describe())
+
+    return result
 
 def window(gdf: gpd.GeoDataFrame) -> Tuple[float, float, float, float]:
     """Query the 'total_bounds' of the GeoDataFrame.
@@ -69,43 +174,143 @@ def area(gdf: gpd.GeoDataFrame, lat: float, long: float, year: int, verbose: boo
     """Query the deforestation area for a given GPS location and year.
 
     The GeoDataFrame should include Series 'area' where all values are in gdf.crs.
+    For more than a handful of locations use areas, which builds its index only once.
 
     Args:
         gdf (gpd.GeoDataFrame): The DataFrame to query.
         lat (float): The latitude of the GPS coordinate.
         long (float): The longitude of the GPS coordinate.
-        year (int): The deforestation year.
+        year (int): The deforestation year, or None for any year.
         verbose (bool, optional): Print additional information to console. Defaults to False.
 
     Returns:
         Optional[float]: The 'area' in EPSG:4326 or None if 'area' is missing or location does not match.
     """
-    to_crs = gdf.crs
-    from_crs = rio.crs.CRS.from_epsg(4326)
-    x, y = transform(from_crs, to_crs, [long], [lat])
-    pt = Point(x, y)
-
-    # TODO: there should be 0 or 1 matches but maybe we should check?
-    mask = gdf.geometry.contains(pt)
-    first_valid_index = None if not mask.any() else gdf.loc[mask].index[0]
-    area = None if first_valid_index == None else gdf.iloc[first_valid_index]['area']
-
     if verbose:
         print(f'shape: {gdf.shape}')
         print(gdf.head())
-        print(f'location: [{lat}, {long}], in CRS: {pt}, index: {first_valid_index}')
-        if not first_valid_index == None:
-            print(f'geometry: {gdf.iloc[first_valid_index]}')
 
-    return area
+    result = areas(gdf, [lat], [long], [year], verbose=verbose)[0]
+
+    return None if np.isnan(result) else result
+
+class LossyearIndex(NamedTuple):
+    """Spatial indices over the polygons of a GeoDataFrame, partitioned by lossyear.
+
+    The key None holds an index over all polygons, for queries without a year.
+    """
+    trees: dict
+    positions: dict
+
+def lossyear_index(gdf: gpd.GeoDataFrame) -> LossyearIndex:
+    """Build an STRtree per lossyear over the polygons of the GeoDataFrame.
+
+    Args:
+        gdf (gpd.GeoDataFrame): The DataFrame to index e.g. from to_lossyear_timeseries.
+
+    Returns:
+        LossyearIndex: The STRtree, and the positions into gdf of its polygons, per lossyear.
+    """
+    class Token:
+        VARIABLE = 'lossyear'
+
+    geometries = gdf.geometry.to_numpy()
+    years = pd.to_numeric(gdf[Token.VARIABLE], errors='coerce').to_numpy()
+
+    trees = {None: STRtree(geometries)}
+    positions = {None: np.arange(len(gdf))}
+    for year in np.unique(years[~np.isnan(years)]):
+        indices = np.flatnonzero(years == year)
+        trees[int(year)] = STRtree(geometries[indices])
+        positions[int(year)] = indices
+
+    return LossyearIndex(trees, positions)
+
+def areas(gdf: gpd.GeoDataFrame, lats: Sequence[float], longs: Sequence[float], years: Optional[Sequence[int]] = None, index: Optional[LossyearIndex] = None, verbose: bool = False, metrics: Optional[Metrics] = None) -> np.ndarray:
+    """Query the deforestation area for many GPS locations and years at once.
+
+    The GeoDataFrame should include Series 'area' and 'lossyear'. All locations are 
+    reprojected in one call and each year is answered with a single bulk query
+    against its partition of the index.
+
+    Args:
+        gdf (gpd.GeoDataFrame): The DataFrame to query.
+        lats (Sequence[float]): The latitudes of the GPS coordinates.
+        longs (Sequence[float]): The longitudes of the GPS coordinates.
+        years (Optional[Sequence[int]], optional): The deforestation year per location, where None or NaN matches any year. Defaults to None for any year.
+        index (Optional[LossyearIndex], optional): A prebuilt lossyear_index(gdf). Defaults to None, to build one.
+        verbose (bool, optional): Print additional information to console. Defaults to False.
+        metrics (Optional[Metrics], optional): Receives the duration of each stage. Defaults to None.
+
+    Returns:
+        np.ndarray: The 'area' per location, or NaN if the location does not match.
+    """
+    class Token:
+        AREA = 'area'
+
+    metrics = NO_METRICS if metrics is None else metrics
+    labels = {'function': 'areas'}
+
+    lats = np.asarray(lats, dtype=float)
+    longs = np.asarray(longs, dtype=float)
+    years = np.full(len(lats), np.nan) if years is None else pd.to_numeric(pd.Series(years, dtype=object), errors='coerce').to_numpy(dtype=float)
+    result = np.full(len(lats), np.nan)
+
+    if len(lats) == 0 or len(gdf) == 0:
+        return result
+
+    with metrics.stage('index', **labels):
+        index = lossyear_index(gdf) if index is None else index
+
+    with metrics.stage('transform', **labels):
+        from_crs = rio.crs.CRS.from_epsg(4326)
+        xs, ys = transform(from_crs, gdf.crs, longs, lats)
+        points = shapely.points(xs, ys)
+
+    with metrics.stage('query', **labels):
+        values = gdf[Token.AREA].to_numpy(dtype=float)
+        keys = np.where(np.isnan(years), -1, years).astype(int)
+        for key in np.unique(keys):
+            year = None if key == -1 else int(key)
+            queries = np.flatnonzero(keys == key)
+            if year not in index.trees:
+                continue
+            query, tree = index.trees[year].query(points[queries], predicate='within')
+            if len(query) == 0:
+                continue
+            # there should be 0 or 1 matches per location, keep the first polygon if not
+            order = np.lexsort((tree, query))
+            query, tree = query[order], tree[order]
+            query, first = np.unique(query, return_index=True)
+            result[queries[query]] = values[index.positions[year][tree[first]]]
+
+    metrics.count('assets', len(lats), **labels)
+
+    if verbose:
+        print(f'Of {len(lats)} locations, {np.count_nonzero(~np.isnan(result))} are contained in an area of deforestation.')
+
+    return result
+
+def resolve(geoTIFF: str) -> str:
+    """The cloud-optimized copy of a cached tile if there is one, see leaf.tiles.TileCache.transcode.
+
+    Args:
+        geoTIFF (str): The path to a GeoTIFF file e.g. data/Hansen_GFC-2022-v1.10_lossyear_20S_060W.tif.
+
+    Returns:
+        str: e.g. data/cog/Hansen_GFC-2022-v1.10_lossyear_20S_060W.tif if it exists, otherwise geoTIFF.
+    """
+    cog = os.path.join(os.path.dirname(geoTIFF), 'cog', os.path.basename(geoTIFF))
+    return cog if os.path.isfile(cog) else geoTIFF
 
-def to_lossyear_timeseries(geoTIFF: str, window: Tuple[float, float, float, float] = None, verbose: bool = False) -> gpd.GeoDataFrame:
+def to_lossyear_timeseries(geoTIFF: str, window: Tuple[float, float, float, float] = None, verbose: bool = False, metrics: Optional[Metrics] = None) -> gpd.GeoDataFrame:
     """_summary_
 
     Args:
         geoTIFF (str): _description_
         window (Tuple[float, float, float, float], optional): _description_. Defaults to None.
         verbose (bool, optional): Print additional information to console. Defaults to False.
+        metrics (Optional[Metrics], optional): Receives the duration of each stage and the pixel counts. Defaults to None.
 
     Returns:
         gpd.GeoDataFrame: _description_
@@ -128,9 +333,14 @@ def to_lossyear_timeseries(geoTIFF: str, window: Tuple[float, float, float, floa
     if verbose:
         print(f'geoTIFF: {geoTIFF}, window: {window}')
 
+    metrics = NO_METRICS if metrics is None else metrics
+    labels = {'function': 'to_lossyear_timeseries'}
+
+    geoTIFF = resolve(geoTIFF)
+
     with rio.open(geoTIFF) as src:
 
-        start_time = time.time()
+        start_time = time.perf_counter()
 
         if verbose:
             print(src.profile)
@@ -146,9 +356,14 @@ def to_lossyear_timeseries(geoTIFF: str, window: Tuple[float, float, float, floa
 
         band = src.read(BAND_INDEX, window=Window(window[0], window[1], window[2], window[3]))
 
-        read_time = time.time()
+        read_time = time.perf_counter()
 
         mask = band != 0
+
+        metrics.count('pixels', band.size, **labels)
+        metrics.count('loss_pixels', np.count_nonzero(mask), **labels)
+        metrics.count('bytes_read', band.nbytes, **labels)
+
         # Object holding a feature collection that implements the __geo_interface__
         results = (
             {'properties': {Token.VARIABLE: v}, 'geometry': s}
@@ -159,7 +374,7 @@ def to_lossyear_timeseries(geoTIFF: str, window: Tuple[float, float, float, floa
         geoms=list(results)
         gdf = gpd.GeoDataFrame.from_features(geoms, crs=src.crs)
 
-        shapes_time = time.time()
+        shapes_time = time.perf_counter()
 
         if verbose:
             print(f'Window results in GeoDataFrame of shape: {gdf.shape}')
@@ -170,7 +385,7 @@ def to_lossyear_timeseries(geoTIFF: str, window: Tuple[float, float, float, floa
         intersects.reset_index(inplace=True)
         intersects.rename(columns={'index': Token.INDEX_LEFT}, inplace=True)
 
-        sjoin_time = time.time()
+        sjoin_time = time.perf_counter()
 
         groups = intersects.groupby(Token.INDEX_LEFT)
         temp = intersects[intersects[Token.INDEX_LEFT] == intersects[Token.INDEX_RIGHT]].set_index(Token.INDEX_LEFT)
@@ -179,7 +394,7 @@ def to_lossyear_timeseries(geoTIFF: str, window: Tuple[float, float, float, floa
         temp[Token.VARIABLE] = temp[Token.VARIABLE_LEFT].astype("int") + 2000
         temp.drop([Token.INDEX_RIGHT, Token.VARIABLE_LEFT, Token.VARIABLE_RIGHT], axis=1, inplace=True)
 
-        start = time.time()
+        start = time.perf_counter()
         counter = it.count()
 
         indices = temp[Token.INDICES].to_numpy()
@@ -189,7 +404,7 @@ def to_lossyear_timeseries(geoTIFF: str, window: Tuple[float, float, float, floa
             first_valid_index = groups.loc[array].first_valid_index()
             id = i if first_valid_index == None else groups.loc[first_valid_index]
             groups.loc[array] = id
-        end = time.time()
+        end = time.perf_counter()
 
         #if verbose:
             #print(f'Loop over {len(temp)} took {end-start}s')
@@ -197,22 +412,22 @@ def to_lossyear_timeseries(geoTIFF: str, window: Tuple[float, float, float, floa
         temp[Token.GROUP_ID] = groups.copy()
         temp.drop(Token.INDICES, axis=1, inplace=True)
 
-        group_time = time.time()
+        group_time = time.perf_counter()
 
         # dissolve based on lossyear to generate any MULTIPOLYGON from disjoint geometry from same lossyear...
         temp2 = temp.dissolve(
             [Token.GROUP_ID, Token.VARIABLE]
         )
 
-        dissolve_time = time.time()
+        dissolve_time = time.perf_counter()
 
         group_ids = temp2.index.get_level_values(0).unique()
-        lossyears = [str(lossyear) for lossyear in range(2001, 2023)]
+        lossyears = list(range(2001, 2023))
 
         index = pd.MultiIndex.from_tuples(tuples=it.product(group_ids, lossyears), names=(Token.GROUP_ID, Token.VARIABLE))
         temp3 = temp2.reindex(index)
 
-        reindex_time = time.time()
+        reindex_time = time.perf_counter()
 
         # geodetic coordinates (e.g. 4826) to meters (e.g. 3857) and vice-versa
 
@@ -220,7 +435,7 @@ def to_lossyear_timeseries(geoTIFF: str, window: Tuple[float, float, float, floa
         proj_3857 = temp3.to_crs(epsg=3347) # lambert projection
         temp3[Token.AREA] = proj_3857.geometry.area
 
-        area_time = time.time()
+        area_time = time.perf_counter()
 
         #temp3['cum_area'] = proj_3857.groupby(group_id).area.cumsum()
 
@@ -233,10 +448,113 @@ def to_lossyear_timeseries(geoTIFF: str, window: Tuple[float, float, float, floa
         if verbose:
             print(f'...and a final GeoDataFrame of .shape: {temp3.shape}')
 
-        end_time = time.time()
+        end_time = time.perf_counter()
+
+        stages = [('read', start_time, read_time), 
+                  ('shapes', read_time, shapes_time), 
+                  ('sjoin', shapes_time, sjoin_time), 
+                  ('group', sjoin_time, group_time), 
+                  ('dissolve', group_time, dissolve_time), 
+                  ('reindex', dissolve_time, reindex_time), 
+                  ('area', reindex_time, area_time), 
+                  ('total', start_time, end_time)]
+        for stage, begin, end in stages:
+            metrics.timing(stage, end - begin, **labels)
+        metrics.count('polygons', len(temp3), **labels)
 
         return temp3
 
+def to_assets_with_loss_events(assets: pd.DataFrame, gdf: gpd.GeoDataFrame, distance: float = 5000, crs: Optional[str] = None, verbose: bool = False, metrics: Optional[Metrics] = None) -> pd.DataFrame:
+    """Join each asset to the loss events, from to_lossyear_timeseries, within a distance of it.
+
+    Every asset is buffered by 'distance' in a metric CRS, all buffers are matched against
+    the polygons with one STRtree query and the overlap areas are computed as arrays.
+
+    Args:
+        assets (pd.DataFrame): The assets, with Series 'uid_gem', 'latitude' and 'longitude'.
+        gdf (gpd.GeoDataFrame): The loss events, with Series 'lossyear'.
+        distance (float, optional): The buffer around each asset in units of the metric CRS. Defaults to 5000.
+        crs (Optional[str], optional): A metric CRS. Defaults to None, for the UTM zone of gdf.
+        verbose (bool, optional): Print additional information to console. Defaults to False.
+        metrics (Optional[Metrics], optional): Receives the duration of each stage. Defaults to None.
+
+    Returns:
+        pd.DataFrame: One row per asset and loss event with the 'index' into gdf, the 'lossyear',
+        the 'event_area' and the 'overlap' of the event with the buffer, in units of the metric CRS.
+    """
+    class Token:
+        INDEX = 'uid_gem'
+        EVENT = 'index'
+        VARIABLE = 'lossyear'
+        EVENT_AREA = 'event_area'
+        OVERLAP = 'overlap'
+
+    metrics = NO_METRICS if metrics is None else metrics
+    labels = {'function': 'to_assets_with_loss_events'}
+
+    crs = gdf.estimate_utm_crs() if crs is None else crs
+
+    with metrics.stage('buffer', **labels):
+        polygons = gdf.geometry.to_crs(crs).to_numpy()
+        from_crs = rio.crs.CRS.from_epsg(4326)
+        xs, ys = transform(from_crs, crs, assets.longitude.to_numpy(), assets.latitude.to_numpy())
+        buffers = shapely.buffer(shapely.points(xs, ys), distance)
+
+    with metrics.stage('query', **labels):
+        asset, event = STRtree(polygons).query(buffers, predicate='intersects')
+
+    with metrics.stage('intersection', **labels):
+        overlap = shapely.area(shapely.intersection(buffers[asset], polygons[event]))
+        event_area = shapely.area(polygons[event])
+
+    metrics.count('assets', len(assets), **labels)
+    metrics.count('pairs', len(asset), **labels)
+
+    result = pd.DataFrame({
+        Token.INDEX: assets[Token.INDEX].to_numpy()[asset],
+        Token.EVENT: gdf.index.to_numpy()[event],
+        Token.VARIABLE: gdf[Token.VARIABLE].to_numpy()[event],
+        Token.EVENT_AREA: event_area,
+        Token.OVERLAP: overlap
+    })
+
+    if verbose:
+        print(f'{result[Token.INDEX].nunique()} of {len(assets)} assets are within {distance} of {result[Token.EVENT].nunique()} loss events.')
+
+    return result
+
+def to_assets_with_loss_area(assets: pd.DataFrame, gdf: gpd.GeoDataFrame, distance: float = 5000, crs: Optional[str] = None, verbose: bool = False, metrics: Optional[Metrics] = None) -> pd.DataFrame:
+    """Aggregate to_assets_with_loss_events to the overlap area per asset and lossyear.
+
+    Args:
+        assets (pd.DataFrame): The assets, with Series 'uid_gem', 'latitude' and 'longitude'.
+        gdf (gpd.GeoDataFrame): The loss events, with Series 'lossyear'.
+        distance (float, optional): The buffer around each asset in units of the metric CRS. Defaults to 5000.
+        crs (Optional[str], optional): A metric CRS. Defaults to None, for the UTM zone of gdf.
+        verbose (bool, optional): Print additional information to console. Defaults to False.
+        metrics (Optional[Metrics], optional): Receives the duration of each stage. Defaults to None.
+
+    Returns:
+        pd.DataFrame: Indexed by 'uid_gem', for assets with at least one loss event, with a column
+        per lossyear e.g. 'loss_area_2001' holding the area of loss within the buffer. The prefix
+        keeps them apart from the year columns of to_assets_with_lossyear.
+    """
+    class Token:
+        INDEX = 'uid_gem'
+        VARIABLE = 'lossyear'
+        OVERLAP = 'overlap'
+        PREFIX = 'loss_area_'
+
+    events = to_assets_with_loss_events(assets, gdf, distance, crs, verbose, metrics)
+
+    lossyears = [f'{Token.PREFIX}{lossyear}' for lossyear in range(2001, 2023)]
+    events[Token.VARIABLE] = Token.PREFIX + events[Token.VARIABLE].astype(int).astype(str)
+    result = events.pivot_table(index=Token.INDEX, columns=Token.VARIABLE, values=Token.OVERLAP, aggfunc='sum', fill_value=0)
+    result = result.reindex(columns=lossyears, fill_value=0)
+    result.columns.name = None
+
+    return result
+
 def safe_floor(value: float) -> int:
     """_summary_
 
@@ -248,7 +566,7 @@ def safe_floor(value: float) -> int:
     """
     return -1 if math.isnan(value) else math.floor(value)
 
-def to_assets_with_treecover2000(geoTIFF: str, GEMFile: str, separator: str, window: Tuple[float, float, float, float] = None, verbose: bool = False) -> pd.DataFrame:
+def to_assets_with_treecover2000(geoTIFF: str, GEMFile: str, separator: str, window: Tuple[float, float, float, float] = None, verbose: bool = False, metrics: Optional[Metrics] = None) -> pd.DataFrame:
     """_summary_
 
     Args:
@@ -257,6 +575,7 @@ def to_assets_with_treecover2000(geoTIFF: str, GEMFile: str, separator: str, win
         separator (str): _description_
         window (Tuple[float, float, float, float], optional): _description_. Defaults to None.
         verbose (bool, optional): _description_. Defaults to False.
+        metrics (Optional[Metrics], optional): Receives the duration of each stage and the asset and pixel counts. Defaults to None.
 
     Returns:
         pd.DataFrame: _description_
@@ -274,7 +593,16 @@ def to_assets_with_treecover2000(geoTIFF: str, GEMFile: str, separator: str, win
 
     lookup = np.vectorize(select, excluded=[Token.XDARRAY], cache=False)
 
-    assets = pd.read_csv(GEMFile, sep=separator)
+    metrics = NO_METRICS if metrics is None else metrics
+    labels = {'function': 'to_assets_with_treecover2000'}
+
+    start_time = time.perf_counter()
+
+    assets = apply_schema(read_table(GEMFile, separator))
+
+    read_time = time.perf_counter()
+    metrics.timing('read_assets', read_time - start_time, **labels)
+    metrics.count('assets', len(assets), **labels)
 
     if verbose:
         print(f'{GEMFile}')
@@ -285,7 +613,7 @@ def to_assets_with_treecover2000(geoTIFF: str, GEMFile: str, separator: str, win
     assert assets[Token.INDEX].nunique() == len(assets)
     assets = assets.set_index(Token.INDEX)
 
-    with rx.open_rasterio(geoTIFF).squeeze() as xda:
+    with rx.open_rasterio(resolve(geoTIFF)).squeeze() as xda:
     
         if verbose:
             print(f'{geoTIFF}')
@@ -314,12 +642,21 @@ def to_assets_with_treecover2000(geoTIFF: str, GEMFile: str, separator: str, win
         if verbose:
             print(f'{len(np_row)} {len(np_col)}')
 
+        transform_time = time.perf_counter()
+        metrics.timing('transform', transform_time - read_time, **labels)
+        metrics.count('assets_sampled', len(local_assets), **labels)
+
         if len(np_row) == 0 or len(np_col) == 0:
             return assets
 
         # Nota bene: Robert Norris - np.vectorize is consistently a little quicker than apply... %timeit 
         result = lookup(row=np_row, col=np_col, xdarray=xda)
 
+        sample_time = time.perf_counter()
+        metrics.timing('sample', sample_time - transform_time, **labels)
+        metrics.count('pixels', len(local_assets), **labels)
+        metrics.count('bytes_read', len(local_assets) * xda.dtype.itemsize, **labels)
+
         local_assets[Token.TREECOVER2000] = pd.Series(result, index=local_assets.index)
 
         mergeable_columns = local_assets.columns.difference(assets.columns)
@@ -327,9 +664,11 @@ def to_assets_with_treecover2000(geoTIFF: str, GEMFile: str, separator: str, win
         assets = assets.merge(mergeable_local_assets, how='left', validate='one_to_one', left_on=Token.INDEX, right_on=Token.INDEX)
         assets.update(local_assets)
 
+        metrics.timing('merge', time.perf_counter() - sample_time, **labels)
+
     return assets
 
-def to_assets_with_lossyear(geoTIFF: str, GEMFile: str, separator: str, offset: int = 16, window: Tuple[float, float, float, float] = None, verbose: bool = False) -> pd.DataFrame:
+def to_assets_with_lossyear(geoTIFF: str, GEMFile: str, separator: str, offset: int = 16, window: Tuple[float, float, float, float] = None, verbose: bool = False, metrics: Optional[Metrics] = None) -> pd.DataFrame:
     """_summary_
 
     Args:
@@ -339,6 +678,7 @@ def to_assets_with_lossyear(geoTIFF: str, GEMFile: str, separator: str, offset:
         offset (int, optional): _description_. Defaults to 16.
         window (Tuple[float, float, float, float], optional): _description_. Defaults to None.
         verbose (bool, optional): _description_. Defaults to False.
+        metrics (Optional[Metrics], optional): Receives the duration of each stage and the asset and pixel counts. Defaults to None.
 
     Returns:
         pd.DataFrame: _description_
@@ -366,7 +706,16 @@ def to_assets_with_lossyear(geoTIFF: str, GEMFile: str, separator: str, offset:
 
     lookup = np.vectorize(select, excluded=[Token.XDARRAY, Token.OFFSET], cache=False)
 
-    assets = pd.read_csv(GEMFile, sep=separator)
+    metrics = NO_METRICS if metrics is None else metrics
+    labels = {'function': 'to_assets_with_lossyear'}
+
+    start_time = time.perf_counter()
+
+    assets = apply_schema(read_table(GEMFile, separator))
+
+    read_time = time.perf_counter()
+    metrics.timing('read_assets', read_time - start_time, **labels)
+    metrics.count('assets', len(assets), **labels)
     
     if verbose:
         print(f'{GEMFile}')
@@ -377,7 +726,7 @@ def to_assets_with_lossyear(geoTIFF: str, GEMFile: str, separator: str, offset:
     assert assets[Token.INDEX].nunique() == len(assets)
     assets = assets.set_index(Token.INDEX)
 
-    with rx.open_rasterio(geoTIFF).squeeze() as xda:
+    with rx.open_rasterio(resolve(geoTIFF)).squeeze() as xda:
 
         if verbose:
             print(f'{geoTIFF}')
@@ -413,12 +762,22 @@ def to_assets_with_lossyear(geoTIFF: str, GEMFile: str, separator: str, offset:
             if len(np_row) == 0 or len(np_col) == 0:
                 print(f'No assets match to {geoTIFF}')
 
+        transform_time = time.perf_counter()
+        metrics.timing('transform', transform_time - read_time, **labels)
+        metrics.count('assets_sampled', len(local_assets), **labels)
+
         if len(np_row) == 0 or len(np_col) == 0:
             return assets
 
         # Nota bene: Robert Norris - np.vectorize is consistently a little quicker than apply... %timeit 
         result = lookup(row=np_row, col=np_col, xdarray=xda, offset=offset)
 
+        sample_time = time.perf_counter()
+        pixels = len(local_assets) * (offset*2+1)**2
+        metrics.timing('sample', sample_time - transform_time, **labels)
+        metrics.count('pixels', pixels, **labels)
+        metrics.count('bytes_read', pixels * xda.dtype.itemsize, **labels)
+
         local_assets[Token.REGION] = pd.Series(result, index=local_assets.index)
         columns = local_assets.columns.drop(Token.REGION)
         # expand to columns i.e. to wide format... indexed by uid_gem
@@ -441,6 +800,8 @@ def to_assets_with_lossyear(geoTIFF: str, GEMFile: str, separator: str, offset:
         assets = assets.merge(mergeable_local_assets, how='left', validate='one_to_one', left_on=Token.INDEX, right_on=Token.INDEX)
         assets.update(local_assets)
 
+        metrics.timing('merge', time.perf_counter() - sample_time, **labels)
+
     return assets
 
 def to_degrees(lat: int, long: int, step: int = 10) -> Tuple[str, str]:
@@ -462,182 +823,432 @@ def to_degrees(lat: int, long: int, step: int = 10) -> Tuple[str, str]:
     clat = div_lat * step if mod_lat == 0 else (div_lat + 1) * step
     clong = div_long * step if mod_long == 0 else (div_long) * step
     slat = 'S' if clat < 0 else 'N'
-    slong = 'E' if clong > 0 else 'W'
+    slong = 'E' if clong >= 0 else 'W'
     return (f'{abs(clat):>02}' + slat, f'{abs(clong):>03}' + slong)
 
-def download_file(session: requests.Session, url, path, verbose: bool = False) -> str:
-    """_summary_
+HANSEN_VERSION = 'GFC-2022-v1.10'
+HANSEN_BASE_URL = 'https://storage.googleapis.com/earthenginepartners-hansen'
+HANSEN_URL = f'{HANSEN_BASE_URL}/{HANSEN_VERSION}'
+
+thread_local = threading.local()
+
+def get_session() -> requests.Session:
+    """The requests.Session of the calling thread, so that each download worker has its own.
+
+    Returns:
+        requests.Session: A session created on first use by this thread.
+    """
+    if not hasattr(thread_local, 'session'):
+        thread_local.session = requests.Session()
+    return thread_local.session
+
+def download_file(session: Optional[requests.Session], url, path, verbose: bool = False, metrics: Optional[Metrics] = None) -> int:
+    """Download url to path, atomically and resumably.
+
+    The data is written to path + '.part' which is renamed to path only once complete,
+    so an interrupted download is never mistaken for a cached file. The ETag, or else the
+    Last-Modified, of the response that started the .part file is kept in path +
+    '.part.json'. A later call resumes the .part file with an HTTP Range request whose
+    If-Range is that validator, so the server sends the whole file again if it changed
+    meanwhile. A .part file without a validator, or one that the server cannot resume
+    e.g. as it is larger than the file, is downloaded again from the start.
 
     Args:
-        session (requests.Session): _description_
-        url (_type_): _description_
-        path (_type_): _description_
+        session (Optional[requests.Session]): The session to use, or None for that of the calling thread.
+        url (_type_): The URL to download.
+        path (_type_): The local path to write.
+        verbose (bool, optional): Print additional information to console. Defaults to False.
+        metrics (Optional[Metrics], optional): Receives the download duration and bytes. Defaults to None.
+
+    Raises:
+        IOError: If fewer bytes arrived than the server announced; the .part file is kept for resuming.
 
     Returns:
-        str: _description_
+        int: The number of bytes downloaded by this call.
     """
+    class Status:
+        PARTIAL_CONTENT = 206
+        RANGE_NOT_SATISFIABLE = 416
 
     if verbose:
         print(f'download_file {path} from {url}')
 
-    with session.get(url, stream=False) as response:
-        response.raise_for_status()
-        with open(path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192): 
-                f.write(chunk)
+    session = get_session() if session is None else session
+    metrics = NO_METRICS if metrics is None else metrics
+    labels = {'function': 'download_file'}
 
-    return path
+    temp = f'{path}.part'
+    validator_path = f'{temp}.json'
+    try:
+        with open(validator_path, 'r') as f:
+            validator = json.load(f)['validator']
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        validator = None
 
-def cache(session: requests.Session, root: str, files: List[str], base_url: str, verbose: bool = False):
-    """_summary_
+    offset = os.path.getsize(temp) if os.path.isfile(temp) and validator is not None else 0
+    headers = {'Range': f'bytes={offset}-', 'If-Range': validator} if offset > 0 else {}
+
+    size = 0
+    with metrics.stage('download', **labels):
+        with session.get(url, headers=headers, stream=True, timeout=60) as response:
+
+            if response.status_code == Status.RANGE_NOT_SATISFIABLE:
+                if response.headers.get('Content-Range') == f'bytes */{offset}':
+                    # the .part file is already complete e.g. interrupted before the rename
+                    os.replace(temp, path)
+                    os.remove(validator_path)
+                    return size
+                # the .part file is larger than the file, so start over
+                os.remove(temp)
+                os.remove(validator_path)
+                return download_file(session, url, path, verbose, metrics)
+
+            response.raise_for_status()
+
+            if offset > 0 and response.status_code != Status.PARTIAL_CONTENT:
+                offset = 0 # the server ignored the Range, or the file changed, so start over
+
+            if offset == 0:
+                validator = response.headers.get('ETag', response.headers.get('Last-Modified'))
+                if validator is None:
+                    if os.path.isfile(validator_path):
+                        os.remove(validator_path)
+                else:
+                    with open(validator_path, 'w') as f:
+                        json.dump({'url': url, 'validator': validator}, f)
+
+            length = response.headers.get('Content-Length')
+            expected = None if length is None else offset + int(length)
+
+            with open(temp, 'ab' if offset > 0 else 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+                    size += len(chunk)
+
+    metrics.count('bytes_downloaded', size, **labels)
+
+    if expected is not None and os.path.getsize(temp) != expected:
+        raise IOError(f'Incomplete download of {url}: {os.path.getsize(temp)} of {expected} bytes.')
+
+    os.replace(temp, path)
+    if os.path.isfile(validator_path):
+        os.remove(validator_path)
+
+    return size
+
+def cache(root: str, files: List[str], base_url: str, max_workers: int = 5, verbose: bool = False, metrics: Optional[Metrics] = None) -> dict:
+    """Download, concurrently, those files that are not in root already.
+
+    Each worker thread has its own requests.Session. See download_file for how partial
+    downloads are handled.
 
     Args:
-        session (requests.Session): _description_
-        data (str): _description_
-        files (List[str]): _description_
-        base_url (str): _description_
+        root (str): The local directory of the cache.
+        files (List[str]): The file names, relative to both root and base_url.
+        base_url (str): The URL to download from e.g. a local http.server for testing.
+        max_workers (int, optional): The number of concurrent downloads. Defaults to 5.
+        verbose (bool, optional): Print additional information to console. Defaults to False.
+        metrics (Optional[Metrics], optional): Receives the cache hits and misses. Defaults to None.
+
+    Returns:
+        dict: The number of 'files' downloaded, their 'bytes', the 'seconds' taken and the 'throughput' in bytes per second.
     """
+    metrics = NO_METRICS if metrics is None else metrics
+    labels = {'function': 'cache'}
+
+    os.makedirs(root, exist_ok=True)
     missing = [(f'{base_url}/{file}', f'{root}/{file}') for file in files if not os.path.isfile(f'{root}/{file}')]
-    #urls = [f'{base_url}/{file}' for file in files if not os.path.isfile(f'{root}/{file}')]
-    #locals = [f'{root}/{file}' for file in files if not os.path.isfile(f'{root}/{file}')]
+    metrics.count('cache_hits', len(files) - len(missing), **labels)
+    metrics.count('cache_misses', len(missing), **labels)
 
-    #session_download_file = partial(download_file, session=session, verbose=verbose)
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        for url, file in missing:
-            future = executor.submit(download_file, session=session, url=url, path=file, verbose=verbose)
-            _ = future.result()
-        #TODO why was the map a problem?
-        #for result in executor.map(session_download_file, urls, locals):
-            #print(f'submit {result}')
+    start = time.perf_counter()
+    size = 0
 
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(download_file, session=None, url=url, path=file, verbose=verbose, metrics=metrics) for url, file in missing]
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Cache missing files', disable=len(futures) == 0):
+            size += future.result()
 
-def cache_earthenginepartners_hansen(latitudes: range, longitudes: range, root: str = 'data', verbose: bool = False) -> dict:
-    """_summary_
+    seconds = time.perf_counter() - start
+    throughput = size / seconds if seconds > 0 else 0.0
+    metrics.timing('cache', seconds, **labels)
+
+    if verbose and len(missing) > 0:
+        print(f'Downloaded {len(missing)} files, {size} bytes in {seconds:.1f}s at {throughput / 2**20:.1f} MiB/s')
+
+    return {'files': len(missing), 'bytes': size, 'seconds': seconds, 'throughput': throughput}
+
+def file_earthenginepartners_hansen(layer: str, lat: int, long: int, version: str = HANSEN_VERSION) -> str:
+    """The Hansen tile file name for a layer and a latitude and longitude in degrees.
+
+    Args:
+        layer (str): The layer e.g. 'lossyear'.
+        lat (int): A latitude value.
+        long (int): A longitude value.
+        version (str, optional): The dataset version. Defaults to HANSEN_VERSION.
+
+    Returns:
+        str: The file name e.g. 'Hansen_GFC-2022-v1.10_lossyear_20S_060W.tif'.
+    """
+    slat, slong = to_degrees(lat, long)
+    t = Template('Hansen_${version}_${layer}_${lat}_${long}.tif')
+    filename = t.substitute({'version': version, 'layer': layer, 'lat': slat, 'long': slong})
+    return filename
+
+def files_earthenginepartners_hansen(layers: List[str], latitudes: range, longitudes: range, version: str = HANSEN_VERSION) -> dict:
+    """The Hansen tile file names covering the given latitudes and longitudes.
 
     Args:
+        layers (List[str]): The layers e.g. ['lossyear', 'treecover2000'].
         latitudes (range): _description_
         longitudes (range): _description_
+        version (str, optional): The dataset version. Defaults to HANSEN_VERSION.
 
     Returns:
-        _type_: _description_
+        dict: A list of file names per layer.
     """
-    def file(layer: str, lat: int, long: int) -> str:
-        slat, slong = to_degrees(lat, long)
-        t = Template('Hansen_GFC-2022-v1.10_${layer}_${lat}_${long}.tif')
-        filename = t.substitute({'layer': layer, 'lat': slat, 'long': slong})
-        return filename
+    files_per_layer = {}
+    permutations = list(it.product(latitudes, longitudes))
+    for layer in layers:
+        files_per_layer[layer] = [file_earthenginepartners_hansen(layer, lat, long, version) for (lat, long) in permutations]
+    return files_per_layer
+
+def cache_earthenginepartners_hansen(latitudes: range, longitudes: range, root: str = 'data', verbose: bool = False, metrics: Optional[Metrics] = None, base_url: Optional[str] = None, max_workers: int = 5, version: str = HANSEN_VERSION, budget: Optional[int] = None, transcode: bool = False) -> dict:
+    """Cache the lossyear and treecover2000 tiles in root, see leaf.tiles.TileCache.
+
+    Args:
+        latitudes (range): _description_
+        longitudes (range): _description_
+        metrics (Optional[Metrics], optional): Receives the cache hits, misses and downloads. Defaults to None.
+        base_url (Optional[str], optional): The URL to download from. Defaults to None, i.e. the version on HANSEN_BASE_URL.
+        max_workers (int, optional): The number of concurrent downloads. Defaults to 5.
+        version (str, optional): The Hansen dataset version. Defaults to HANSEN_VERSION.
+        budget (Optional[int], optional): The maximum size of the cache in bytes. Defaults to None, i.e. unbounded.
+        transcode (bool, optional): Also keep a cloud-optimized copy of each tile, which the readers prefer. Defaults to False.
 
-    def files(layers: List[str], latitudes: range, longitudes: range) -> dict:
-        files_per_layer = {}
-        permutations = list(it.product(latitudes, longitudes))
-        for layer in layers:
-            files_per_layer[layer] = [file(layer, lat, long) for (lat, long) in permutations]
-        return files_per_layer
+    Returns:
+        dict: A list of file names per layer.
+    """
+    from leaf.tiles import TileCache # leaf.tiles imports this module
 
-    thread_local = threading.local()
-    thread_local.session = requests.Session()
+    tile_cache = TileCache(root, budget, version, base_url, max_workers, transcode, verbose=verbose, metrics=metrics)
+    return tile_cache.layers(['lossyear', 'treecover2000'], latitudes, longitudes)
 
-    layers = files(['lossyear', 'treecover2000'], latitudes, longitudes)
-    for _, files in tqdm(layers.items(), desc='Cache missing files'):
-        cache(thread_local.session, root, files, 'https://storage.googleapis.com/earthenginepartners-hansen/GFC-2022-v1.10', verbose=verbose)
+def earthenginepartners_hansen(GEMFile: str, separator: str, latitudes: range, longitudes: range, data: str, offset: int = 16, root: str = 'data', verbose: bool = False, metrics: Optional[Metrics] = None, remote_read: bool = False, base_url: Optional[str] = None, version: str = HANSEN_VERSION, budget: Optional[int] = None, transcode: bool = False):
+    """Add the lossyear and treecover2000 of the Hansen tiles to the assets of GEMFile.
 
-    return layers
+    With remote_read the tiles are not downloaded. Instead, only the blocks around the 
+    assets are read through /vsicurl/ and kept in a block cache under root/blocks.
 
-def earthenginepartners_hansen(GEMFile: str, separator: str, latitudes: range, longitudes: range, data: str, offset: int = 16, root: str = 'data', verbose: bool = False):
+    Args:
+        GEMFile (str): The assets e.g. from gem_data_for_ml.
+        separator (str): The separator of GEMFile and data.
+        latitudes (range): _description_
+        longitudes (range): _description_
+        data (str): The path to write the result to.
+        offset (int, optional): See to_assets_with_lossyear. Defaults to 16.
+        root (str, optional): The local directory of the cache. Defaults to 'data'.
+        verbose (bool, optional): Print additional information to console. Defaults to False.
+        metrics (Optional[Metrics], optional): Receives the duration of each stage and the counts. Defaults to None.
+        remote_read (bool, optional): Read windows from base_url rather than downloading whole tiles. Defaults to False.
+        base_url (Optional[str], optional): The URL of the tiles. Defaults to None, i.e. the version on HANSEN_BASE_URL.
+        version (str, optional): The Hansen dataset version. Defaults to HANSEN_VERSION.
+        budget (Optional[int], optional): The maximum size of the tile cache, or with remote_read of the block cache, in bytes. Defaults to None, i.e. unbounded.
+        transcode (bool, optional): Also keep a cloud-optimized copy of each tile, which the readers prefer. Defaults to False.
+    """
+    base_url = f'{HANSEN_BASE_URL}/{version}' if base_url is None else base_url
 
-    layers = cache_earthenginepartners_hansen(latitudes, longitudes, root, verbose=verbose)
+    if remote_read:
+        layers = files_earthenginepartners_hansen(['lossyear', 'treecover2000'], latitudes, longitudes, version)
+    else:
+        layers = cache_earthenginepartners_hansen(latitudes, longitudes, root, verbose=verbose, metrics=metrics, base_url=base_url, version=version, budget=budget, transcode=transcode)
     
     lossyear = layers['lossyear']
     treecover2000 = layers['treecover2000']
 
     # TODO: use a temporary file that the os chooses...
-    temp = f'{root}/earthenginepartners_hansen.csv'
-    shutil.copyfile(GEMFile, temp)
+    # Parquet keeps the types of the year columns between the tiles
+    temp = f'{root}/earthenginepartners_hansen.parquet'
+    write_table(read_table(GEMFile, separator), temp)
+
+    with remote(base_url, f'{root}/blocks', budget=budget, metrics=metrics) if remote_read else nullcontext(root) as url:
+
+        path = (lambda file: f'/vsicurl/{url}/{file}') if remote_read else (lambda file: f'{root}/{file}')
+
+        for lossyear in tqdm(lossyear, desc=f'to_assets_with_lossyear for latitudes: {latitudes} and longitudes: {longitudes}'):
+            df = to_assets_with_lossyear(path(lossyear), temp, separator, offset, verbose = verbose, metrics = metrics)
+            write_table(df, temp, index=True)
+
+        for treecover2000 in tqdm(treecover2000, desc=f'to_assets_with_treecover2000 for latitudes: {latitudes} and longitudes: {longitudes}'):
+            df = to_assets_with_treecover2000(path(treecover2000), temp, separator, verbose = verbose, metrics = metrics)
+            write_table(df, temp, index=True)
+
+    write_table(read_table(temp), data, separator)
+    os.remove(temp)
 
-    for lossyear in tqdm(lossyear, desc=f'to_assets_with_lossyear for latitudes: {latitudes} and longitudes: {longitudes}'):
-        df = to_assets_with_lossyear(f'{root}/{lossyear}', temp, separator, offset, verbose = verbose)
-        df.to_csv(temp, sep=separator)
+REG_SAMPLE_WINDOWS = {'around_3': (-1, 1), 'around_5': (-2, 2), 'forward_3': (0, 2), 'past_3': (-2, 0)}
 
-    for treecover2000 in tqdm(treecover2000, desc=f'to_assets_with_treecover2000 for latitudes: {latitudes} and longitudes: {longitudes}'):
-        df = to_assets_with_treecover2000(f'{root}/{treecover2000}', temp, separator, verbose = verbose)
-        df.to_csv(temp, sep=separator)
+def offset_name(t: int) -> str:
+    """The column name of a year relative to the start year e.g. 't_m3' for -3 and 't_2' for 2."""
+    return 't_m' + str(t*(-1)) if t < 0 else 't_' + str(t)
 
-    shutil.move(temp, data)
+def event_windows(values: np.ndarray, first_year: int, start_years: np.ndarray, offsets: Sequence[int], windows: dict) -> Tuple[np.ndarray, np.ndarray]:
+    """Gather the values at years relative to each start year, and sum named windows of them.
 
-def to_reg_sample(GEMFile: str, separator: str, max_year = 7) -> pd.DataFrame: 
+    Both are computed on the (assets, years) matrix without reshaping to long format:
+    the offsets with fancy indexing and the windows from cumulative sums, so any window
+    costs the same.
 
-    df = pd.read_csv(GEMFile, sep = separator)
+    Args:
+        values (np.ndarray): An (assets, years) matrix of consecutive years, NaN where missing.
+        first_year (int): The year of the first column e.g. 2001.
+        start_years (np.ndarray): The start year of each asset.
+        offsets (Sequence[int]): The relative years to gather e.g. range(-3, 4).
+        windows (dict): The first and last relative year, inclusive, per window name e.g. {'around_3': (-1, 1)}.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The (assets, offsets) values and the (assets, windows) sums,
+            NaN where a year is missing or beyond the years of values.
+    """
+    n, m = values.shape
+    rows = np.arange(n)
+    start = np.asarray(start_years, dtype=np.int64) - first_year
+
+    # column m pads the years out of range with NaN
+    padded = np.hstack([values, np.full((n, 1), np.nan)])
+    columns = start[:, None] + np.asarray(offsets, dtype=np.int64)[None, :]
+    columns[(columns < 0) | (columns >= m)] = m
+    gathered = padded[rows[:, None], columns]
+
+    # prefix sums of the values and of the number of missing values, per asset
+    missing = np.isnan(values)
+    sums = np.zeros((n, m + 1))
+    sums[:, 1:] = np.cumsum(np.where(missing, 0, values), axis=1)
+    counts = np.zeros((n, m + 1), dtype=np.int64)
+    counts[:, 1:] = np.cumsum(missing, axis=1)
+
+    result = np.full((n, len(windows)), np.nan)
+    for j, (first, last) in enumerate(windows.values()):
+        begin, end = start + first, start + last + 1
+        inside = (begin >= 0) & (end <= m)
+        begin, end = np.clip(begin, 0, m), np.clip(end, 0, m)
+        complete = inside & (counts[rows, end] == counts[rows, begin])
+        result[:, j] = np.where(complete, sums[rows, end] - sums[rows, begin], np.nan)
+
+    return gathered, result
+
+def reg_sample(df: pd.DataFrame, offsets: Sequence[int] = range(-3, 4), windows: dict = REG_SAMPLE_WINDOWS) -> pd.DataFrame:
+    """The regression sample of assets with year columns e.g. output by to_assets_with_treecover2000.
+
+    Keeps the assets with data for the last year, replaces the year columns by 'defo_total'
+    and the deforestation in the years around 'start_year_first', see event_windows.
 
-    # rename year columns to have a prefix
-    rename_aux = {str(x): "deforestation_"+str(x) for x in range(2000, 2023)}
-    df.rename(columns = rename_aux, inplace = True)
+    Args:
+        df (pd.DataFrame): Assets with 'uid_gem', 'start_year_first' and a column per year e.g. '2001'..'2022'.
+        offsets (Sequence[int], optional): The relative years of the t_ columns. Defaults to range(-3, 4).
+        windows (dict, optional): The relative years per window column. Defaults to REG_SAMPLE_WINDOWS.
+
+    Returns:
+        pd.DataFrame: A row per asset with any of the offset years in the data.
+    """
+    year_columns = sorted((col for col in df.columns if col.isdigit()), key=int)
+    first_year, last_year = int(year_columns[0]), int(year_columns[-1])
+    years = [str(year) for year in range(first_year, last_year + 1)]
 
     # keep only observations in countries where we obtained data
-    print(f"All assets: {len(df)}")
-    df = df[df.deforestation_2022 >= 0]
-    print(f"Our assets: {len(df)}")
+    df = df[df[year_columns[-1]] >= 0]
+
+    values = df.reindex(columns=years).to_numpy(dtype=float)
+    start_years = df['start_year_first'].astype(int).to_numpy()
+
+    # keep the assets with any of the offset years in the data
+    relative = start_years[:, None] + np.asarray(offsets)[None, :]
+    keep = ((relative >= first_year) & (relative <= last_year)).any(axis=1)
+    df, values, start_years = df[keep], values[keep], start_years[keep]
+
+    gathered, sums = event_windows(values, first_year, start_years, offsets, windows)
+
+    result = df.drop(columns=year_columns)
+    result['defo_total'] = np.nansum(values, axis=1)
+    result['start_year_first'] = start_years
+    result = pd.concat([
+        result,
+        pd.DataFrame(gathered, index=df.index, columns=[offset_name(t) for t in offsets]),
+        pd.DataFrame(sums, index=df.index, columns=list(windows))
+    ], axis=1).reset_index(drop=True)
 
-    # create column lists for splitting the dta
-    i_cols = [col for col in df.columns if not col.startswith('deforestation_')]
-    def_cols = [col for col in df.columns if col.startswith('deforestation_')]
+    # fill in missing values for subsector
+    if result.sector_sub_first.dtype == 'category':
+        categories = result.sector_sub_first.cat.categories
+        result['sector_sub_first'] = result.sector_sub_first.cat.set_categories(categories.union(['unknown']))
+    result['sector_sub_first'] = result.sector_sub_first.fillna('unknown')
 
-    # create a variable which has the total deforestation over the entire period
-    df['defo_total'] = df[def_cols].sum(axis = 1)
-    i_cols.append('defo_total')
+    return result
 
-    # create a dataframe of invariant features
-    df_invar = df[i_cols]
+def to_reg_sample(GEMFile: str, separator: str, max_year = 7, metrics: Optional[Metrics] = None, offsets: Optional[Sequence[int]] = None, windows: Optional[dict] = None, chunksize: Optional[int] = None) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    """Read the assets with deforestation per year and build the regression sample, see reg_sample.
 
-    # convert start year to integer
-    df_invar['start_year_first'] = df_invar.start_year_first.astype(int)
+    With chunksize, GEMFile is read in chunks of that many rows and an iterator of the
+    regression sample per chunk is returned, so memory depends on chunksize rather
+    than on the size of GEMFile.
 
-    # reshape to long to get deforestation for each year for each asset
-    df_long = df[['uid_gem', 'start_year_first'] + def_cols]
-    df_long = pd.wide_to_long(df_long, 
-                            "deforestation_", 
-                            i = ['uid_gem', 'start_year_first'], 
-                            j = 'year').reset_index()
+    Args:
+        GEMFile (str): The assets e.g. output by to_assets_with_treecover2000.
+        separator (str): The separator of GEMFile.
+        max_year (int, optional): The number of years around the start year, used if offsets is None. Defaults to 7.
+        metrics (Optional[Metrics], optional): Receives the duration of each stage and the asset count. Defaults to None.
+        offsets (Optional[Sequence[int]], optional): The relative years of the t_ columns. Defaults to None.
+        windows (Optional[dict], optional): The relative years per window column. Defaults to None, i.e. REG_SAMPLE_WINDOWS.
+        chunksize (Optional[int], optional): The number of rows per chunk. Defaults to None, i.e. all at once.
 
-    # keep only observation in t = [-3, 3] around the start date of the asset
-    df_long['t'] = df_long['year'] - df_long['start_year_first']
-    df_long = df_long[df_long.t.between(-((max_year-1)/2), (max_year-1)/2)]
+    Returns:
+        Union[pd.DataFrame, Iterator[pd.DataFrame]]: The regression sample, or an iterator of its chunks.
+    """
+    metrics = NO_METRICS if metrics is None else metrics
+    labels = {'function': 'to_reg_sample'}
 
-    # rename columns into something reasonable and pythonic
-    def var_name(t): 
-        return 't_m' + str(t*(-1)) if t < 0 else 't_' + str(t)
+    half = (max_year - 1) // 2
+    offsets = range(-half, half + 1) if offsets is None else offsets
+    windows = REG_SAMPLE_WINDOWS if windows is None else windows
 
-    colnames = {x: var_name(x) for x in list(range(-3, 4))}
+    if chunksize is not None:
+        return to_reg_sample_chunks(GEMFile, separator, chunksize, offsets, windows, metrics)
 
-    # reshape back to wide format
-    df_wide = df_long.pivot(index='uid_gem', 
-                            columns='t', 
-                            values='deforestation_').reset_index().rename(columns = colnames)
+    start_time = time.perf_counter()
 
-    # merge with invariant features
-    df = pd.merge(df_invar, df_wide, how = 'inner', on = 'uid_gem')
+    df = read_table(GEMFile, separator)
 
-    # sum up some useful outcome variables:
-    def sum_window(start = -2, end = 2): 
-        vars_to_sum = []
+    read_time = time.perf_counter()
+    metrics.timing('read_assets', read_time - start_time, **labels)
+    metrics.count('assets', len(df), **labels)
 
-        # create a list of variables to sum 
-        for val in list(range(start, end + 1)): 
-            vars_to_sum.append(var_name(val)) 
-        
-        return vars_to_sum
-        
-    # create some nice default outcomes, giving nan if not all values are present
-    df['around_3'] = df[sum_window(-1, 1)].sum(axis=1, min_count = 3)
-    df['around_5'] = df[sum_window(-2, 2)].sum(axis=1, min_count = 5)
-    df['forward_3'] = df[sum_window(0, 2)].sum(axis=1, min_count = 3)
-    df['past_3'] = df[sum_window(-2, 0)].sum(axis=1, min_count = 3)
+    print(f"All assets: {len(df)}")
+    df = reg_sample(df, offsets, windows)
+    print(f"Our assets: {len(df)}")
 
-    # # create deciles of capacity by sector
-    # df = df.sort_values(by=['sector_main', 'capacity_first'])
-    # df['quintile_capacity'] = pd.qcut(df.groupby('sector_main')['capacity_first'].cumsum(), 10, labels=False)
-    # df['quintile_capacity'] = df.quintile_capacity.apply(lambda x: -1 if pd.isnull(x) else x)
+    metrics.timing('reshape', time.perf_counter() - read_time, **labels)
 
-    # fill in missing values for subsector
-    df['sector_sub_first'] = df.sector_sub_first.apply(lambda x: "unknown" if pd.isnull(x) else x)
+    return df
+
+def to_reg_sample_chunks(GEMFile: str, separator: str, chunksize: int, offsets: Sequence[int], windows: dict, metrics: Metrics) -> Iterator[pd.DataFrame]:
+    """The regression sample of GEMFile per chunk of rows, see to_reg_sample."""
+    labels = {'function': 'to_reg_sample'}
+
+    all_assets, our_assets = 0, 0
+    start_time = time.perf_counter()
+    for df in read_table_chunks(GEMFile, separator, chunksize):
+        read_time = time.perf_counter()
+        metrics.timing('read_assets', read_time - start_time, **labels)
+        metrics.count('assets', len(df), **labels)
+
+        all_assets += len(df)
+        df = reg_sample(df, offsets, windows)
+        our_assets += len(df)
+
+        metrics.timing('reshape', time.perf_counter() - read_time, **labels)
+
+        yield df
+        start_time = time.perf_counter()
 
-    return df
\ No newline at end of file
+    print(f"All assets: {all_assets}")
+    print(f"Our assets: {our_assets}")
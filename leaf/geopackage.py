@@ -0,0 +1,294 @@
+from contextlib import closing
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import geopandas as gpd
+import rasterio as rio
+from rasterio.warp import transform
+import shapely
+
+from leaf.deforestation import nearest, nearest_index
+
+from typing import Tuple, Optional, Sequence
+
+
+def layer(path: str) -> Tuple[str, str, int]:
+    """Query the first feature table of a GeoPackage.
+
+    Args:
+        path (str): The path to the .gpkg file.
+
+    Returns:
+        Tuple[str, str, int]: The table name, its geometry column and its srs_id.
+    """
+    with closing(sqlite3.connect(path)) as con:
+        row = con.execute(
+            'SELECT g.table_name, g.column_name, g.srs_id FROM gpkg_geometry_columns g '
+            "JOIN gpkg_contents c ON c.table_name = g.table_name WHERE c.data_type = 'features'"
+        ).fetchone()
+
+    if row is None:
+        raise ValueError(f'{path} contains no feature table.')
+
+    return row
+
+def has_spatial_index(path: str) -> bool:
+    """Check whether the GeoPackage has an R-tree spatial index over its feature table.
+
+    Args:
+        path (str): The path to the .gpkg file.
+
+    Returns:
+        bool: True if the gpkg_rtree_index extension is registered for the feature table.
+    """
+    table, column, _ = layer(path)
+    with closing(sqlite3.connect(path)) as con:
+        try:
+            count, = con.execute(
+                "SELECT COUNT(*) FROM gpkg_extensions WHERE extension_name = 'gpkg_rtree_index' "
+                'AND table_name = ? AND column_name = ?', (table, column)
+            ).fetchone()
+        except sqlite3.OperationalError: # no gpkg_extensions table
+            return False
+
+    return count > 0
+
+def indexed(path: str, verbose: bool = False) -> str:
+    """The path of a GeoPackage with the features of path and an R-tree spatial index.
+
+    This is path itself if it has an index, as GeoPackages written by to_file do.
+    Otherwise the features are copied, once, to an indexed sidecar next to it, e.g.
+    loss.rtree.gpkg for loss.gpkg, which is rebuilt when path is newer. The input is
+    never modified, and the sidecar is written to a temporary file then moved in place
+    so that it is either complete or absent.
+
+    Args:
+        path (str): The path to the .gpkg file.
+        verbose (bool, optional): Print additional information to console. Defaults to False.
+
+    Returns:
+        str: The path to an indexed .gpkg file with the same feature table.
+    """
+    if has_spatial_index(path):
+        return path
+
+    sidecar = f'{os.path.splitext(path)[0]}.rtree.gpkg'
+    if os.path.isfile(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(path) and has_spatial_index(sidecar):
+        return sidecar
+
+    if verbose:
+        print(f'Creating spatial index for {path} in {sidecar}')
+
+    table, _, _ = layer(path)
+    temp = f'{os.path.splitext(sidecar)[0]}.{os.getpid()}.part.gpkg'
+    try:
+        gdf = gpd.read_file(path, layer=table)
+        gdf.to_file(temp, layer=table, driver='GPKG', SPATIAL_INDEX='YES')
+        os.replace(temp, sidecar)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+    return sidecar
+
+def crs(path: str) -> rio.crs.CRS:
+    """Query the CRS of the GeoPackage without reading its features.
+
+    Args:
+        path (str): The path to the .gpkg file.
+
+    Returns:
+        rio.crs.CRS: The CRS of the feature table.
+    """
+    _, _, srs_id = layer(path)
+    with closing(sqlite3.connect(path)) as con:
+        organization, code, definition = con.execute(
+            'SELECT organization, organization_coordsys_id, definition FROM gpkg_spatial_ref_sys WHERE srs_id = ?', (srs_id,)
+        ).fetchone()
+
+    if organization.upper() == 'EPSG':
+        return rio.crs.CRS.from_epsg(code)
+
+    return rio.crs.CRS.from_wkt(definition)
+
+def extent(path: str) -> Optional[Tuple[float, float, float, float]]:
+    """Query the bounds of the GeoPackage, in EPSG:4326, from its spatial index.
+
+    Equivalent to window(gpd.read_file(path)) but without reading any features.
+
+    Args:
+        path (str): The path to the .gpkg file.
+
+    Returns:
+        Optional[Tuple[float, float, float, float]]: minx, miny, maxx, maxy or None if there are no features.
+    """
+    path = indexed(path)
+
+    table, column, _ = layer(path)
+    with closing(sqlite3.connect(path)) as con:
+        minx, miny, maxx, maxy = con.execute(
+            f'SELECT MIN(minx), MIN(miny), MAX(maxx), MAX(maxy) FROM "rtree_{table}_{column}"'
+        ).fetchone()
+
+    if minx is None:
+        return None
+
+    to_crs = rio.crs.CRS.from_epsg(4326)
+    x, y = transform(crs(path), to_crs, [minx, maxx], [miny, maxy])
+
+    return (x[0], y[0], x[1], y[1])
+
+def read_features(path: str,
+                  lats: Optional[Sequence[float]] = None,
+                  longs: Optional[Sequence[float]] = None,
+                  distance: float = 0,
+                  bbox: Optional[Tuple[float, float, float, float]] = None,
+                  verbose: bool = False) -> gpd.GeoDataFrame:
+    """Read only the features whose bounding boxes intersect the given GPS locations or region.
+
+    The features are selected with the R-tree spatial index of the GeoPackage, so the
+    cost depends on the number of matches rather than on the size of the file. The
+    result can be passed to e.g. areas or nearest. Its index matches that of
+    gpd.read_file(path) for files written by to_file.
+
+    Args:
+        path (str): The path to the .gpkg file e.g. output by to_lossyear_timeseries.
+        lats (Optional[Sequence[float]], optional): The latitudes of GPS coordinates. Defaults to None.
+        longs (Optional[Sequence[float]], optional): The longitudes of GPS coordinates. Defaults to None.
+        distance (float, optional): Also match features within this distance, in units of the file CRS, of each location. Defaults to 0.
+        bbox (Optional[Tuple[float, float, float, float]], optional): A region as minx, miny, maxx, maxy in EPSG:4326. Defaults to None.
+        verbose (bool, optional): Print additional information to console. Defaults to False.
+
+    Returns:
+        gpd.GeoDataFrame: The matching features in the CRS of the file.
+    """
+    def to_wkb(blob: bytes) -> bytes:
+        # GeoPackage binary: 'GP', version, flags, srs_id, optional envelope, then WKB
+        envelope = (blob[3] >> 1) & 0x07
+        return blob[8 + {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}[envelope]:]
+
+    path = indexed(path, verbose)
+
+    table, column, _ = layer(path)
+    file_crs = crs(path)
+    from_crs = rio.crs.CRS.from_epsg(4326)
+
+    boxes = []
+    if lats is not None and longs is not None:
+        xs, ys = transform(from_crs, file_crs, np.asarray(longs, dtype=float), np.asarray(lats, dtype=float))
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        boxes.extend(zip(xs - distance, ys - distance, xs + distance, ys + distance))
+    if bbox is not None:
+        xs, ys = transform(from_crs, file_crs, [bbox[0], bbox[2]], [bbox[1], bbox[3]])
+        boxes.append((min(xs), min(ys), max(xs), max(ys)))
+
+    with closing(sqlite3.connect(path)) as con:
+        fid = next(name for _, name, _, _, _, pk in con.execute(f'PRAGMA table_info("{table}")') if pk)
+
+        con.execute('CREATE TEMP TABLE boxes (minx REAL, miny REAL, maxx REAL, maxy REAL)')
+        con.executemany('INSERT INTO boxes VALUES (?, ?, ?, ?)', boxes)
+
+        df = pd.read_sql_query(
+            f'SELECT * FROM "{table}" WHERE "{fid}" IN ('
+            f'SELECT r.id FROM boxes b, "rtree_{table}_{column}" r '
+            'WHERE r.maxx >= b.minx AND r.minx <= b.maxx AND r.maxy >= b.miny AND r.miny <= b.maxy) '
+            f'ORDER BY "{fid}"', con)
+
+    geometry = shapely.from_wkb([None if blob is None else to_wkb(blob) for blob in df[column]])
+    df = df.drop(columns=column)
+    df.index = df.pop(fid) - 1
+    df.index.name = None
+    gdf = gpd.GeoDataFrame(df, geometry=geometry, crs=file_crs.to_string())
+
+    if verbose:
+        print(f'Read {len(gdf)} features from {path} for {len(boxes)} queries.')
+
+    return gdf
+
+def utm_crs(path: str) -> rio.crs.CRS:
+    """The UTM CRS of the whole GeoPackage, as estimate_utm_crs of gpd.read_file(path), from its extent.
+
+    Pass it as the crs of e.g. nearest_index or to_assets_with_loss_area over features
+    read with read_features, so that distances and areas are those over the whole file.
+
+    Args:
+        path (str): The path to the .gpkg file.
+
+    Returns:
+        rio.crs.CRS: The UTM CRS.
+    """
+    bounds = gpd.GeoSeries([shapely.box(*extent(path))], crs='EPSG:4326')
+    return rio.crs.CRS.from_user_input(bounds.estimate_utm_crs())
+
+def file_distance(path: str, meters: float, lats: Sequence[float]) -> float:
+    """A distance in units of the CRS of the GeoPackage that covers at least meters around each latitude.
+
+    For a geographic CRS this is in degrees of longitude at the latitude furthest from
+    the equator, which is at least as many degrees of latitude, see read_features.
+
+    Args:
+        path (str): The path to the .gpkg file.
+        meters (float): The distance in meters.
+        lats (Sequence[float]): The latitudes of GPS coordinates.
+
+    Returns:
+        float: The distance in units of the CRS of the file.
+    """
+    file_crs = crs(path)
+    if file_crs.is_projected:
+        return meters / file_crs.linear_units_factor[1]
+
+    lats = np.abs(np.asarray(lats, dtype=float))
+    lats = lats[np.isfinite(lats)]
+    latitude = min(lats.max(), 89.9) if len(lats) else 0.0
+    # a degree of latitude is at least 110574 meters, with a margin for the metric CRS of nearest
+    return 1.01 * meters / (110_574 * np.cos(np.radians(latitude)))
+
+def read_nearest_features(path: str,
+                          lats: Sequence[float],
+                          longs: Sequence[float],
+                          distance: float = 5000,
+                          verbose: bool = False) -> gpd.GeoDataFrame:
+    """Read the features that include the closest feature of each GPS location, see nearest.
+
+    The features within distance, in meters, of the locations are read with read_features.
+    The locations whose closest feature is further away are queried again with twice the
+    distance, until all of them have one, so that nearest over the result is that over
+    the whole file while reading only the features near the locations.
+
+    Args:
+        path (str): The path to the .gpkg file e.g. output by to_lossyear_timeseries.
+        lats (Sequence[float]): The latitudes of GPS coordinates.
+        longs (Sequence[float]): The longitudes of GPS coordinates.
+        distance (float, optional): The first distance in meters. Defaults to 5000.
+        verbose (bool, optional): Print additional information to console. Defaults to False.
+
+    Returns:
+        gpd.GeoDataFrame: The features in the CRS of the file, indexed as by read_features.
+    """
+    lats = np.asarray(lats, dtype=float)
+    longs = np.asarray(longs, dtype=float)
+    metric_crs = utm_crs(path)
+    todo = np.flatnonzero(np.isfinite(lats) & np.isfinite(longs))
+
+    gdfs = []
+    # beyond half the circumference of the earth every feature is within distance
+    while len(todo) > 0 and distance < 2e7:
+        gdf = read_features(path, lats[todo], longs[todo], file_distance(path, distance, lats[todo]), verbose=verbose)
+        gdfs.append(gdf)
+        found = nearest(gdf, lats[todo], longs[todo], nearest_index(gdf, metric_crs))['distance'].to_numpy() <= distance
+        todo = todo[~found]
+        distance *= 2
+
+    if len(todo) > 0:
+        path = indexed(path, verbose)
+        gdfs.append(gpd.read_file(path, layer=layer(path)[0]))
+
+    if not gdfs:
+        return read_features(path, verbose=verbose)
+
+    gdf = pd.concat(gdfs)
+    return gdf[~gdf.index.duplicated()].sort_index()
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from typing import Optional, List
+
+
+class Metrics:
+    """Collect per-stage durations and counters from the leaf functions.
+
+    Pass an instance as the 'metrics' argument of e.g. to_lossyear_timeseries or
+    to_assets_with_lossyear, then export with to_jsonl or to_prometheus. Recording is
+    thread-safe so a single instance can be shared by concurrent downloads.
+
+    Timings are in seconds, measured with time.perf_counter. Counters in use are 'pixels', 'assets', 'bytes_read',
+    'bytes_downloaded', 'cache_hits' and 'cache_misses'.
+    """
+
+    class Kind:
+        TIMING = 'timing'
+        COUNT = 'count'
+
+    def __init__(self, **labels):
+        """
+        Args:
+            **labels: Labels added to every record e.g. command='series'.
+        """
+        self.labels = labels
+        self.records: List[dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, name: str, value: float, **labels):
+        """Append a single record.
+
+        Args:
+            kind (str): Metrics.Kind.TIMING or Metrics.Kind.COUNT.
+            name (str): The stage or counter name.
+            value (float): Seconds for a timing, an amount for a counter.
+            **labels: Labels for this record e.g. function='to_lossyear_timeseries'.
+        """
+        record = {
+            'time': time.time(),
+            'kind': kind,
+            'name': name,
+            'value': float(value),
+            'labels': {**self.labels, **labels}
+        }
+        with self._lock:
+            self.records.append(record)
+
+    def timing(self, name: str, seconds: float, **labels):
+        self.record(Metrics.Kind.TIMING, name, seconds, **labels)
+
+    def count(self, name: str, value: float = 1, **labels):
+        self.record(Metrics.Kind.COUNT, name, value, **labels)
+
+    @contextmanager
+    def stage(self, name: str, **labels):
+        """Time the enclosed block as stage 'name'."""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.timing(name, time.perf_counter() - start, **labels)
+
+    def to_jsonl(self) -> str:
+        """One JSON object per record."""
+        with self._lock:
+            records = list(self.records)
+        return ''.join(json.dumps(record) + '\n' for record in records)
+
+    def to_prometheus(self, prefix: str = 'leaf') -> str:
+        """Prometheus text exposition format.
+
+        Timings become a summary '<prefix>_stage_seconds' with a 'stage' label,
+        counters become '<prefix>_<name>_total'. Records with equal labels are summed.
+        """
+        def escape(value) -> str:
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def format_labels(labels: dict) -> str:
+            if not labels:
+                return ''
+            pairs = ','.join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items()))
+            return '{' + pairs + '}'
+
+        with self._lock:
+            records = list(self.records)
+
+        timings = {}
+        counts = {}
+        for record in records:
+            if record['kind'] == Metrics.Kind.TIMING:
+                key = format_labels({**record['labels'], 'stage': record['name']})
+                total, n = timings.get(key, (0.0, 0))
+                timings[key] = (total + record['value'], n + 1)
+            else:
+                metric = f"{prefix}_{record['name']}_total"
+                key = (metric, format_labels(record['labels']))
+                counts[key] = counts.get(key, 0.0) + record['value']
+
+        lines = []
+        if timings:
+            metric = f'{prefix}_stage_seconds'
+            lines.append(f'# HELP {metric} Duration of each stage in seconds.')
+            lines.append(f'# TYPE {metric} summary')
+            for key, (total, n) in timings.items():
+                lines.append(f'{metric}_sum{key} {total}')
+                lines.append(f'{metric}_count{key} {n}')
+        for metric in sorted({metric for metric, _ in counts}):
+            lines.append(f'# TYPE {metric} counter')
+            for (name, key), value in counts.items():
+                if name == metric:
+                    lines.append(f'{metric}{key} {value}')
+
+        return ''.join(line + '\n' for line in lines)
+
+    def write(self, path: str, format: Optional[str] = None):
+        """Write the records to 'path' as 'jsonl' or 'prometheus'.
+
+        Args:
+            path (str): The file to write.
+            format (Optional[str], optional): 'jsonl' or 'prometheus'. Defaults to None,
+                which means 'prometheus' for .prom/.txt files and 'jsonl' otherwise.
+        """
+        if format is None:
+            format = 'prometheus' if path.endswith(('.prom', '.txt')) else 'jsonl'
+
+        text = self.to_prometheus() if format == 'prometheus' else self.to_jsonl()
+        with open(path, 'w') as f:
+            f.write(text)
+
+
+class NullMetrics(Metrics):
+    """A Metrics that keeps nothing, the default of the functions called without one."""
+
+    def record(self, kind: str, name: str, value: float, **labels):
+        pass
+
+# the shared instance of NullMetrics
+NO_METRICS = NullMetrics()
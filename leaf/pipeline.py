@@ -0,0 +1,220 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import hashlib
+import inspect
+import json
+import os
+
+from leaf.deforestation import to_assets_with_lossyear, to_assets_with_treecover2000, to_reg_sample
+from leaf.metrics import Metrics, NO_METRICS
+from leaf.sheets import content_hash
+from leaf.storage import read_table, write_table
+
+from typing import Any, Callable, NamedTuple, Optional, List, Sequence, Tuple
+
+
+# where the state of the stages and the hashes of their files are kept
+PIPELINE_ROOT = os.path.join('data', '.pipeline')
+
+class Stage(NamedTuple):
+    """A step of a Pipeline, run as function(**parameters), which writes the outputs from the inputs.
+
+    A stage depends on the stages whose outputs are its inputs.
+    """
+    name: str                                     # e.g. 'lossyear_20S_060W'
+    function: Callable[..., Any]                  # e.g. gem_data_for_ml
+    inputs: Tuple[str, ...] = ()                  # the files read, by path
+    outputs: Tuple[str, ...] = ()                 # the files written, by path
+    parameters: Optional[dict] = None             # the keyword arguments of function, part of the key of the stage
+
+class Pipeline:
+    """Run stages in the order of their inputs and outputs, skipping those that are up to date.
+
+    The key of a stage is the hash of its function and its source, parameters and the
+    content of its inputs. A stage is skipped when its key is the one of its last run and its outputs
+    are as it left them, so that changing a parameter, e.g. the offset of lossyear, runs
+    that stage again and then only the stages whose inputs it changed. Stages whose
+    inputs are ready run concurrently in threads.
+
+    The state, root/stages.json, assumes a single pipeline runs in root at a time.
+    """
+
+    STATE = 'stages.json'
+
+    class Status:
+        RAN = 'ran'
+        SKIPPED = 'skipped'
+
+    def __init__(self,
+                 stages: Sequence[Stage],
+                 root: str = PIPELINE_ROOT,
+                 max_workers: Optional[int] = None,
+                 verbose: bool = False,
+                 metrics: Optional[Metrics] = None):
+        """
+        Args:
+            stages (Sequence[Stage]): The stages, with unique names and outputs.
+            root (str, optional): The directory of the state. Defaults to PIPELINE_ROOT.
+            max_workers (Optional[int], optional): The number of stages run at once. Defaults to None, see ThreadPoolExecutor.
+            verbose (bool, optional): Print whether each stage ran. Defaults to False.
+            metrics (Optional[Metrics], optional): Receives the duration of each stage that ran. Defaults to None.
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError('The names of the stages are not unique')
+
+        self.producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f'{output} is an output of both {self.producers[output]} and {stage.name}')
+                self.producers[output] = stage.name
+
+        self.root = root
+        self.max_workers = max_workers
+        self.verbose = verbose
+        self.metrics = NO_METRICS if metrics is None else metrics
+
+    def dependencies(self, name: str) -> List[str]:
+        """The stages that write the inputs of a stage."""
+        return list(dict.fromkeys(self.producers[path] for path in self.stages[name].inputs if path in self.producers))
+
+    def digest(self, path: str) -> str:
+        """The content hash of a file, see content_hash."""
+        return content_hash(path, self.root)
+
+    @staticmethod
+    def code(function: Callable[..., Any]) -> str:
+        """The hash of the source of a function, or of its bytecode if the source is not available."""
+        try:
+            code = inspect.getsource(function).encode()
+        except (OSError, TypeError):
+            code = getattr(getattr(function, '__code__', None), 'co_code', b'')
+        return hashlib.sha256(code).hexdigest()
+
+    def key(self, stage: Stage) -> str:
+        """The hash of the function, its source, the parameters and the content of the inputs of a stage."""
+        for path in stage.inputs:
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f'{path}, an input of {stage.name}, does not exist')
+        function = f'{stage.function.__module__}.{stage.function.__qualname__}:{Pipeline.code(stage.function)}'
+        parameters = json.dumps(stage.parameters or {}, sort_keys=True, default=str)
+        inputs = [f'{path}:{self.digest(path)}' for path in stage.inputs]
+        return hashlib.sha256('\n'.join([function, parameters, *inputs]).encode()).hexdigest()
+
+    def read_state(self) -> dict:
+        try:
+            with open(os.path.join(self.root, Pipeline.STATE), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def write_state(self, state: dict):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, Pipeline.STATE)
+        temp = f'{path}.{os.getpid()}.part'
+        with open(temp, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp, path)
+
+    def execute(self, stage: Stage, last: Optional[dict], force: bool) -> Tuple[str, dict]:
+        """Run a stage unless its key and outputs are those of its last run.
+
+        Returns:
+            Tuple[str, dict]: The Status, and the state of the stage with its key and the hash of each output.
+        """
+        key = self.key(stage)
+        if not force and last is not None and last['key'] == key and all(
+                os.path.isfile(path) and self.digest(path) == last['outputs'].get(path) for path in stage.outputs):
+            return Pipeline.Status.SKIPPED, last
+
+        if self.verbose: print(f'Running {stage.name}')
+        for path in stage.outputs:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        with self.metrics.stage(stage.name, function='pipeline'):
+            stage.function(**(stage.parameters or {}))
+
+        missing = [path for path in stage.outputs if not os.path.isfile(path)]
+        if missing:
+            raise FileNotFoundError(f'{stage.name} did not write {missing}')
+        return Pipeline.Status.RAN, {'key': key, 'outputs': {path: self.digest(path) for path in stage.outputs}}
+
+    def run(self, targets: Optional[List[str]] = None, force: Sequence[str] = ()) -> dict:
+        """Run the stages that targets need, each as soon as the stages it depends on are done.
+
+        Args:
+            targets (Optional[List[str]], optional): The names of the stages to bring up to date. Defaults to None, i.e. all.
+            force (Sequence[str], optional): The names of stages to run even if they are up to date. Defaults to ().
+
+        Returns:
+            dict: The Status of each stage that was needed.
+        """
+        needed, todo = set(), list(self.stages if targets is None else targets)
+        while todo:
+            name = todo.pop()
+            if name not in self.stages:
+                raise ValueError(f'Unknown stage {name}')
+            if name not in needed:
+                needed.add(name)
+                todo.extend(self.dependencies(name))
+
+        state = self.read_state()
+        statuses = {}
+        waiting = {name: set(self.dependencies(name)) for name in self.stages if name in needed}
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while waiting or running:
+                ready = [name for name, dependencies in waiting.items() if not dependencies - statuses.keys()]
+                if not ready and not running:
+                    raise ValueError(f'The stages {sorted(waiting)} depend on each other')
+                for name in ready:
+                    del waiting[name]
+                    running[executor.submit(self.execute, self.stages[name], state.get(name), name in force)] = name
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        status, state[name] = future.result()
+                    except BaseException:
+                        for other in running:
+                            other.cancel()
+                        self.write_state(state)
+                        raise
+                    statuses[name] = status
+                    self.metrics.count(f'stages_{status}', function='pipeline')
+                    if self.verbose and status == Pipeline.Status.SKIPPED: print(f'Skipped {name}, up to date')
+                self.write_state(state)
+
+        return statuses
+
+def lossyear_tile(geoTIFF: str, assets: str, data: str, offset: int = 16):
+    """Write the assets of a table with the lossyear of a tile, see to_assets_with_lossyear."""
+    write_table(to_assets_with_lossyear(geoTIFF, assets, ',', offset), data, index=True)
+
+def treecover2000_tile(geoTIFF: str, assets: str, data: str):
+    """Write the assets of a table with the treecover2000 of a tile, see to_assets_with_treecover2000."""
+    write_table(to_assets_with_treecover2000(geoTIFF, assets, ','), data, index=True)
+
+def merge_tiles(tiles: List[str], data: str, index: str = 'uid_gem'):
+    """Merge the tables of the tiles of a layer, where the values of a later tile come first.
+
+    This is the table that running the tiles one after the other on the same file gives,
+    as in earthenginepartners_hansen.
+
+    Args:
+        tiles (List[str]): The tables of the tiles e.g. written by lossyear_tile.
+        data (str): The path to write the merged table to.
+        index (str, optional): The column of the assets. Defaults to 'uid_gem'.
+    """
+    merged = None
+    for tile in tiles:
+        df = read_table(tile).set_index(index)
+        merged = df if merged is None else df.combine_first(merged)[list(merged.columns.union(df.columns, sort=False))]
+    write_table(merged, data, index=True)
+
+def reg_sample_table(assets: str, data: str, offsets: Optional[Sequence[int]] = None, windows: Optional[dict] = None):
+    """Write the regression sample of assets, see to_reg_sample."""
+    write_table(to_reg_sample(assets, ',', offsets=offsets, windows=windows), data, encoding='utf-8')
@@ -0,0 +1,328 @@
+import rasterio as rio
+
+from http.server import (ThreadingHTTPServer, BaseHTTPRequestHandler)
+from contextlib import contextmanager
+import requests
+import threading
+import hashlib
+import tempfile
+import re
+import os
+
+from leaf.metrics import Metrics, NO_METRICS
+
+from typing import Optional, List, Sequence, Tuple
+
+
+class BlockCache:
+    """Read byte ranges of remote files through a block-level disk cache.
+
+    Files are split into fixed-size blocks stored under root, one directory per URL.
+    Missing blocks are fetched with HTTP Range requests, where consecutive missing
+    blocks are coalesced into a single request.
+
+    With a budget the least recently read blocks are evicted, except for those of the
+    current read, until the blocks fit. Without one the cache grows with every window
+    read, and root can be deleted at any time, e.g. rm -r data/blocks, as it only
+    holds copies of remote data.
+    """
+
+    BLOCK = '.blk'
+
+    def __init__(self, base_url: str, root: str = 'data/blocks', block_size: int = 1 << 18, budget: Optional[int] = None, metrics: Optional[Metrics] = None):
+        """
+        Args:
+            base_url (str): The URL that file names are relative to.
+            root (str, optional): The local directory of the cache. Defaults to 'data/blocks'.
+            block_size (int, optional): The size of a cached block in bytes. Defaults to 256 KiB.
+            budget (Optional[int], optional): The maximum size of the cached blocks in bytes. Defaults to None, i.e. unbounded.
+            metrics (Optional[Metrics], optional): Receives the block cache hits, misses, evictions and bytes downloaded. Defaults to None.
+        """
+        self.base_url = base_url
+        self.root = root
+        self.block_size = block_size
+        self.budget = budget
+        self.metrics = NO_METRICS if metrics is None else metrics
+        self.thread_local = threading.local()
+        self._lock = threading.Lock()
+        self._size = None # the size of the cached blocks, counted on first use
+
+    def session(self) -> requests.Session:
+        if not hasattr(self.thread_local, 'session'):
+            self.thread_local.session = requests.Session()
+        return self.thread_local.session
+
+    def directory(self, name: str) -> str:
+        url = f'{self.base_url}/{name}'
+        key = hashlib.sha1(url.encode()).hexdigest()[:16]
+        directory = os.path.join(self.root, f'{os.path.basename(name)}.{key}.{self.block_size}')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def write(self, path: str, data: bytes):
+        # write to a temporary file then rename, so concurrent readers never see a partial block
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+    def size(self, name: str) -> int:
+        """The size of the remote file in bytes, from a HEAD request the first time.
+
+        Args:
+            name (str): The file name relative to base_url.
+
+        Returns:
+            int: The size in bytes.
+        """
+        path = os.path.join(self.directory(name), 'size')
+        if os.path.isfile(path):
+            with open(path) as f:
+                return int(f.read())
+
+        with self.session().head(f'{self.base_url}/{name}', allow_redirects=True, timeout=60) as response:
+            response.raise_for_status()
+            size = int(response.headers['Content-Length'])
+
+        self.write(path, str(size).encode())
+        return size
+
+    def fetch(self, name: str, first: int, last: int):
+        """Fetch blocks first..last, inclusive, with a single Range request and cache each of them.
+
+        Args:
+            name (str): The file name relative to base_url.
+            first (int): The first block.
+            last (int): The last block.
+        """
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, self.size(name)) - 1
+        headers = {'Range': f'bytes={start}-{end}'}
+
+        with self.metrics.stage('fetch', function='BlockCache'):
+            with self.session().get(f'{self.base_url}/{name}', headers=headers, timeout=60) as response:
+                response.raise_for_status()
+                data = response.content
+                if response.status_code != 206:
+                    data = data[start:end + 1] # the server ignored the Range
+
+        self.metrics.count('bytes_downloaded', len(data), function='BlockCache')
+
+        directory = self.directory(name)
+        for block in range(first, last + 1):
+            offset = (block - first) * self.block_size
+            self.write(os.path.join(directory, f'{block}{BlockCache.BLOCK}'), data[offset:offset + self.block_size])
+
+        if self.budget is not None:
+            with self._lock:
+                self._size = self.size_on_disk() if self._size is None else self._size + len(data)
+
+    def blocks(self) -> List[Tuple[float, int, str]]:
+        """The last access time, size and path of each cached block."""
+        result = []
+        if os.path.isdir(self.root):
+            for directory in os.scandir(self.root):
+                if directory.is_dir():
+                    for entry in os.scandir(directory.path):
+                        if entry.name.endswith(BlockCache.BLOCK):
+                            stat = entry.stat()
+                            result.append((stat.st_mtime, stat.st_size, entry.path))
+        return result
+
+    def size_on_disk(self) -> int:
+        """The total size of the cached blocks in bytes."""
+        return sum(size for _, size, _ in self.blocks())
+
+    def evict(self, keep: Sequence[str] = ()) -> int:
+        """Remove the least recently read blocks until the cache fits its budget.
+
+        Args:
+            keep (Sequence[str], optional): The paths of blocks that must not be evicted e.g. those being read. Defaults to ().
+
+        Returns:
+            int: The number of evicted blocks.
+        """
+        if self.budget is None:
+            return 0
+
+        keep = set(keep)
+        evicted = 0
+        with self._lock:
+            if self._size is None:
+                self._size = self.size_on_disk()
+            if self._size <= self.budget:
+                return 0
+
+            for _, size, path in sorted(self.blocks()):
+                if self._size <= self.budget:
+                    break
+                if path in keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                self._size -= size
+                evicted += 1
+
+        self.metrics.count('evictions', evicted, function='BlockCache')
+        return evicted
+
+    def read(self, name: str, start: int, end: int) -> bytes:
+        """Read bytes start..end, inclusive, of the remote file.
+
+        Args:
+            name (str): The file name relative to base_url.
+            start (int): The first byte.
+            end (int): The last byte, which is clipped to the size of the file.
+
+        Returns:
+            bytes: The requested bytes.
+        """
+        end = min(end, self.size(name) - 1)
+        if end < start:
+            return b''
+
+        directory = self.directory(name)
+        blocks = range(start // self.block_size, end // self.block_size + 1)
+        paths = [os.path.join(directory, f'{block}{BlockCache.BLOCK}') for block in blocks]
+        missing = [block for block, path in zip(blocks, paths) if not os.path.isfile(path)]
+
+        self.metrics.count('cache_hits', len(blocks) - len(missing), function='BlockCache')
+        self.metrics.count('cache_misses', len(missing), function='BlockCache')
+
+        for first, last in runs(missing):
+            self.fetch(name, first, last)
+        self.evict(keep=paths)
+
+        parts = []
+        for block, path in zip(blocks, paths):
+            try:
+                with open(path, 'rb') as f:
+                    parts.append(f.read())
+            except FileNotFoundError: # evicted by a concurrent read
+                self.fetch(name, block, block)
+                with open(path, 'rb') as f:
+                    parts.append(f.read())
+            if self.budget is not None:
+                os.utime(path) # the access time of a block is its modification time
+        data = b''.join(parts)
+
+        offset = blocks[0] * self.block_size
+        return data[start - offset:end - offset + 1]
+
+def runs(blocks: List[int]) -> List[Tuple[int, int]]:
+    """Coalesce sorted block numbers into runs of consecutive blocks.
+
+    Args:
+        blocks (List[int]): Sorted block numbers e.g. [1, 2, 3, 7].
+
+    Returns:
+        List[Tuple[int, int]]: The first and last block of each run e.g. [(1, 3), (7, 7)].
+    """
+    result = []
+    for block in blocks:
+        if result and result[-1][1] == block - 1:
+            result[-1] = (result[-1][0], block)
+        else:
+            result.append((block, block))
+    return result
+
+def handler(block_cache: BlockCache) -> type:
+    """An HTTP request handler that serves HEAD and single Range GET requests from block_cache."""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def respond(self, body: bool):
+            name = self.path.lstrip('/')
+            try:
+                size = block_cache.size(name)
+            except requests.HTTPError as error:
+                self.send_error(error.response.status_code)
+                return
+            except requests.RequestException:
+                self.send_error(502)
+                return
+
+            match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+            if match is None:
+                start, end = 0, size - 1
+            else:
+                first, last = match.groups()
+                if first == '': # a suffix range i.e. the last bytes
+                    start, end = max(0, size - int(last)), size - 1
+                else:
+                    start, end = int(first), size - 1 if last == '' else min(int(last), size - 1)
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{size}')
+                    self.end_headers()
+                    return
+
+            # read before the status is sent, so that an upstream failure can still be reported
+            data = b''
+            if body:
+                try:
+                    data = block_cache.read(name, start, end)
+                except requests.RequestException:
+                    self.send_error(502)
+                    return
+
+            if match is None:
+                self.send_response(200)
+            else:
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_HEAD(self):
+            self.respond(body=False)
+
+        def do_GET(self):
+            self.respond(body=True)
+
+    return Handler
+
+@contextmanager
+def remote(base_url: str, root: str = 'data/blocks', block_size: int = 1 << 18, budget: Optional[int] = None, metrics: Optional[Metrics] = None):
+    """Serve base_url through a local BlockCache, for windowed reads with GDAL /vsicurl/.
+
+    Within the context, rasterio and rioxarray can open f'/vsicurl/{url}/{file}' and
+    only the blocks of the file needed for the windows read are downloaded, once.
+
+    Args:
+        base_url (str): The URL of the remote files e.g. HANSEN_URL or a local http.server for testing.
+        root (str, optional): The local directory of the block cache. Defaults to 'data/blocks'.
+        block_size (int, optional): The size of a cached block in bytes. Defaults to 256 KiB.
+        budget (Optional[int], optional): The maximum size of the block cache in bytes, see BlockCache. Defaults to None, i.e. unbounded.
+        metrics (Optional[Metrics], optional): Receives the block cache hits, misses and bytes downloaded. Defaults to None.
+
+    Yields:
+        str: The local URL to use in place of base_url.
+    """
+    block_cache = BlockCache(base_url, root, block_size, budget, metrics)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler(block_cache))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    options = {
+        'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+        'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.tif',
+        'GDAL_HTTP_MERGE_CONSECUTIVE_RANGES': 'YES',
+        'CPL_VSIL_CURL_CHUNK_SIZE': str(block_size),
+        'VSI_CACHE': 'TRUE',
+    }
+
+    try:
+        with rio.Env(**options):
+            yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from typing import NamedTuple, Optional, Sequence
+
+
+class Weights(NamedTuple):
+    """A sparse matrix of the share of each column held by each row e.g. parents × assets."""
+    matrix: sparse.csr_matrix                     # rows × columns
+    index: pd.Index                               # the labels of the rows e.g. parent names
+    columns: pd.Index                             # the labels of the columns e.g. asset uids
+
+def link_weights(children: Sequence, parents: Sequence, shares: Optional[Sequence] = None, columns: Optional[pd.Index] = None, index: Optional[pd.Index] = None) -> Weights:
+    """The weights of links from children to parents e.g. assets to owners, or owners to parents.
+
+    Links with a missing child or parent are left out, and the shares of links that
+    appear more than once are added up. A missing share is the share of a child that
+    its links with a share leave, split equally among its links without one, so a
+    child with a single owner and no share is held entirely by it.
+
+    Args:
+        children (Sequence): The child of each link e.g. the uid of an asset.
+        parents (Sequence): The parent of each link e.g. parent_name.
+        shares (Optional[Sequence], optional): The share of each link from 0 to 1 e.g. percent_interest_parent / 100. Defaults to None, i.e. equal shares.
+        columns (Optional[pd.Index], optional): The children, in order. Defaults to None, i.e. those of the links.
+        index (Optional[pd.Index], optional): The parents, in order. Defaults to None, i.e. those of the links.
+
+    Returns:
+        Weights: parents × children.
+    """
+    links = pd.DataFrame({'child': children, 'parent': parents,
+                          'share': np.nan if shares is None else np.asarray(shares, dtype=float)})
+    links = links.dropna(subset=['child', 'parent'])
+
+    columns = pd.Index(links['child'].unique()) if columns is None else columns
+    index = pd.Index(links['parent'].unique()) if index is None else index
+    cols, rows = columns.get_indexer(links['child']), index.get_indexer(links['parent'])
+    known = (cols >= 0) & (rows >= 0)
+    links, cols, rows = links[known], cols[known], rows[known]
+
+    # the rest of the share of each child, split among its links without a share
+    missing = links['share'].isna().to_numpy()
+    if missing.any():
+        held = np.bincount(cols, weights=links['share'].fillna(0).to_numpy(), minlength=len(columns))
+        unshared = np.bincount(cols[missing], minlength=len(columns))
+        rest = np.clip(1 - held, 0, None)[cols[missing]] / unshared[cols[missing]]
+        links.loc[missing, 'share'] = rest
+
+    matrix = sparse.csr_matrix((links['share'].to_numpy(), (rows, cols)), shape=(len(index), len(columns)))
+    matrix.sum_duplicates()
+    return Weights(matrix, index, columns)
+
+def group_weights(keys: pd.Series) -> Weights:
+    """The indicator weights of a grouping e.g. assets by country or by sector.
+
+    Args:
+        keys (pd.Series): The group of each child, indexed by the child e.g. the country by uid.
+
+    Returns:
+        Weights: groups × children, with a 1 for the group of each child and none for a missing group.
+    """
+    codes, groups = pd.factorize(keys, sort=True)
+    known = codes >= 0
+    matrix = sparse.csr_matrix((np.ones(known.sum()), (codes[known], np.flatnonzero(known))), shape=(len(groups), len(keys)))
+    return Weights(matrix, pd.Index(groups), keys.index)
+
+def compose(outer: Weights, inner: Weights) -> Weights:
+    """The weights of chained links e.g. parents × owners composed with owners × assets is parents × assets.
+
+    The rows of inner are matched to the columns of outer by label, and a label that
+    is in only one of them holds nothing.
+
+    Args:
+        outer (Weights): e.g. parents × owners.
+        inner (Weights): e.g. owners × assets.
+
+    Returns:
+        Weights: outer.index × inner.columns.
+    """
+    positions = inner.index.get_indexer(outer.columns)
+    known = positions >= 0
+    matrix = outer.matrix[:, np.flatnonzero(known)] @ inner.matrix[positions[known]]
+    return Weights(matrix.tocsr(), outer.index, inner.columns)
+
+def exposure_matrix(df: pd.DataFrame, index: str = 'uid_gem', columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """The exposure of each asset per year, with missing values as 0.
+
+    Args:
+        df (pd.DataFrame): The assets e.g. from to_assets_with_lossyear.
+        index (str, optional): The column of the assets. Defaults to 'uid_gem'.
+        columns (Optional[Sequence[str]], optional): The columns of the exposure. Defaults to None, i.e. the years e.g. '2001'..'2022'.
+
+    Returns:
+        pd.DataFrame: assets × years, as floats.
+    """
+    if columns is None:
+        columns = [column for column in df.columns if str(column).isdigit()]
+    return df.set_index(index)[list(columns)].astype(float).fillna(0)
+
+def roll_up(weights: Weights, exposure: pd.DataFrame) -> pd.DataFrame:
+    """The exposure of the rows of weights e.g. of each parent, as one sparse product.
+
+    The rows of exposure are matched to the columns of weights by label, and assets
+    without exposure add nothing.
+
+    Args:
+        weights (Weights): e.g. parents × assets, see link_weights, group_weights and compose.
+        exposure (pd.DataFrame): assets × years, see exposure_matrix.
+
+    Returns:
+        pd.DataFrame: weights.index × exposure.columns.
+    """
+    if exposure.index.equals(weights.columns):
+        values = weights.matrix @ exposure.to_numpy(dtype=float)
+    else:
+        positions = exposure.index.get_indexer(weights.columns)
+        known = positions >= 0
+        values = weights.matrix[:, np.flatnonzero(known)] @ exposure.to_numpy(dtype=float)[positions[known]]
+    return pd.DataFrame(values, index=weights.index, columns=exposure.columns)
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from typing import Sequence, Union
+
+
+# the dtype of each column of the asset tables, applied to the columns a table has,
+# where names e.g. owner_name stay text as nearly every value is distinct
+ASSET_SCHEMA = {
+    'sector': 'category',
+    'sector_main': 'category',
+    'sector_sub': 'category',
+    'sector_sub_first': 'category',
+    'country': 'category',
+    'country_iso': 'category',
+    'capacity_unit': 'category',
+    'data_source': 'category',
+    'status': 'category',
+    'latitude': 'float32',
+    'longitude': 'float32',
+    'start_year': 'Int16',
+    'start_year_first': 'Int16',
+}
+
+# the prefix of the uid of each source, whose position is the code in the uid
+UID_PREFIXES = ['GEM', 'CLT', 'SFI']
+UID_BITS = 32
+
+def apply_schema(df: pd.DataFrame, schema: dict = ASSET_SCHEMA) -> pd.DataFrame:
+    """Convert the columns of an asset table to the dtypes of the schema.
+
+    Text columns with few distinct values become categorical, coordinates float32 and
+    years nullable integers, where values that are not a year e.g. 'not found' become
+    missing. List columns e.g. the start_year of gem_data_for_ml are left unchanged.
+
+    Args:
+        df (pd.DataFrame): An asset table e.g. from process_and_save_gem_data or combine_asset_datasets.
+        schema (dict, optional): The dtype per column. Defaults to ASSET_SCHEMA.
+
+    Returns:
+        pd.DataFrame: The table with converted columns, sharing the others with df.
+    """
+    converted = {}
+    for column, dtype in schema.items():
+        if column not in df.columns or df[column].dtype == dtype:
+            continue
+        if df[column].dtype == object and df[column].map(lambda value: isinstance(value, (list, np.ndarray))).any():
+            continue
+
+        if dtype == 'category':
+            converted[column] = df[column].astype('category')
+        elif dtype.startswith('float'):
+            converted[column] = pd.to_numeric(df[column], errors='coerce').astype(dtype)
+        else:
+            values = np.floor(pd.to_numeric(df[column], errors='coerce'))
+            info = np.iinfo(dtype.lower())
+            converted[column] = values.where(values.between(info.min, info.max)).astype(dtype)
+
+    if not converted:
+        return df
+    # unlike assign, which copies the whole frame, this only allocates the converted columns
+    return pd.DataFrame({column: converted.get(column, df[column]) for column in df.columns}, index=df.index, copy=False)
+
+def make_uid(prefix: str, count: int) -> np.ndarray:
+    """Integer uids 0..count-1 of a source, with the code of its prefix in the high bits.
+
+    Args:
+        prefix (str): One of UID_PREFIXES e.g. 'GEM'.
+        count (int): The number of uids.
+
+    Returns:
+        np.ndarray: The uids as int64, unique across sources.
+    """
+    code = UID_PREFIXES.index(prefix)
+    return (np.int64(code) << UID_BITS) + np.arange(count, dtype=np.int64)
+
+def format_uid(uids: Union[int, Sequence[int]]) -> Union[str, np.ndarray]:
+    """The text form of integer uids e.g. 'GEM_12', as the uid column was before.
+
+    Args:
+        uids (Union[int, Sequence[int]]): A uid or uids from make_uid.
+
+    Returns:
+        Union[str, np.ndarray]: The uid or uids as text.
+    """
+    array = np.asarray(uids, dtype=np.int64)
+    prefixes = np.asarray(UID_PREFIXES)[array >> UID_BITS]
+    numbers = (array & ((1 << UID_BITS) - 1)).astype(str)
+    result = np.char.add(np.char.add(prefixes, '_'), numbers)
+    return str(result) if result.ndim == 0 else result
+
+def parse_uid(uid: str) -> int:
+    """The integer form of a uid in text form e.g. 'GEM_12', see format_uid."""
+    prefix, number = uid.split('_')
+    return (UID_PREFIXES.index(prefix) << UID_BITS) + int(number)
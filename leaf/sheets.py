@@ -0,0 +1,258 @@
+import numpy as np
+import pandas as pd
+import openpyxl
+from openpyxl.cell.cell import ERROR_CODES
+from pandas.io.parsers import TextParser
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+from leaf.storage import read_table, write_table
+
+from typing import Optional, List
+
+
+# where parsed sheets are kept, see read_sheet
+SHEET_CACHE = os.path.join('data', '.sheets')
+HASHES = 'hashes.json'
+
+# guards the memo of content_hash, not the hashing, so threads hash files concurrently
+memo_lock = threading.Lock()
+
+# the prefix of the column with the type of each value of a column that mixes types
+TYPE_PREFIX = '__type__'
+TYPES = {
+    'int': int,
+    'float': float,
+    'bool': lambda value: value == 'True',
+    'datetime': pd.Timestamp,
+    'time': datetime.time.fromisoformat,
+}
+
+def content_hash(path: str, root: str = SHEET_CACHE) -> str:
+    """The sha256 of the content of a file, remembered by its size and modification time.
+
+    Hashing a large workbook takes a fraction of a second, so it is only done again
+    when the size or the modification time of the file changes. It is safe to call
+    from several threads, which hash at the same time.
+
+    Args:
+        path (str): The path to the file.
+        root (str, optional): The directory of the memo. Defaults to SHEET_CACHE.
+
+    Returns:
+        str: The hex digest.
+    """
+    def read_memo() -> dict:
+        try:
+            with open(memo, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    memo = os.path.join(root, HASHES)
+    key = os.path.abspath(path)
+    stat = os.stat(path)
+    with memo_lock:
+        entry = read_memo().get(key)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+        return entry['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+
+    with memo_lock:
+        # read again, as other threads may have added hashes meanwhile
+        hashes = read_memo()
+        hashes[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest.hexdigest()}
+        os.makedirs(root, exist_ok=True)
+        temp = f'{memo}.{os.getpid()}.part'
+        with open(temp, 'w') as f:
+            json.dump(hashes, f, indent=2)
+        os.replace(temp, memo)
+
+    return digest.hexdigest()
+
+def sheet_names(path: str, root: str = SHEET_CACHE) -> List[str]:
+    """The names of the sheets of a workbook, cached by the content of the file.
+
+    Args:
+        path (str): The path to the workbook.
+        root (str, optional): The directory of the cache. Defaults to SHEET_CACHE.
+
+    Returns:
+        List[str]: The names in the order of the workbook.
+    """
+    cached = os.path.join(root, f'{content_hash(path, root)}.json')
+    if os.path.isfile(cached):
+        with open(cached, 'r') as f:
+            return json.load(f)
+
+    with pd.ExcelFile(path, engine='openpyxl') as xl:
+        names = xl.sheet_names
+
+    temp = f'{cached}.{os.getpid()}.part'
+    with open(temp, 'w') as f:
+        json.dump(names, f)
+    os.replace(temp, cached)
+
+    return names
+
+def resolve_sheet(names: List[str]) -> str:
+    """The sheet with the data of a workbook: the second if there is an 'About' sheet, as in the GEM trackers, else the first."""
+    return names[1] if 'About' in names else names[0]
+
+def clean_name(name) -> str:
+    """A column name in lowercase with underscores for spaces, as in the asset tables."""
+    return str(name).lower().replace(' ', '_')
+
+def read_columns(path: str, sheet_name: Optional[str] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Read some columns of a sheet, opening the workbook once and streaming its rows.
+
+    The workbook is opened read-only, the sheet is resolved from its names and only
+    the cells of the requested columns are kept, before they are converted to typed
+    columns the way pd.read_excel does, e.g. empty cells and 'NA' become NaN.
+
+    Args:
+        path (str): The path to the workbook e.g. a GEM tracker.
+        sheet_name (Optional[str], optional): The name of the sheet. Defaults to None, see resolve_sheet.
+        columns (Optional[List[str]], optional): The columns by their clean_name e.g. 'capacity_(mw)'. Defaults to None, i.e. all.
+
+    Returns:
+        pd.DataFrame: The columns in the order of the sheet, with the names of the sheet.
+    """
+    def convert(value):
+        if value is None:
+            return ''
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str) and value in ERROR_CODES:
+            return np.nan
+        return value
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook[resolve_sheet(workbook.sheetnames) if sheet_name is None else sheet_name]
+        sheet.reset_dimensions()
+
+        data, last = [], -1
+        indices = None
+        for number, row in enumerate(sheet.iter_rows(values_only=True)):
+            if indices is None and columns is not None:
+                indices = [i for i, name in enumerate(row) if name is not None and clean_name(name) in columns]
+            if any(value is not None for value in row):
+                last = number
+            if indices is None:
+                # all columns, up to the last cell with a value as in pd.read_excel
+                width = len(row)
+                while width > 0 and row[width - 1] is None:
+                    width -= 1
+                data.append([convert(value) for value in row[:width]])
+            else:
+                data.append([convert(row[i]) if i < len(row) else '' for i in indices])
+    finally:
+        workbook.close()
+
+    data = data[:last + 1]
+    if not data:
+        return pd.DataFrame()
+    width = max(len(row) for row in data)
+    data = [row + [''] * (width - len(row)) for row in data]
+    return TextParser(data, header=0, skip_blank_lines=False).read()
+
+def read_sheet(path: str, sheet_name: Optional[str] = None, columns: Optional[List[str]] = None, root: Optional[str] = SHEET_CACHE, verbose: bool = False, **kwargs) -> pd.DataFrame:
+    """Read a sheet of a workbook, parsing it only if the workbook or the options changed.
+
+    A parsed sheet is kept as Parquet under root, keyed by the content of the workbook,
+    the sheet and the reader options, so that a workbook that was replaced is parsed
+    again and an unchanged one is not. Object columns that mix e.g. numbers and text
+    keep the type of each value, see encode_mixed, so that the sheet is the same as
+    one that was just parsed.
+
+    Args:
+        path (str): The path to the workbook e.g. a GEM tracker.
+        sheet_name (Optional[str], optional): The name of the sheet. Defaults to None, see resolve_sheet.
+        columns (Optional[List[str]], optional): The columns by their clean_name, see read_columns. Defaults to None, i.e. all.
+        root (Optional[str], optional): The directory of the cache, None to always parse. Defaults to SHEET_CACHE.
+        verbose (bool, optional): Print whether the sheet was parsed. Defaults to False.
+        **kwargs: Passed to pd.read_excel instead of read_columns e.g. dtype.
+
+    Returns:
+        pd.DataFrame: The sheet.
+    """
+    def parse() -> pd.DataFrame:
+        if kwargs:
+            with pd.ExcelFile(path, engine='openpyxl') as xl:
+                return xl.parse(resolve_sheet(xl.sheet_names) if sheet_name is None else sheet_name,
+                                usecols=None if columns is None else lambda name: clean_name(name) in columns, **kwargs)
+        return read_columns(path, sheet_name, columns)
+
+    if root is None:
+        return parse()
+
+    options = json.dumps({'sheet_name': sheet_name, 'columns': columns, **kwargs}, sort_keys=True, default=str)
+    key = hashlib.sha256(f'{content_hash(path, root)}:{options}'.encode()).hexdigest()
+    cached = os.path.join(root, f'{key}.parquet')
+
+    if os.path.isfile(cached):
+        if verbose: print(f'Reading {sheet_name} of {path} from {cached}')
+        return decode_mixed(read_table(cached))
+
+    if verbose: print(f'Parsing {sheet_name} of {path}')
+    df = parse()
+    df.columns = [str(column) for column in df.columns]
+
+    temp = os.path.join(root, f'{key}.{os.getpid()}.part.parquet')
+    write_table(encode_mixed(df), temp)
+    os.replace(temp, cached)
+
+    return df
+
+def encode_mixed(df: pd.DataFrame) -> pd.DataFrame:
+    """Store object columns that mix types, e.g. capacities and 'unknown', as text with the type of each value.
+
+    Cells of a sheet have a type each, so a column can hold numbers, text and dates,
+    which Parquet cannot. The type goes to a column named TYPE_PREFIX + column, see
+    decode_mixed.
+
+    Args:
+        df (pd.DataFrame): The sheet as read by pd.read_excel.
+
+    Returns:
+        pd.DataFrame: The sheet that write_table keeps as it is.
+    """
+    df = df.copy()
+    for column in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[column], skipna=True) in ('string', 'empty'):
+            continue
+        values = df[column]
+        missing = values.isna()
+        df[TYPE_PREFIX + column] = values.map(lambda value: type(value).__name__).where(~missing)
+        df[column] = values.map(lambda value: value.isoformat() if isinstance(value, (datetime.datetime, datetime.time)) else str(value)).where(~missing)
+        df.loc[df[TYPE_PREFIX + column] == 'Timestamp', TYPE_PREFIX + column] = 'datetime'
+    return df
+
+def decode_mixed(df: pd.DataFrame) -> pd.DataFrame:
+    """Restore the columns stored by encode_mixed, and missing text as NaN as pd.read_excel has it.
+
+    Args:
+        df (pd.DataFrame): The sheet as read from the cache.
+
+    Returns:
+        pd.DataFrame: The sheet as read by pd.read_excel.
+    """
+    for column in df.columns[df.dtypes == object]:
+        if column.startswith(TYPE_PREFIX):
+            continue
+        values = df[column].astype(object)
+        types = df.get(TYPE_PREFIX + column)
+        if types is not None:
+            values = pd.Series([value if kind is None or kind not in TYPES else TYPES[kind](value)
+                                for value, kind in zip(values, types)], index=df.index, dtype=object)
+        df[column] = values.where(values.notna(), np.nan)
+    return df.drop(columns=[column for column in df.columns if column.startswith(TYPE_PREFIX)])
@@ -0,0 +1,273 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import operator
+import os
+import tempfile
+
+from typing import Optional, List, Iterator, Iterable, Callable
+
+
+class Format:
+    PARQUET = 'parquet'
+    FEATHER = 'feather'
+    CSV = 'csv'
+
+EXTENSIONS = {
+    '.parquet': Format.PARQUET,
+    '.pq': Format.PARQUET,
+    '.feather': Format.FEATHER,
+    '.arrow': Format.FEATHER,
+}
+
+OPERATORS = {
+    '==': operator.eq, '=': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+    'in': lambda column, value: column.isin(value),
+    'not in': lambda column, value: ~column.isin(value),
+}
+
+def table_format(path: str) -> str:
+    """The format of a table file from its extension, where anything unknown e.g. .csv or .tsv is CSV.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        str: Format.PARQUET, Format.FEATHER or Format.CSV.
+    """
+    _, extension = os.path.splitext(path)
+    return EXTENSIONS.get(extension.lower(), Format.CSV)
+
+def read_table(path: str,
+               separator: str = ',',
+               columns: Optional[List[str]] = None,
+               filters: Optional[List[tuple]] = None,
+               **kwargs) -> pd.DataFrame:
+    """Read a table as Parquet, Feather or CSV depending on the extension of path.
+
+    Parquet and Feather keep the types of the columns, including list columns, and only
+    the requested columns are read. Parquet filters are pushed down to skip row groups.
+
+    Args:
+        path (str): The path to the file e.g. data/assets_for_deforestation.parquet.
+        separator (str, optional): The separator of a CSV file. Defaults to ','.
+        columns (Optional[List[str]], optional): The columns to read. Defaults to None, i.e. all.
+        filters (Optional[List[tuple]], optional): Row filters e.g. [('start_year_first', '>=', 2001)]. Defaults to None.
+        **kwargs: Passed to pd.read_csv for CSV files e.g. low_memory=False.
+
+    Returns:
+        pd.DataFrame: The table.
+    """
+    match table_format(path):
+        case Format.PARQUET:
+            return pd.read_parquet(path, columns=columns, filters=filters)
+        case Format.FEATHER:
+            df = pd.read_feather(path, columns=columns)
+        case _:
+            df = pd.read_csv(path, sep=separator, usecols=columns, **kwargs)
+
+    if filters is not None:
+        mask = np.ones(len(df), dtype=bool)
+        for column, op, value in filters:
+            mask &= OPERATORS[op](df[column], value).to_numpy()
+        df = df[mask].reset_index(drop=True)
+
+    return df
+
+def read_table_chunks(path: str, separator: str = ',', chunksize: int = 100_000, **kwargs) -> Iterator[pd.DataFrame]:
+    """Read a table in chunks of rows, see read_table.
+
+    CSV files are parsed and Parquet files are decoded chunk by chunk. Feather files
+    are memory-mapped and sliced.
+
+    Args:
+        path (str): The path to the file.
+        separator (str, optional): The separator of a CSV file. Defaults to ','.
+        chunksize (int, optional): The number of rows per chunk. Defaults to 100_000.
+        **kwargs: Passed to pd.read_csv for CSV files.
+
+    Yields:
+        pd.DataFrame: The next chunk.
+    """
+    match table_format(path):
+        case Format.PARQUET:
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+                yield batch.to_pandas()
+        case Format.FEATHER:
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            for offset in range(0, table.num_rows, chunksize):
+                yield table.slice(offset, chunksize).to_pandas()
+        case _:
+            with pd.read_csv(path, sep=separator, chunksize=chunksize, **kwargs) as reader:
+                yield from reader
+
+def read_arrow(path: str) -> pa.Table:
+    """Memory-map an uncompressed Feather (Arrow IPC) file.
+
+    The columns of the table are backed by the file rather than copied into memory,
+    and the pages are shared by every process that maps the file.
+
+    Args:
+        path (str): The path to the file e.g. written by write_table or to_arrow_file.
+
+    Returns:
+        pa.Table: The table.
+    """
+    return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+def to_arrow_file(path: str, target: str, separator: str = ',', transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None) -> str:
+    """Convert a table to an uncompressed Feather file once, see read_arrow.
+
+    The conversion is skipped when target is newer than path.
+
+    Args:
+        path (str): The path to the table e.g. data/regression_sample.csv.
+        target (str): The path to the Feather file e.g. data/.arrow/regression_sample.csv.feather.
+        separator (str, optional): The separator of a CSV file. Defaults to ','.
+        transform (Optional[Callable[[pd.DataFrame], pd.DataFrame]], optional): Applied before writing e.g. apply_schema. Defaults to None.
+
+    Returns:
+        str: target.
+    """
+    if os.path.isfile(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+        return target
+
+    df = read_table(path, separator)
+    if transform is not None:
+        df = transform(df)
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    root, extension = os.path.splitext(target)
+    temp = f'{root}.part{extension}'
+    write_table(df, temp)
+    os.replace(temp, target)
+
+    return target
+
+def write_table(df: pd.DataFrame, path: str, separator: str = ',', index: bool = False, **kwargs):
+    """Write a table as Parquet, Feather or CSV depending on the extension of path.
+
+    For Parquet and Feather an index that is written becomes a column, as it does in a
+    CSV file, and object columns that mix e.g. numbers and text become text. Feather
+    files are not compressed, so that they can be memory-mapped, see read_arrow.
+
+    Args:
+        df (pd.DataFrame): The table.
+        path (str): The path to the file e.g. data/assets_for_deforestation.parquet.
+        separator (str, optional): The separator of a CSV file. Defaults to ','.
+        index (bool, optional): Write the index too. Defaults to False.
+        **kwargs: Passed to to_csv for CSV files e.g. mode='a'.
+    """
+    format = table_format(path)
+    if format == Format.CSV:
+        df.to_csv(path, sep=separator, index=index, **kwargs)
+        return
+
+    df = to_arrow_compatible(df.reset_index() if index else df.reset_index(drop=True))
+
+    if format == Format.PARQUET:
+        df.to_parquet(path, index=False)
+    else:
+        df.to_feather(path, compression='uncompressed')
+
+def to_arrow_compatible(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert object columns that mix scalar types, e.g. years and 'not found', and column names to text.
+
+    Args:
+        df (pd.DataFrame): The table.
+
+    Returns:
+        pd.DataFrame: The table, a copy if any column was converted.
+    """
+    def is_nested(value) -> bool:
+        return isinstance(value, (list, tuple, dict, np.ndarray))
+
+    mixed = []
+    for column in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[column], skipna=True) not in ('mixed', 'mixed-integer'):
+            continue
+        values = df[column].dropna()
+        if not values.map(is_nested).all():
+            mixed.append(column)
+
+    if not mixed and all(isinstance(column, str) for column in df.columns):
+        return df
+
+    df = df.copy()
+    for column in mixed:
+        df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    df.columns = [str(column) for column in df.columns]
+    return df
+
+def unify_schemas(schemas: List[pa.Schema]) -> pa.Schema:
+    """The schema that the tables of all schemas can be cast to.
+
+    Types are promoted, e.g. null to string, int64 to double or the indices of a
+    dictionary to a wider integer, and a field whose types cannot be promoted, e.g.
+    int64 and string, becomes string. The metadata is that of the first schema.
+
+    Args:
+        schemas (List[pa.Schema]): The schemas e.g. of the chunks of a table.
+
+    Returns:
+        pa.Schema: The unified schema.
+    """
+    fields = []
+    for name in dict.fromkeys(name for schema in schemas for name in schema.names):
+        types = [pa.schema([schema.field(name)]) for schema in schemas if name in schema.names]
+        try:
+            fields.append(pa.unify_schemas(types, promote_options='permissive').field(name))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            fields.append(pa.field(name, pa.string()))
+    return pa.schema(fields, metadata=schemas[0].metadata)
+
+def write_table_chunks(chunks: Iterable[pd.DataFrame], path: str, separator: str = ',', **kwargs) -> int:
+    """Write chunks of a table as they arrive, see write_table.
+
+    CSV files are appended to. For Parquet files each chunk is spooled to a temporary
+    file next to path, and then written as a row group cast to the schema of all the
+    chunks, see unify_schemas, so that a column that is e.g. empty in the first chunk
+    or categorical with other categories in a later one has a single type. Feather
+    files are written once all chunks are read.
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): The chunks e.g. from to_reg_sample(chunksize=...).
+        path (str): The path to the file.
+        separator (str, optional): The separator of a CSV file. Defaults to ','.
+        **kwargs: Passed to to_csv for CSV files e.g. encoding='utf-8'.
+
+    Returns:
+        int: The number of rows written.
+    """
+    rows = 0
+    match table_format(path):
+        case Format.PARQUET:
+            with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as directory:
+                spooled = []
+                for df in chunks:
+                    table = pa.Table.from_pandas(to_arrow_compatible(df.reset_index(drop=True)), preserve_index=False)
+                    spooled.append((os.path.join(directory, f'{len(spooled)}.parquet'), table.schema))
+                    pq.write_table(table, spooled[-1][0])
+                    rows += len(df)
+
+                if spooled:
+                    schema = unify_schemas([schema for _, schema in spooled])
+                    temp = os.path.join(directory, 'table.parquet')
+                    with pq.ParquetWriter(temp, schema) as writer:
+                        for file, _ in spooled:
+                            writer.write_table(pq.read_table(file).cast(schema))
+                            os.remove(file)
+                    os.replace(temp, path)
+        case Format.FEATHER:
+            dfs = list(chunks)
+            rows = sum(len(df) for df in dfs)
+            write_table(pd.concat(dfs, ignore_index=True), path)
+        case _:
+            for i, df in enumerate(chunks):
+                df.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, sep=separator, index=False, **kwargs)
+                rows += len(df)
+
+    return rows
@@ -0,0 +1,417 @@
+import pandas as pd
+import requests
+
+import rasterio as rio
+import rasterio.shutil
+from rasterio.windows import Window
+
+import threading
+import tempfile
+import hashlib
+import base64
+import json
+import math
+import time
+import os
+
+from leaf.deforestation import (
+    HANSEN_BASE_URL,
+    HANSEN_VERSION,
+    cache,
+    get_session,
+    file_earthenginepartners_hansen,
+    files_earthenginepartners_hansen
+)
+from leaf.metrics import Metrics, NO_METRICS
+from leaf.storage import read_table
+
+from typing import Optional, List, Sequence, Tuple, Union
+
+
+class TileCache:
+    """A size-bounded cache of Hansen tiles with an integrity manifest.
+
+    The manifest, root/manifest.json, records the url, size, dataset version and last
+    access time and MD5 of every cached file, and the size and MD5 checksum that the
+    server announces for it. A file is verified the first time it is used after
+    download, i.e. its size and MD5 are compared with those of the server, from the
+    Content-Length and x-goog-hash headers of a HEAD request, and rasterio must be able
+    to read its last row. A server that announces no MD5 leaves only the size and read
+    checks, and one that cannot be reached the local MD5, see verify. A corrupt file is
+    downloaded again. Hansen tiles that were cached before the manifest
+    existed are adopted, so they count towards the budget too.
+
+    With transcode, each verified tile is also rewritten once as a cloud-optimized
+    GeoTIFF in root/cog, which the leaf.deforestation readers prefer, see resolve.
+
+    With a budget the least recently used files are evicted, except for those of
+    the current request, until the cache fits. The manifest assumes a single
+    process writes to root at a time.
+    """
+
+    MANIFEST = 'manifest.json'
+    COG = 'cog'
+
+    def __init__(self,
+                 root: str = 'data',
+                 budget: Optional[int] = None,
+                 version: str = HANSEN_VERSION,
+                 base_url: Optional[str] = None,
+                 max_workers: int = 5,
+                 transcode: bool = False,
+                 compress: str = 'ZSTD',
+                 verbose: bool = False,
+                 metrics: Optional[Metrics] = None):
+        """
+        Args:
+            root (str, optional): The local directory of the cache. Defaults to 'data'.
+            budget (Optional[int], optional): The maximum size of the cached files in bytes. Defaults to None, i.e. unbounded.
+            version (str, optional): The Hansen dataset version e.g. 'GFC-2022-v1.10'. Defaults to HANSEN_VERSION.
+            base_url (Optional[str], optional): The URL to download from. Defaults to None, i.e. the version on HANSEN_BASE_URL.
+            max_workers (int, optional): The number of concurrent downloads. Defaults to 5.
+            transcode (bool, optional): Also keep a cloud-optimized copy of each tile. Defaults to False.
+            compress (str, optional): The lossless compression of the copies, 'ZSTD', 'LZW' or 'DEFLATE'. Defaults to 'ZSTD'.
+            verbose (bool, optional): Print additional information to console. Defaults to False.
+            metrics (Optional[Metrics], optional): Receives the downloads, verifications and evictions. Defaults to None.
+        """
+        self.root = root
+        self.budget = budget
+        self.version = version
+        self.base_url = f'{HANSEN_BASE_URL}/{version}' if base_url is None else base_url
+        self.max_workers = max_workers
+        self.transcode = transcode
+        self.compress = compress
+        self.verbose = verbose
+        self.metrics = NO_METRICS if metrics is None else metrics
+        self._lock = threading.RLock()
+        self.files = self.load()
+
+        # adopt the tiles that were cached before the manifest existed
+        if os.path.isdir(root):
+            adopted = [file for file in sorted(os.listdir(root)) if file.startswith('Hansen_') and file.endswith('.tif') and file not in self.files]
+            for file in adopted:
+                self.add(file)
+            if adopted:
+                self.save()
+
+    def path(self, file: str) -> str:
+        return os.path.join(self.root, file)
+
+    def cog(self, file: str) -> str:
+        return os.path.join(self.root, TileCache.COG, file)
+
+    def load(self) -> dict:
+        path = self.path(TileCache.MANIFEST)
+        if not os.path.isfile(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)['files']
+
+    def save(self):
+        # write to a temporary file then rename, so an interrupted save keeps the previous manifest
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            text = json.dumps({'files': self.files}, indent=2, sort_keys=True)
+        fd, temp = tempfile.mkstemp(dir=self.root, suffix='.part')
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(temp, self.path(TileCache.MANIFEST))
+
+    def size(self) -> int:
+        """The total size of the cached files, and their copies, in bytes."""
+        with self._lock:
+            return sum(entry['size'] + entry.get('cog_size', 0) for entry in self.files.values())
+
+    def add(self, file: str):
+        """Record a file, which must be in root, in the manifest as not yet verified."""
+        path = self.path(file)
+        # e.g. Hansen_GFC-2022-v1.10_lossyear_20S_060W.tif
+        version = file.split('_')[1] if file.startswith('Hansen_') else self.version
+        url = f'{self.base_url}/{file}' if version == self.version else f'{HANSEN_BASE_URL}/{version}/{file}'
+        with self._lock:
+            self.files[file] = {
+                'url': url,
+                'size': os.path.getsize(path),
+                'version': version,
+                'last_access': time.time(),
+                'verified': False
+            }
+            if os.path.isfile(self.cog(file)):
+                self.files[file]['cog_size'] = os.path.getsize(self.cog(file))
+
+    def verify(self, file: str) -> bool:
+        """Check a cached file against the size and MD5 of the server and that rasterio can read it.
+
+        The size and MD5 of the server are requested once and kept in the manifest. When
+        the server cannot be reached the file is checked against the MD5 it had when it
+        was last verified, if any, and stays unverified so that the next verification
+        online compares it with the server.
+
+        Args:
+            file (str): The file name relative to root.
+
+        Returns:
+            bool: True if the file is valid. It is then marked as verified in the manifest, if it was compared with the server.
+        """
+        labels = {'function': 'TileCache.verify'}
+        path = self.path(file)
+        with self.metrics.stage('verify', **labels):
+            with self._lock:
+                entry = self.files.get(file)
+            valid = entry is not None and os.path.isfile(path) and os.path.getsize(path) == entry['size']
+            if valid:
+                digest = md5(path)
+                if 'server_md5' not in entry:
+                    try:
+                        server_size, server_md5 = server_checksum(entry['url'])
+                        with self._lock:
+                            entry['server_size'], entry['server_md5'] = server_size, server_md5
+                    except requests.RequestException as error:
+                        if self.verbose:
+                            print(f'Cannot verify {path} against {entry["url"]}: {error}')
+                online = 'server_md5' in entry
+                if online:
+                    valid = entry['server_size'] in (None, entry['size']) and entry['server_md5'] in (None, digest)
+                else:
+                    valid = entry.get('md5') in (None, digest)
+                valid = valid and readable(path)
+
+        if valid:
+            with self._lock:
+                entry['md5'] = digest
+                entry['verified'] = online
+        else:
+            self.metrics.count('corrupt', **labels)
+            if self.verbose:
+                print(f'File {path} is corrupt.')
+
+        return valid
+
+    def remove(self, file: str):
+        with self._lock:
+            self.files.pop(file, None)
+        for path in [self.path(file), self.cog(file)]:
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def to_cog(self, file: str) -> str:
+        """Rewrite a cached tile as a cloud-optimized GeoTIFF in root/cog.
+
+        The copy has 512x512 internal tiles, lossless compression and internal overviews
+        resampled with NEAREST, which keeps the values of categorical layers such as
+        lossyear. Windowed reads then decode only the tiles they touch and coarse reads
+        use an overview rather than the full resolution.
+
+        Args:
+            file (str): The file name relative to root.
+
+        Returns:
+            str: The path to the copy.
+        """
+        labels = {'function': 'TileCache.to_cog'}
+        path = self.cog(file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        options = {
+            'BLOCKSIZE': 512,
+            'COMPRESS': self.compress,
+            'OVERVIEWS': 'AUTO',
+            'OVERVIEW_RESAMPLING': 'NEAREST',
+            'BIGTIFF': 'IF_SAFER',
+            'NUM_THREADS': 'ALL_CPUS'
+        }
+
+        # write to a temporary file then rename, so an interrupted transcode leaves no copy to prefer
+        temp = f'{path}.part'
+        with self.metrics.stage('transcode', **labels):
+            rasterio.shutil.copy(self.path(file), temp, driver='COG', **options)
+        os.replace(temp, path)
+
+        with self._lock:
+            self.files[file]['cog_size'] = os.path.getsize(path)
+
+        if self.verbose:
+            print(f'Transcoded {self.path(file)} to {path}, {self.files[file]["size"]} to {self.files[file]["cog_size"]} bytes.')
+
+        return path
+
+    def get(self, files: List[str]) -> List[str]:
+        """Download the missing files, verify those used for the first time and evict others if over budget.
+
+        With transcode, the verified files without a cloud-optimized copy are transcoded.
+
+        Args:
+            files (List[str]): The file names, relative to both root and base_url.
+
+        Returns:
+            List[str]: The local paths of the files.
+        """
+        for file in files:
+            exists = os.path.isfile(self.path(file))
+            if file in self.files and (not exists or os.path.getsize(self.path(file)) != self.files[file]['size']):
+                # deleted or modified behind the back of the manifest
+                self.remove(file)
+                exists = False
+            if file not in self.files and exists:
+                # adopt files that were added since
+                self.add(file)
+
+        cache(self.root, files, self.base_url, max_workers=self.max_workers, verbose=self.verbose, metrics=self.metrics)
+        for file in files:
+            if file not in self.files:
+                self.add(file)
+
+        corrupt = [file for file in files if not self.files[file]['verified'] and not self.verify(file)]
+        if corrupt:
+            for file in corrupt:
+                self.remove(file)
+            cache(self.root, corrupt, self.base_url, max_workers=self.max_workers, verbose=self.verbose, metrics=self.metrics)
+            for file in corrupt:
+                self.add(file)
+                if not self.verify(file):
+                    self.save()
+                    raise IOError(f'File {self.path(file)} downloaded from {self.files[file]["url"]} is corrupt.')
+
+        if self.transcode:
+            for file in files:
+                if not os.path.isfile(self.cog(file)):
+                    self.to_cog(file)
+
+        now = time.time()
+        with self._lock:
+            for file in files:
+                self.files[file]['last_access'] = now
+
+        self.evict(keep=files)
+        self.save()
+
+        return [self.path(file) for file in files]
+
+    def evict(self, keep: Sequence[str] = ()) -> List[str]:
+        """Remove the least recently used files until the cache fits its budget.
+
+        Args:
+            keep (Sequence[str], optional): Files that must not be evicted e.g. those in use. Defaults to ().
+
+        Returns:
+            List[str]: The evicted file names.
+        """
+        if self.budget is None:
+            return []
+
+        labels = {'function': 'TileCache.evict'}
+        keep = set(keep)
+
+        with self._lock:
+            size = self.size()
+            candidates = sorted((entry['last_access'], file) for file, entry in self.files.items() if file not in keep)
+
+            evicted = []
+            for _, file in candidates:
+                if size <= self.budget:
+                    break
+                entry = self.files[file]
+                size -= entry['size'] + entry.get('cog_size', 0)
+                self.remove(file)
+                evicted.append(file)
+
+        self.metrics.count('evictions', len(evicted), **labels)
+
+        if self.verbose and evicted:
+            print(f'Evicted {len(evicted)} files, the cache is {size} bytes of a budget of {self.budget} bytes.')
+        if size > self.budget:
+            print(f'Warning: the {len(keep)} files in use are {size} bytes, more than the budget of {self.budget} bytes.')
+
+        return evicted
+
+    def layers(self, layers: List[str], latitudes: range, longitudes: range) -> dict:
+        """Cache the tiles of the layers covering the given latitudes and longitudes.
+
+        Args:
+            layers (List[str]): The layers e.g. ['lossyear', 'treecover2000'].
+            latitudes (range): The latitudes of the tiles e.g. range(-10, -30, -10).
+            longitudes (range): The longitudes of the tiles e.g. range(-60, -40, 10).
+
+        Returns:
+            dict: A list of file names per layer.
+        """
+        files_per_layer = files_earthenginepartners_hansen(layers, latitudes, longitudes, self.version)
+        self.get([file for files in files_per_layer.values() for file in files])
+        return files_per_layer
+
+    def prefetch(self, assets: Union[str, pd.DataFrame], separator: str = ',', layers: List[str] = ['lossyear', 'treecover2000']) -> dict:
+        """Cache the tiles of the layers containing the given assets.
+
+        Args:
+            assets (Union[str, pd.DataFrame]): Assets with 'latitude' and 'longitude' columns, or the path to a file of them.
+            separator (str, optional): The separator of the CSV file. Defaults to ','.
+            layers (List[str], optional): The layers. Defaults to ['lossyear', 'treecover2000'].
+
+        Returns:
+            dict: A list of file names per layer.
+        """
+        if isinstance(assets, str):
+            assets = read_table(assets, separator, columns=['latitude', 'longitude'])
+
+        files_per_layer = {}
+        tiles = tiles_of(assets['latitude'], assets['longitude'])
+        for layer in layers:
+            files_per_layer[layer] = [file_earthenginepartners_hansen(layer, lat, long, self.version) for (lat, long) in tiles]
+
+        if self.verbose:
+            print(f'Prefetching {len(tiles)} tiles for {len(assets)} assets.')
+
+        self.get([file for files in files_per_layer.values() for file in files])
+        return files_per_layer
+
+def tiles_of(lats: Sequence[float], longs: Sequence[float], step: int = 10) -> List[tuple]:
+    """The top left corners of the tiles containing the given GPS locations.
+
+    Args:
+        lats (Sequence[float]): The latitudes of GPS coordinates.
+        longs (Sequence[float]): The longitudes of GPS coordinates.
+        step (int, optional): The size of a tile in degrees. Defaults to 10.
+
+    Returns:
+        List[tuple]: The unique (lat, long) of each tile, sorted e.g. [(-10, -60), (-20, -60)].
+    """
+    tiles = {
+        (math.ceil(lat / step) * step, math.floor(long / step) * step)
+        for lat, long in zip(lats, longs)
+        if not (math.isnan(lat) or math.isnan(long))
+    }
+    return sorted(tiles)
+
+def server_checksum(url: str) -> Tuple[Optional[int], Optional[str]]:
+    """The size and MD5 that the server announces for a file, from a HEAD request.
+
+    Google Cloud Storage sends the MD5 as 'x-goog-hash: crc32c=...,md5=...' in base64.
+
+    Args:
+        url (str): The URL of the file.
+
+    Returns:
+        Tuple[Optional[int], Optional[str]]: The size in bytes and the base64 MD5, each None if not announced.
+    """
+    with get_session().head(url, allow_redirects=True, timeout=60) as response:
+        response.raise_for_status()
+        length = response.headers.get('Content-Length')
+        hashes = dict(value.strip().split('=', 1) for value in response.headers.get('x-goog-hash', '').split(',') if '=' in value)
+    return (None if length is None else int(length)), hashes.get('md5')
+
+def md5(path: str) -> str:
+    """The MD5 of a file in base64, as in the x-goog-hash header."""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode()
+
+def readable(path: str) -> bool:
+    """Check that rasterio can open the file and decode its last row, which catches truncated files."""
+    try:
+        with rio.open(path) as src:
+            src.read(1, window=Window(0, src.height - 1, src.width, 1))
+    except rio.errors.RasterioError:
+        return False
+    return True
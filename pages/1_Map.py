@@ -1,4 +1,4 @@
-from streamlit_app import sidebar, geography_changed
+from streamlit_app import sidebar, geography_changed, geolocation_data
 
 import streamlit as st
 import pydeck as pdk
@@ -41,8 +41,9 @@ def get_markers(file: Optional[str],
     def is_inside(location: Tuple[float, float], lat_range: Tuple[float, float], lon_range: Tuple[float, float]) -> bool:
         return (location[0] >= lat_range[0]) and (location[0] <= lat_range[1]) and (location[1] >= lon_range[0]) and (location[1] <= lon_range[1])
 
-    #locations=st.session_state.geolocation_data.loc[:, ['latitude', 'longitude']]
-    locations=list(zip(st.session_state.geolocation_data['latitude'], st.session_state.geolocation_data['longitude']))
+    #locations=geolocation_data().loc[:, ['latitude', 'longitude']]
+    data = geolocation_data()
+    locations=list(zip(data['latitude'], data['longitude']))
     markers = [create_marker_at(location) for location in locations if is_inside(location, lat_range, lon_range)]
     return markers
 
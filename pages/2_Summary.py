@@ -1,5 +1,5 @@
 import streamlit as st
-from streamlit_app import sidebar
+from streamlit_app import sidebar, asset_data, observation_data
 import numpy as np
 import altair as alt
 import matplotlib.pyplot as plt
@@ -15,17 +15,19 @@ st.write("""First, the asset data. Below are a few graphical representation of t
             showing informationa about the distribution of setors and subsectors of the assets, 
             capacity and number of sub-units of assets.""")
 
-country_count = st.session_state.asset_data.country.value_counts()
+observations = observation_data()
+
+country_count = asset_data().country.value_counts()
 st.write(country_count)
 
-st.write(st.session_state.observation_data.head(10))
+st.write(observations.head(10))
 
 # ----------------- BAR CHART OF SECTORS --------------
 
 st.subheader("Main sectors")
 st.write("The chosen area on the map has the following distribution of sectors:")
 
-top_sectors = st.session_state.observation_data.groupby('sector_main').uid_gem.count().reset_index().sort_values('uid_gem')
+top_sectors = observations.groupby('sector_main').uid_gem.count().reset_index().sort_values('uid_gem')
 
 fig1 = plt.figure(figsize=(5, 5))
 
@@ -39,7 +41,7 @@ st.pyplot(fig1, use_container_width=True)
 #--------------------------------------------------------------
 st.subheader("Most represented countries")
 
-top_countries = st.session_state.observation_data.groupby('country').uid_gem.count().reset_index().sort_values('uid_gem').tail(10)
+top_countries = observations.groupby('country').uid_gem.count().reset_index().sort_values('uid_gem').tail(10)
 
 fig2 = plt.figure(figsize=(5, 5))
 
@@ -60,7 +62,7 @@ def normalize_group(sector_main):
     return sector_main
 
 # Apply the function to each group
-normalized_data = st.session_state.observation_data.groupby('sector_main').apply(normalize_group).reset_index(drop = True)
+normalized_data = observations.groupby('sector_main').apply(normalize_group).reset_index(drop = True)
 
 fig = plt.figure(figsize=(5, 5))
 sns.kdeplot(data = normalized_data, x = 'capacity_norm', hue = 'sector_main')
@@ -1,7 +1,7 @@
 import streamlit as st
 import matplotlib.pyplot as plt
 
-from streamlit_app import sidebar, OBSERVATION_COLUMNS, ASSET_COLUMNS
+from streamlit_app import sidebar, observation_data, ASSET_COLUMNS
 
 
 
@@ -34,7 +34,7 @@ with st.expander('Assets associated with the most deforestation...'):
             sort_column = 'forward_3'
             period_columns = [sort_column]
 
-    assets_for_chosen_period = st.session_state.observation_data[ASSET_COLUMNS + period_columns].copy()
+    assets_for_chosen_period = observation_data()[ASSET_COLUMNS + period_columns].copy()
 
     block = st.slider("Select a block...", 
         0, len(assets_for_chosen_period), (0, 50), step=10)
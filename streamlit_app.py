@@ -8,41 +8,107 @@ import altair as alt
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
-from os.path import isfile, join
+from os.path import isfile, join, basename, getmtime
 
-from typing import Tuple, Optional, List
+from leaf.storage import read_arrow, to_arrow_file
+from leaf.schema import apply_schema
+
+from typing import NamedTuple, Tuple, Optional, List
 
 # Constants
 MIN_LAT, MAX_LAT, MIN_LON, MAX_LON = -90, 90, -180, 180
 DATA_PATH = 'data'
+ARROW_PATH = join(DATA_PATH, '.arrow') # memory-mapped copies of the files in DATA_PATH
 GEOLOCATION_COLUMNS = ['latitude', 'longitude']
 ASSET_COLUMNS = ['uid_gem', 'sector_main', 'country', 'capacity_first', 'owner_name', 'asset_name']
 OBSERVATION_COLUMNS = ['defo_total', 't_m3', 't_m2', 't_m1', 't_0', 't_1', 't_2', 't_3', 'around_3', 'around_5', 'forward_3', 'past_3']
+MOCK_DEFOR_SEED = 0 # the same mock_defor for every session
+MAX_SELECTIONS = 64 # the filtered row indices kept for all sessions
+MAX_DATASETS = 4 # the datasets kept in memory, including earlier versions of rewritten files
+
+class Selection(NamedTuple):
+    """The rows of a dataset a session looks at, which is all the session keeps of the data."""
+    path: str
+    separator: str
+    mtime: float # the modification time of the file the rows were selected from
+    lat_range: Tuple[float, float]
+    lon_range: Tuple[float, float]
+    rows: np.ndarray # read-only and shared by the sessions with the same filter, see select_rows
 
 #maps, sumstat, risk = st.tabs(["🌍 Map ", "📈 Summary statistics ", "💵 Risk index "])
 
-@st.cache_data # will hash on function arguments...
-def read_dataframe_from_csv(path, separator) -> Optional[pd.DataFrame]:
+@st.cache_resource(max_entries=MAX_DATASETS) # shared by all sessions without copying, so never modify the result
+def read_dataset(path: str, separator: str, mtime: float) -> Optional[pd.DataFrame]:
     try:
-        return pd.read_csv(path, sep = separator)
+        arrow = to_arrow_file(path, join(ARROW_PATH, f'{basename(path)}.feather'), separator, apply_schema)
+        # numeric columns without missing values stay views of the memory-mapped file
+        df = read_arrow(arrow).to_pandas(split_blocks=True)
     except:
         return None
+    if all(column in df.columns for column in GEOLOCATION_COLUMNS):
+        # TODO: remove mock_defor...?
+        df['mock_defor'] = np.random.default_rng(MOCK_DEFOR_SEED).random(len(df))
+    return df
 
-def update_data(df: pd.DataFrame, path: str, state = st.session_state):
+def read_dataframe_from_csv(path, separator) -> Optional[pd.DataFrame]:
+    if not isfile(path): return None
+    return read_dataset(path, separator, getmtime(path))
+
+@st.cache_resource(max_entries=MAX_SELECTIONS) # shared by all sessions, so never modify the result
+def select_rows(path: str, separator: str, mtime: float, lat_range: Tuple[float, float], lon_range: Tuple[float, float]) -> np.ndarray:
+    df = read_dataset(path, separator, mtime)
+    latitude, longitude = df['latitude'].to_numpy(), df['longitude'].to_numpy()
+    mask = ((latitude >= lat_range[0]) & (latitude <= lat_range[1]) &
+            (longitude >= lon_range[0]) & (longitude <= lon_range[1]))
+    rows = np.flatnonzero(mask).astype(np.int32)
+    rows.flags.writeable = False
+    return rows
+
+def update_data(df: pd.DataFrame, path: str, state = st.session_state, separator: str = '\t'):
     if all(column in df.columns for column in GEOLOCATION_COLUMNS):
         st.toast(f'The file {path} contains geolocation data...')
-        filtered_data = df[(df['latitude'] >= state.lat_range[0]) & (df['latitude'] <= state.lat_range[1]) & 
-                        (df['longitude'] >= state.lon_range[0]) & (df['longitude'] <= state.lon_range[1])].copy()
-        # TODO: remove mock_defor...?
-        filtered_data['mock_defor'] = np.random.rand(len(filtered_data))
-        state.geolocation_data = filtered_data
+        # the session keeps the filter and the rows in range, df is shared and stays unchanged
+        lat_range, lon_range = tuple(state.lat_range), tuple(state.lon_range)
+        mtime = getmtime(path)
+        rows = select_rows(path, separator, mtime, lat_range, lon_range)
+        state.selection = Selection(path, separator, mtime, lat_range, lon_range, rows)
         #state.map_layer.data = state.geolocation_data.head(30)
-        if all(column in state.geolocation_data.columns for column in ASSET_COLUMNS):
+        if all(column in df.columns for column in ASSET_COLUMNS):
             st.toast(f'The file {path} contains asset data...')
-            state.asset_data = state.geolocation_data
-            if all(column in state.asset_data.columns for column in OBSERVATION_COLUMNS):
+            if all(column in df.columns for column in OBSERVATION_COLUMNS):
                 st.toast(f'The file {path} contains observation data...')
-                state.observation_data = state.asset_data
+
+def selected_data(columns: List[str], state = st.session_state) -> pd.DataFrame:
+    """The selected rows of the dataset of the session, if it has the columns, else an empty frame with them.
+
+    The rows are copied for the caller, so the result can be modified, but not kept in
+    the session state.
+    """
+    selection = state.get('selection')
+    if selection is None or not isfile(selection.path):
+        return pd.DataFrame(columns=columns)
+    mtime = getmtime(selection.path)
+    df = read_dataset(selection.path, selection.separator, mtime)
+    if df is None or not all(column in df.columns for column in GEOLOCATION_COLUMNS + columns):
+        return pd.DataFrame(columns=columns)
+    if mtime != selection.mtime:
+        # the file was rewritten since the rows were selected, so select them again from df
+        rows = select_rows(selection.path, selection.separator, mtime, selection.lat_range, selection.lon_range)
+        selection = state.selection = selection._replace(mtime=mtime, rows=rows)
+    df = df.take(selection.rows)
+    # the categories of the whole dataset, see apply_schema, would be counted as 0 by value_counts and groupby
+    for column in df.columns[df.dtypes == 'category']:
+        df[column] = df[column].cat.remove_unused_categories()
+    return df
+
+def geolocation_data(state = st.session_state) -> pd.DataFrame:
+    return selected_data(GEOLOCATION_COLUMNS, state)
+
+def asset_data(state = st.session_state) -> pd.DataFrame:
+    return selected_data(GEOLOCATION_COLUMNS + ASSET_COLUMNS, state)
+
+def observation_data(state = st.session_state) -> pd.DataFrame:
+    return selected_data(GEOLOCATION_COLUMNS + ASSET_COLUMNS + OBSERVATION_COLUMNS, state)
 
 def file_changed(state = st.session_state): # state: SessionStateProxy
 